@@ -0,0 +1,88 @@
+"""
+Compare the speed of the tifffile codec implementations.
+
+Three paths are timed for `decodepackbits` and `unpackints`:
+
+c
+    the bundled C extension, `pyRafters.extern._tifffile`, if it was
+    built (``python setup.py build_ext --inplace``)
+fallback
+    the numpy / slice based versions used when the extension is missing
+python
+    the original pure-python loops
+
+Run as ``python benchmarks/bench_tifffile_codecs.py``.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import timeit
+import warnings
+
+import numpy as np
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    from pyRafters.extern import tifffile
+
+try:
+    from pyRafters.extern import _tifffile
+except ImportError:
+    _tifffile = None
+
+
+def _fallback(name):
+    # if the C function was swapped in, the python one is kept as __old_
+    return getattr(tifffile, '__old_' + name, getattr(tifffile, name))
+
+
+def _packbits_stream(n_bytes, literal, repeat, seed=0):
+    """
+    Make a valid PackBits stream of alternating literal and repeat runs
+    """
+    rs = np.random.RandomState(seed)
+    parts = []
+    for j in range(n_bytes // (literal + repeat)):
+        parts.append(bytes(bytearray([literal - 1])))
+        parts.append(rs.randint(0, 256, literal).astype(np.uint8).tobytes())
+        parts.append(bytes(bytearray([257 - repeat])))
+        parts.append(b'x')
+    return b''.join(parts)
+
+
+def _best_of(func, number=3, repeat=3):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def bench(n_bytes=2**20):
+    paths = [('c', _tifffile and _tifffile.decodepackbits,
+              _tifffile and _tifffile.unpackints),
+             ('fallback', _fallback('decodepackbits'),
+              _fallback('unpackints')),
+             ('python', tifffile._decodepackbits_py,
+              tifffile._unpackints_py)]
+
+    print("decodepackbits, %d bytes" % n_bytes)
+    for literal, repeat in ((128, 128), (64, 16), (3, 3)):
+        encoded = _packbits_stream(n_bytes, literal, repeat)
+        for name, func, _ in paths:
+            if func is None:
+                continue
+            print("  runs %3d/%3d %-9s %8.2f ms" % (
+                literal, repeat, name,
+                1e3 * _best_of(lambda: func(encoded))))
+
+    print("unpackints, %d bytes" % n_bytes)
+    data = np.random.RandomState(0).randint(
+        0, 256, n_bytes).astype(np.uint8).tobytes()
+    for itemsize, dtype in ((4, 'B'), (12, '=u2'), (24, '=u4')):
+        for name, _, func in paths:
+            if func is None:
+                continue
+            print("  %2d bit %-9s %8.2f ms" % (
+                itemsize, name,
+                1e3 * _best_of(lambda: func(data, dtype, itemsize, 1024),
+                               number=1, repeat=2)))
+
+
+if __name__ == '__main__':
+    bench()
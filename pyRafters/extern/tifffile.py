@@ -145,15 +145,22 @@ import json
 import struct
 import warnings
 import datetime
+import threading
 import collections
 from fractions import Fraction
 from xml.etree import cElementTree as ElementTree
 
 import numpy
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
 __version__ = '2014.02.05'
 __docformat__ = 'restructuredtext en'
-__all__ = ['imsave', 'imread', 'imshow', 'TiffFile', 'TiffSequence']
+__all__ = ['imsave', 'imread', 'imshow', 'TiffFile', 'TiffWriter',
+           'TiffSequence']
 
 
 def imsave(filename, data, photometric=None, planarconfig=None,
@@ -485,6 +492,394 @@ def imsave(filename, data, photometric=None, planarconfig=None,
                 tags = [t for t in tags if not t[-1]]
 
 
+class TiffWriter(object):
+    """Write image pages to a TIFF file as they arrive.
+
+    Image data are appended to the file as soon as a page is saved, so
+    only the page being written is held in memory. The strip offset and
+    byte count tables of each page are written next to its data. The
+    IFDs are written when the file is closed, ordered by page index,
+    which allows pages to be saved in any order.
+
+    By default the BigTIFF format is used only if the file would not fit
+    the 4 GB limit of the standard TIFF format. The first 16 bytes of
+    the file are reserved so either header fits.
+
+    Compressed strips are encoded in a pool of threads. The encoded
+    strips are appended to the file in order of saving, at the latest
+    when more than maxpending pages are waiting to be written.
+
+    Examples
+    --------
+    >>> with TiffWriter('temp.tif') as tif:
+    ...     for i in range(4):
+    ...         tif.save(numpy.random.rand(301, 219), index=3-i)
+
+    """
+    _TIFF_TYPES = {'B': 1, 's': 2, 'H': 3, 'I': 4, 'Q': 16}
+
+    _CODECS = {'deflate': 8, 'zlib': 8}
+
+    def __init__(self, filename, bigtiff=None, byteorder=None,
+                 software='tifffile.py', rowsperstrip=None, compress=0,
+                 codec='deflate', predictor=False, maxworkers=None,
+                 maxpending=None):
+        """Open file for writing.
+
+        Parameters
+        ----------
+        filename : str
+            Name of file to write.
+        bigtiff : bool or None
+            If True, the BigTIFF format is used, if False, the standard
+            TIFF format is used and IOError is raised on close if the
+            file is too large. By default (None) the format is chosen
+            on close.
+        byteorder : {'<', '>'}
+            The endianness of the data in the file.
+            By default this is the system's native byte order.
+        software : str
+            Name of the software used to create the image.
+            Saved with the first page only.
+        rowsperstrip : int
+            Number of image rows per strip. By default strips are
+            about 256 KB.
+        compress : int
+            Values from 0 to 9 controlling the level of compression.
+            If 0, data are written uncompressed (default).
+        codec : {'deflate', 'zlib'}
+            The compression scheme. Both names select Adobe deflate
+            (compression tag 8) using zlib.
+        predictor : bool
+            If True, apply horizontal differencing to integer data
+            before compression. Ignored if data are not compressed.
+        maxworkers : int
+            Maximum number of threads encoding strips. By default all
+            CPUs are used if data are compressed.
+        maxpending : int
+            Maximum number of saved pages waiting to be written.
+            By default twice the number of workers.
+
+        """
+        assert(byteorder in (None, '<', '>'))
+        assert(0 <= compress <= 9)
+        if compress and codec not in self._CODECS:
+            raise ValueError("codec not supported: %s" % codec)
+        if byteorder is None:
+            byteorder = '<' if sys.byteorder == 'little' else '>'
+        self._byteorder = byteorder
+        self._bigtiff = bigtiff
+        self._software = software
+        self._rowsperstrip = rowsperstrip
+        self._compress = compress
+        self._compression = self._CODECS[codec] if compress else 1
+        # the predictor is only applied when compressing
+        self._predictor = 2 if predictor and compress else 1
+        self._executor = None
+        if compress:
+            if maxworkers is None:
+                try:
+                    import multiprocessing
+                    maxworkers = multiprocessing.cpu_count()
+                except NotImplementedError:
+                    maxworkers = 1
+            if maxworkers > 1 and ThreadPoolExecutor is not None:
+                self._executor = ThreadPoolExecutor(maxworkers)
+        if maxpending is None:
+            maxpending = 2 * (maxworkers or 1)
+        self._maxpending = maxpending
+        # pages with strips being encoded, in order of saving
+        self._pending = collections.deque()
+        self.description = None
+        # page index -> description of that page
+        self._descriptions = {}
+        # page index -> (shape, dtype, photometric, compression, predictor,
+        #                rowsperstrip, strip offsets, strip byte counts)
+        self._pages = {}
+        self._fh = open(filename, 'wb')
+        # reserve room for a BigTIFF header
+        self._fh.write(b'\0' * 16)
+
+    def _pack(self, fmt, *val):
+        return struct.pack(self._byteorder + fmt, *val)
+
+    def save(self, data, index=None, photometric=None, description=None):
+        """Append image data as a new page.
+
+        Parameters
+        ----------
+        data : array_like
+            Input image of shape (height, width) or (height, width,
+            samples).
+        index : int
+            Position of the page in the file. By default one more than
+            the largest index saved so far. Saving the same index again
+            replaces the page.
+        photometric : {'minisblack', 'rgb'}
+            The color space of the image data. By default 'rgb' if the
+            image has 3 or 4 samples.
+        description : str or bytes
+            Image description of this page.  The description of the
+            first page is replaced by the `description` attribute if
+            that is set.
+
+        """
+        fh = self._fh
+        if fh is None:
+            raise IOError("TIFF file is not open")
+        data = data_in = numpy.asarray(data)
+        data = numpy.ascontiguousarray(
+            data, dtype=self._byteorder + data.dtype.char)
+        if data.ndim == 2:
+            data = data.reshape(data.shape + (1, ))
+        elif data.ndim != 3:
+            raise ValueError("data must be 2 or 3 dimensional")
+        if data.dtype.kind not in 'uifc':
+            raise ValueError("data type not supported: %s" % data.dtype)
+        if photometric is None:
+            photometric = 'rgb' if data.shape[-1] in (3, 4) else 'minisblack'
+        assert(photometric in ('minisblack', 'rgb'))
+        if photometric == 'rgb' and data.shape[-1] not in (3, 4):
+            raise ValueError("not a RGB(A) image")
+        if index is None:
+            index = max(self._pages) + 1 if self._pages else 0
+        if description is not None and not isinstance(description, bytes):
+            description = description.encode('utf-8')
+        if description:
+            self._descriptions[index] = description
+        else:
+            self._descriptions.pop(index, None)
+
+        if self._predictor > 1 and data.dtype.kind not in 'ui':
+            raise ValueError("predictor requires integer data")
+
+        rowbytes = data[0].nbytes
+        rowsperstrip = self._rowsperstrip
+        if not rowsperstrip:
+            rowsperstrip = max(1, 2**18 // max(rowbytes, 1))
+        rowsperstrip = min(rowsperstrip, data.shape[0])
+        record = [data.shape, data.dtype.char, photometric,
+                  self._compression, self._predictor, rowsperstrip]
+
+        if not self._compress:
+            # keep pages in order of saving
+            self._flush(0)
+            offset = fh.tell()
+            fh.write(data.data)
+            strip_offsets = range(offset, offset + data.nbytes,
+                                  rowsperstrip * rowbytes)
+            strip_byte_counts = [rowsperstrip * rowbytes] * len(
+                strip_offsets)
+            strip_byte_counts[-1] = data.nbytes - (
+                len(strip_offsets) - 1) * (rowsperstrip * rowbytes)
+            self._pages[index] = tuple(record + [
+                self._write_table(strip_offsets),
+                self._write_table(strip_byte_counts)])
+            return
+
+        if self._executor is not None and numpy.may_share_memory(
+                data, data_in):
+            # the caller may modify its array while strips are encoded
+            data = data.copy()
+        strips = [data[i:i+rowsperstrip]
+                  for i in range(0, data.shape[0], rowsperstrip)]
+        if self._executor is None:
+            encoded = [self._encode(strip) for strip in strips]
+        else:
+            encoded = [self._executor.submit(self._encode, strip)
+                       for strip in strips]
+        self._pending.append((index, record, encoded))
+        self._flush(self._maxpending)
+
+    def _encode(self, strip):
+        """Return compressed strip."""
+        if self._predictor > 1:
+            strip = strip.copy()
+            strip[:, 1:] -= strip[:, :-1].copy()
+        return zlib.compress(strip.tobytes(), self._compress)
+
+    def _flush(self, maxpending):
+        """Write encoded pages until at most maxpending pages are waiting.
+
+        Pages whose strips are all encoded are also written.
+
+        """
+        pending = self._pending
+        while pending:
+            index, record, encoded = pending[0]
+            if len(pending) <= maxpending and not all(
+                    e.done() for e in encoded if not isinstance(e, bytes)):
+                break
+            pending.popleft()
+            strip_offsets = []
+            strip_byte_counts = []
+            for strip in encoded:
+                if not isinstance(strip, bytes):
+                    strip = strip.result()
+                strip_offsets.append(self._fh.tell())
+                strip_byte_counts.append(len(strip))
+                self._fh.write(strip)
+            self._pages[index] = tuple(record + [
+                self._write_table(strip_offsets),
+                self._write_table(strip_byte_counts)])
+
+    def _write_table(self, values):
+        """Write strip table to file if needed, return (type, count, value).
+
+        Value is the integer itself for single entries, else the position
+        of the table in the file.
+
+        """
+        values = list(values)
+        typecode = 'I' if max(values) < 2**32 else 'Q'
+        if len(values) == 1:
+            return typecode, 1, values[0]
+        pos = self._fh.tell()
+        self._fh.write(self._pack('%i%s' % (len(values), typecode), *values))
+        return typecode, len(values), pos
+
+    def close(self):
+        """Write IFDs and header and close the file."""
+        fh = self._fh
+        if fh is None:
+            return
+        try:
+            self._flush(0)
+            self._write_ifds(fh)
+        finally:
+            self._fh = None
+            self._pending.clear()
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            fh.close()
+
+    def _write_ifds(self, fh):
+        """Write one IFD per page in order of page index and the header."""
+        description = self.description
+        if description is not None and not isinstance(description, bytes):
+            description = description.encode('utf-8')
+        pages = sorted(self._pages.items())
+
+        # estimate the size of the IFDs to decide on the file format
+        end = fh.tell() + 512 * (len(pages) + 1) + len(description or b'')
+        end += sum(len(d) for d in self._descriptions.values())
+        bigtiff = self._bigtiff
+        if bigtiff is None:
+            bigtiff = end >= 2**32 or any(
+                'Q' in (p[6][0], p[7][0]) for _, p in pages)
+        elif not bigtiff and end >= 2**32:
+            raise IOError("data too large for standard TIFF file")
+
+        if bigtiff:
+            offset_size, numtag_format, tag_format = 8, 'Q', 'HHQ8s'
+        else:
+            offset_size, numtag_format, tag_format = 4, 'H', 'HHI4s'
+        offset_format = {4: 'I', 8: 'Q'}[offset_size]
+        pack = self._pack
+        tiff_types = self._TIFF_TYPES
+
+        def addtag(tags, code, dtype, count, value):
+            # return IFD entry, out of line values are written to file
+            if dtype == 's':
+                value = value + b'\0'
+                count = len(value)
+                data = value
+            elif isinstance(value, (tuple, list)):
+                data = pack('%i%s' % (count, dtype), *value)
+            else:
+                data = pack(dtype, value)
+            if len(data) > offset_size:
+                pos = fh.tell()
+                fh.write(data)
+                data = pack(offset_format, pos)
+            tags.append((code, pack(tag_format, code, tiff_types[dtype],
+                                    count, data)))
+
+        next_ifd = 8 if bigtiff else 4
+        first = True
+        for index, page in pages:
+            (shape, dtype, photometric, compression, predictor, rowsperstrip,
+             strip_offsets, strip_byte_counts) = page
+            samples = shape[-1]
+            dtype = numpy.dtype(dtype)
+            tags = []
+            page_description = self._descriptions.get(index)
+            if first and description:
+                page_description = description
+            if page_description:
+                addtag(tags, 270, 's', 0, page_description)
+            if first:
+                if self._software:
+                    addtag(tags, 305, 's', 0,
+                           self._software.encode('ascii'))
+                addtag(tags, 306, 's', 0, datetime.datetime.now().strftime(
+                    "%Y:%m:%d %H:%M:%S").encode('ascii'))
+            addtag(tags, 254, 'I', 1, 0)
+            addtag(tags, 256, 'I', 1, shape[1])
+            addtag(tags, 257, 'I', 1, shape[0])
+            addtag(tags, 258, 'H', samples, (dtype.itemsize * 8, ) * samples
+                   if samples > 1 else dtype.itemsize * 8)
+            addtag(tags, 259, 'H', 1, compression)
+            addtag(tags, 262, 'H', 1,
+                   {'minisblack': 1, 'rgb': 2}[photometric])
+            for code, (typecode, count, value) in (
+                    (273, strip_offsets), (279, strip_byte_counts)):
+                if count == 1:
+                    addtag(tags, code, typecode, 1, value)
+                else:
+                    # the table was already written
+                    tags.append((code, pack(
+                        tag_format, code, tiff_types[typecode], count,
+                        pack(offset_format, value))))
+            addtag(tags, 277, 'H', 1, samples)
+            addtag(tags, 278, 'I', 1, rowsperstrip)
+            if samples > 1:
+                addtag(tags, 284, 'H', 1, 1)
+            if predictor > 1:
+                addtag(tags, 317, 'H', 1, predictor)
+            if photometric == 'rgb' and samples == 4:
+                addtag(tags, 338, 'H', 1, 1)  # alpha channel
+            elif photometric != 'rgb' and samples > 1:
+                addtag(tags, 338, 'H', samples - 1, (0, ) * (samples - 1))
+            sample_format = {'u': 1, 'i': 2, 'f': 3, 'c': 6}[dtype.kind]
+            addtag(tags, 339, 'H', samples, (sample_format, ) * samples
+                   if samples > 1 else sample_format)
+            # the entries in an IFD must be sorted in ascending order
+            tags.sort(key=lambda x: x[0])
+
+            pos = fh.tell()
+            if pos % 2:
+                # IFDs must begin on a word boundary
+                fh.write(b'\0')
+                pos += 1
+            fh.seek(next_ifd)
+            fh.write(pack(offset_format, pos))
+            fh.seek(pos)
+            fh.write(pack(numtag_format, len(tags)))
+            fh.write(b''.join(t[1] for t in tags))
+            next_ifd = fh.tell()
+            fh.write(pack(offset_format, 0))
+            first = False
+
+        if not bigtiff and fh.tell() >= 2**32:
+            raise IOError("data too large for standard TIFF file")
+        fh.seek(0)
+        fh.write({'<': b'II', '>': b'MM'}[self._byteorder])
+        if bigtiff:
+            fh.write(pack('HHH', 43, 8, 0))
+        else:
+            fh.write(pack('H', 42))
+        # the offset of the first IFD was patched in above
+        fh.seek(0, 2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 def imread(files, *args, **kwargs):
     """Return image data from TIFF file(s) as numpy array.
 
@@ -565,8 +960,8 @@ class TiffFile(object):
 
     Attributes
     ----------
-    pages : list
-        All TIFF pages in file.
+    pages : TiffPages
+        All TIFF pages in file. Pages are parsed when first accessed.
     series : list of Records(shape, dtype, axes, TiffPages)
         TIFF pages with compatible shapes and types.
     micromanager_metadata: dict
@@ -585,7 +980,7 @@ class TiffFile(object):
     ...     tif.close()
 
     """
-    def __init__(self, arg, name=None, multifile=False):
+    def __init__(self, arg, name=None, multifile=False, ifd_offsets=None):
         """Initialize instance from file.
 
         Parameters
@@ -597,6 +992,9 @@ class TiffFile(object):
             Human readable label of open file.
         multifile : bool
             If True, series may include pages from multiple files.
+        ifd_offsets : sequence of int
+            Positions of all IFDs in the file, e.g. from a previous scan
+            of the same file. If None, the chain of IFDs is followed.
 
         """
         if isinstance(arg, basestring):
@@ -609,6 +1007,8 @@ class TiffFile(object):
         self._fh.seek(0, 2)
         self._fsize = self._fh.tell()
         self._fh.seek(0)
+        # serializes seek and read of threads decoding or parsing pages
+        self._lock = threading.RLock()
         self.fname = os.path.basename(filename)
         self.fpath = os.path.dirname(filename)
         self._tiffs = {self.fname: self}  # cache of TiffFiles
@@ -616,7 +1016,7 @@ class TiffFile(object):
         self.pages = []
         self._multifile = bool(multifile)
         try:
-            self._fromfile()
+            self._fromfile(ifd_offsets)
         except Exception:
             self._fh.close()
             raise
@@ -629,8 +1029,8 @@ class TiffFile(object):
                 tif._fh = None
         self._tiffs = {}
 
-    def _fromfile(self):
-        """Read TIFF header and all page records from file."""
+    def _fromfile(self, ifd_offsets=None):
+        """Read TIFF header and the positions of all IFDs from file."""
         self._fh.seek(0)
         try:
             self.byteorder = {b'II': '<', b'MM': '>'}[self._fh.read(2)]
@@ -646,13 +1046,9 @@ class TiffFile(object):
             self.offset_size = 4
         else:
             raise ValueError("not a TIFF file")
-        self.pages = []
-        while True:
-            try:
-                page = TiffPage(self)
-                self.pages.append(page)
-            except StopIteration:
-                break
+        if ifd_offsets is None:
+            ifd_offsets = self._ifd_offsets()
+        self.pages = TiffPages(self, ifd_offsets)
         if not self.pages:
             raise ValueError("empty TIFF file")
 
@@ -753,7 +1149,49 @@ class TiffFile(object):
                       for s in shapes]
         return series
 
-    def asarray(self, key=None, series=None, memmap=False):
+    def _ifd_offsets(self):
+        """Return positions of all IFDs by following the chain of IFDs.
+
+        Only the number of tags and the offset to the next IFD are read.
+
+        """
+        fh = self._fh
+        byteorder = self.byteorder
+        offset_format, tagno_format, tag_size = {
+            4: ('I', 'H', 12), 8: ('Q', 'Q', 20)}[self.offset_size]
+        offset_format = byteorder + offset_format
+        tagno_format = byteorder + tagno_format
+        offset_size = self.offset_size
+        tagno_size = struct.calcsize(tagno_format)
+        fh.seek(8 if offset_size == 8 else 4)
+        offset = struct.unpack(offset_format, fh.read(offset_size))[0]
+        offsets = []
+        seen = set()
+        while offset:
+            if offset in seen or offset + tagno_size > self._fsize:
+                warnings.warn("corrupted page list")
+                break
+            seen.add(offset)
+            fh.seek(offset)
+            try:
+                numtags = struct.unpack(tagno_format,
+                                        fh.read(tagno_size))[0]
+                fh.seek(offset + tagno_size + numtags * tag_size)
+                next_offset = struct.unpack(offset_format,
+                                            fh.read(offset_size))[0]
+            except struct.error:
+                warnings.warn("corrupted page list")
+                break
+            offsets.append(offset)
+            offset = next_offset
+        return offsets
+
+    @property
+    def ifd_offsets(self):
+        """Positions of all IFDs in the file."""
+        return self.pages.offsets
+
+    def asarray(self, key=None, series=None, memmap=False, maxworkers=None):
         """Return image data of multiple TIFF pages as numpy array.
 
         By default the first image series is returned.
@@ -766,6 +1204,10 @@ class TiffFile(object):
             Defines which series of pages to return as array.
         memmap : bool
             If True, use numpy.memmap to read arrays from file if possible.
+        maxworkers : int
+            Maximum number of threads used to decode pages, or the strips
+            of a single page. By default (None), all CPUs are used if the
+            pages are compressed.
 
         """
         if key is None and series is None:
@@ -787,20 +1229,35 @@ class TiffFile(object):
             raise TypeError("key must be an int, slice, or sequence")
 
         if len(pages) == 1:
-            return pages[0].asarray(memmap=memmap)
-        elif self.is_nih:
-            result = numpy.vstack(
-                p.asarray(colormapped=False, squeeze=False, memmap=memmap)
-                for p in pages)
-            if pages[0].is_palette:
-                result = numpy.take(pages[0].color_map, result, axis=1)
-                result = numpy.swapaxes(result, 0, 1)
+            return pages[0].asarray(memmap=memmap, maxworkers=maxworkers)
+
+        firstpage = next(p for p in pages if p)
+        if maxworkers is None:
+            maxworkers = _default_maxworkers(firstpage)
+        if self.is_nih:
+            kwargs = dict(colormapped=False, squeeze=False)
+            pageshape, dtype = firstpage._shape, firstpage._dtype
         else:
-            if self.is_ome and any(p is None for p in pages):
-                firstpage = next(p for p in pages if p)
-                nopage = numpy.zeros_like(firstpage.asarray(memmap=memmap))
-            result = numpy.vstack((p.asarray(memmap=memmap) if p else nopage)
-                                  for p in pages)
+            kwargs = dict()
+            pageshape, dtype = firstpage.shape, firstpage.dtype
+        kwargs['memmap'] = memmap
+        result = numpy.empty((len(pages), ) + tuple(pageshape), dtype)
+
+        def decode(i):
+            page = pages[i]
+            if page:
+                page.asarray(out=result[i], **kwargs)
+            else:
+                # missing OME pages
+                result[i] = 0
+
+        _map_workers(decode, range(len(pages)), min(maxworkers, len(pages)))
+
+        if self.is_nih:
+            result.shape = (-1, ) + tuple(pageshape[1:])
+            if firstpage.is_palette:
+                result = numpy.take(firstpage.color_map, result, axis=1)
+                result = numpy.swapaxes(result, 0, 1)
         if key is None:
             try:
                 result.shape = self.series[series].shape
@@ -1030,33 +1487,39 @@ class TiffPage(object):
     All attributes are read-only.
 
     """
-    def __init__(self, parent):
-        """Initialize instance from file."""
+    def __init__(self, parent, index=None, offset=None):
+        """Initialize instance from file.
+
+        If offset is None, the file cursor must be at the storage position
+        of the IFD offset.
+
+        """
         self.parent = parent
-        self.index = len(parent.pages)
+        self.index = len(parent.pages) if index is None else index
         self.shape = self._shape = ()
         self.dtype = self._dtype = None
         self.axes = ""
         self.tags = TiffTags()
 
-        self._fromfile()
+        self._fromfile(offset)
         self._process_tags()
 
-    def _fromfile(self):
+    def _fromfile(self, offset=None):
         """Read TIFF IFD structure and its tags from file.
 
-        File cursor must be at storage position of IFD offset and is left at
-        offset to next IFD.
+        If offset is None, the file cursor must be at storage position of
+        IFD offset. The cursor is left at offset to next IFD.
 
-        Raises StopIteration if offset (first bytes read) is 0.
+        Raises StopIteration if offset is 0.
 
         """
         fh = self.parent._fh
         byteorder = self.parent.byteorder
         offset_size = self.parent.offset_size
 
-        fmt = {4: 'I', 8: 'Q'}[offset_size]
-        offset = struct.unpack(byteorder + fmt, fh.read(offset_size))[0]
+        if offset is None:
+            fmt = {4: 'I', 8: 'Q'}[offset_size]
+            offset = struct.unpack(byteorder + fmt, fh.read(offset_size))[0]
         if not offset:
             raise StopIteration()
 
@@ -1276,7 +1739,7 @@ class TiffPage(object):
                 self.bits_per_sample // 8)
 
     def asarray(self, squeeze=True, colormapped=True, rgbonly=True,
-                memmap=False):
+                memmap=False, out=None, maxworkers=1):
         """Read image data from file and return as numpy array.
 
         Raise ValueError if format is unsupported.
@@ -1294,9 +1757,18 @@ class TiffPage(object):
             If True, return RGB(A) image without additional extra samples.
         memmap : bool
             If True, use numpy.memmap to read array if possible.
+        out : numpy array
+            If given, the image data are written to this array, which must
+            have the shape of the returned array, and `out` is returned.
+            Strips are decoded directly into `out` if it is contiguous
+            and of native byte order.
+        maxworkers : int
+            Maximum number of threads used to decode strips or tiles.
+            If None, all CPUs are used if the page is compressed.
 
         """
         fh = self.parent._fh
+        lock = self.parent._lock
         if not fh:
             raise IOError("TIFF file is not open")
         if self.dtype is None:
@@ -1362,57 +1834,84 @@ class TiffPage(object):
                                 (not byteorder_is_native))):
                 result = numpy.memmap(fh, typecode, 'r', offsets[0], shape)
             else:
-                fh.seek(offsets[0])
-                result = numpy_fromfile(fh, typecode, numpy.prod(shape))
+                with lock:
+                    fh.seek(offsets[0])
+                    result = numpy_fromfile(fh, typecode, numpy.prod(shape))
                 result = result.astype('=' + dtype)
         else:
             if self.planar_configuration == 'contig':
                 runlen *= self.samples_per_pixel
-            if bits_per_sample in (8, 16, 32, 64, 128):
-                if (bits_per_sample * runlen) % 8:
-                    raise ValueError("data and sample size mismatch")
-
-                def unpack(x):
-                    return numpy.fromstring(x, typecode)
-            elif isinstance(bits_per_sample, tuple):
-                def unpack(x):
-                    return unpackrgb(x, typecode, bits_per_sample)
-            else:
-                def unpack(x):
-                    return unpackints(x, typecode, bits_per_sample, runlen)
+            unpack = self._unpacker(runlen)
             decompress = TIFF_DECOMPESSORS[self.compression]
+            if maxworkers is None:
+                maxworkers = _default_maxworkers(self)
+            maxworkers = min(maxworkers, len(offsets))
+
+            def read_segment(i):
+                with lock:
+                    fh.seek(offsets[i])
+                    return fh.read(byte_counts[i])
+
             if self.is_tiled:
                 result = numpy.empty(shape, dtype)
-                tw, tl, pl = 0, 0, 0
-                for offset, bytecount in zip(offsets, byte_counts):
-                    fh.seek(offset)
-                    tile = unpack(decompress(fh.read(bytecount)))
+                tiles_across = shape[-2] // tile_width
+                tiles_down = shape[-3] // tile_length
+
+                def decode_tile(i):
+                    tile = unpack(decompress(read_segment(i)))
                     tile.shape = tile_shape
                     if self.predictor == 'horizontal':
                         numpy.cumsum(tile, axis=-2, dtype=dtype, out=tile)
+                    pl, i = divmod(i, tiles_across * tiles_down)
+                    tl, tw = divmod(i, tiles_across)
+                    tl *= tile_length
+                    tw *= tile_width
                     result[0, pl, tl:tl+tile_length,
                            tw:tw+tile_width, :] = tile
-                    del tile
-                    tw += tile_width
-                    if tw >= shape[-2]:
-                        tw, tl = 0, tl + tile_length
-                        if tl >= shape[-3]:
-                            tl, pl = 0, pl + 1
+
+                _map_workers(decode_tile, range(len(offsets)), maxworkers)
                 result = result[..., :image_length, :image_width, :]
             else:
+                result = None
+                if (out is not None and out.flags.c_contiguous and
+                        out.dtype == numpy.dtype('=' + dtype) and
+                        out.size == numpy.prod(shape)):
+                    result = out.reshape(-1)
+                if result is None:
+                    result = numpy.empty(shape, dtype).reshape(-1)
                 strip_size = (self.rows_per_strip * self.image_width *
                               self.samples_per_pixel)
-                result = numpy.empty(shape, dtype).reshape(-1)
-                index = 0
-                for offset, bytecount in zip(offsets, byte_counts):
-                    fh.seek(offset)
-                    strip = fh.read(bytecount)
-                    strip = unpack(decompress(strip))
-                    size = min(result.size, strip.size, strip_size,
-                               result.size - index)
-                    result[index:index+size] = strip[:size]
-                    del strip
-                    index += size
+                plane_size = image_length * image_width * shape[-1]
+                strips_per_plane = ((image_length + self.rows_per_strip - 1)
+                                    // self.rows_per_strip)
+                if (plane_size and result.size % plane_size == 0 and
+                        len(offsets) == (result.size // plane_size *
+                                         strips_per_plane)):
+                    # strip i starts at a known position in the result
+                    strip_size = self.rows_per_strip * image_width * shape[-1]
+
+                    def decode_strip(i):
+                        plane, j = divmod(i, strips_per_plane)
+                        start = plane * plane_size + j * strip_size
+                        stop = min(start + strip_size,
+                                   (plane + 1) * plane_size)
+                        strip = unpack(decompress(read_segment(i)))
+                        size = min(strip.size, stop - start)
+                        result[start:start+size] = strip[:size]
+
+                    _map_workers(decode_strip, range(len(offsets)),
+                                 maxworkers)
+                else:
+                    # the position of a strip depends on the size of all
+                    # previous strips
+                    index = 0
+                    for i in range(len(offsets)):
+                        strip = unpack(decompress(read_segment(i)))
+                        size = min(result.size, strip.size, strip_size,
+                                   result.size - index)
+                        result[index:index+size] = strip[:size]
+                        del strip
+                        index += size
 
         result.shape = self._shape
 
@@ -1451,6 +1950,157 @@ class TiffPage(object):
                 warnings.warn("failed to reshape from %s to %s" % (
                     str(result.shape), str(self.shape)))
 
+        if out is not None:
+            if not numpy.may_share_memory(result, out):
+                out[...] = result
+            return out
+        return result
+
+    def _unpacker(self, runlen):
+        """Return function to convert decompressed bytes to samples.
+
+        runlen is the number of samples after which a new byte starts.
+
+        """
+        bits_per_sample = self.bits_per_sample
+        typecode = self.parent.byteorder + self._dtype
+        if bits_per_sample in (8, 16, 32, 64, 128):
+            if (bits_per_sample * runlen) % 8:
+                raise ValueError("data and sample size mismatch")
+
+            def unpack(x):
+                return numpy.fromstring(x, typecode)
+        elif isinstance(bits_per_sample, tuple):
+            def unpack(x):
+                return unpackrgb(x, typecode, bits_per_sample)
+        else:
+            def unpack(x):
+                return unpackints(x, typecode, bits_per_sample, runlen)
+        return unpack
+
+    def asarray_region(self, key, memmap=False):
+        """Read rectangular region of image data from file.
+
+        Only the strips or tiles intersecting the region are read and
+        decoded. Pages with more than one plane, palette-indexed or with
+        extra samples are read completely and cropped.
+
+        Parameters
+        ----------
+        key : tuple of two slices
+            The region along the Y and X axes.
+        memmap : bool
+            If True, return a view into a numpy.memmap if possible.
+
+        """
+        fh = self.parent._fh
+        if not fh:
+            raise IOError("TIFF file is not open")
+        ykey, xkey = key
+        length, width = self.image_length, self.image_width
+        ystart, ystop, ystep = ykey.indices(length)
+        xstart, xstop, xstep = xkey.indices(width)
+        samples = self.samples_per_pixel
+        if (self._dtype is None or self.is_palette or
+                self._shape[:2] != (1, 1) or
+                'extra_samples' in self.tags or
+                self.shape not in ((length, width),
+                                   (length, width, samples)) or
+                self.compression not in TIFF_DECOMPESSORS or
+                (self.is_lsm and self.predictor) or
+                ystep < 0 or xstep < 0 or
+                ystop <= ystart or xstop <= xstart):
+            result = self.asarray(memmap=memmap)
+            if result.shape[:2] == (length, width):
+                return result[ykey, xkey]
+            return result[..., ykey, xkey]
+
+        # decode whole strips or tiles covering the region
+        dtype = '=' + self._dtype
+        contiguous = self.is_contiguous
+        lock = self.parent._lock
+        if contiguous is not None:
+            rowsize = width * samples * numpy.dtype(dtype).itemsize
+            if memmap and self.parent.byteorder == (
+                    '<' if sys.byteorder == 'little' else '>'):
+                result = numpy.memmap(fh, dtype, 'r', contiguous[0],
+                                      (length, width, samples))
+                result = result[ystart:ystop]
+            else:
+                with lock:
+                    fh.seek(contiguous[0] + ystart * rowsize)
+                    result = numpy_fromfile(
+                        fh, self.parent.byteorder + self._dtype,
+                        (ystop - ystart) * width * samples)
+                result = result.astype(dtype)
+                result.shape = (ystop - ystart, width, samples)
+            top, left = ystart, 0
+        elif self.is_tiled:
+            tile_length, tile_width = self.tile_length, self.tile_width
+            tiles_across = (width + tile_width - 1) // tile_width
+            if 'tile_offsets' in self.tags:
+                offsets, byte_counts = (self.tile_offsets,
+                                        self.tile_byte_counts)
+            else:
+                offsets, byte_counts = (self.strip_offsets,
+                                        self.strip_byte_counts)
+            try:
+                offsets[0]
+            except TypeError:
+                offsets, byte_counts = (offsets, ), (byte_counts, )
+            unpack = self._unpacker(tile_width * samples)
+            decompress = TIFF_DECOMPESSORS[self.compression]
+            tl0, tl1 = ystart // tile_length, (ystop - 1) // tile_length + 1
+            tw0, tw1 = xstart // tile_width, (xstop - 1) // tile_width + 1
+            result = numpy.empty(((tl1 - tl0) * tile_length,
+                                  (tw1 - tw0) * tile_width, samples), dtype)
+            for tl in range(tl0, tl1):
+                for tw in range(tw0, tw1):
+                    index = tl * tiles_across + tw
+                    with lock:
+                        fh.seek(offsets[index])
+                        tile = fh.read(byte_counts[index])
+                    tile = unpack(decompress(tile))
+                    tile.shape = (tile_length, tile_width, samples)
+                    if self.predictor == 'horizontal':
+                        numpy.cumsum(tile, axis=-2, dtype=dtype, out=tile)
+                    y, x = (tl - tl0) * tile_length, (tw - tw0) * tile_width
+                    result[y:y+tile_length, x:x+tile_width] = tile
+            top, left = tl0 * tile_length, tw0 * tile_width
+        else:
+            rows_per_strip = min(self.rows_per_strip, length)
+            offsets, byte_counts = self.strip_offsets, self.strip_byte_counts
+            try:
+                offsets[0]
+            except TypeError:
+                offsets, byte_counts = (offsets, ), (byte_counts, )
+            unpack = self._unpacker(width * samples)
+            decompress = TIFF_DECOMPESSORS[self.compression]
+            s0 = ystart // rows_per_strip
+            s1 = min((ystop - 1) // rows_per_strip + 1, len(offsets))
+            top = s0 * rows_per_strip
+            nrows = min(s1 * rows_per_strip, length) - top
+            result = numpy.empty(nrows * width * samples, dtype)
+            index = 0
+            for strip in range(s0, s1):
+                with lock:
+                    fh.seek(offsets[strip])
+                    data = fh.read(byte_counts[strip])
+                data = unpack(decompress(data))
+                size = min(data.size, result.size - index,
+                           rows_per_strip * width * samples)
+                result[index:index+size] = data[:size]
+                index += size
+            result.shape = (nrows, width, samples)
+            if self.predictor == 'horizontal':
+                numpy.cumsum(result, axis=-2, dtype=dtype, out=result)
+            left = 0
+
+        result = result[ystart-top:ystop-top:ystep,
+                        xstart-left:xstop-left:xstep]
+        # match the axes of asarray
+        if len(self.shape) == 2:
+            result = result[..., 0]
         return result
 
     def __str__(self):
@@ -1492,6 +2142,35 @@ class TiffPage(object):
         """True if page contains tiled image."""
         return 'tile_width' in self.tags
 
+    @lazyattr
+    def is_contiguous(self):
+        """Return offset and size of image data if stored contiguously.
+
+        Return None unless the data are uncompressed and can be read as
+        is, i.e. asarray would return the bytes at offset reshaped to
+        shape, converted to native byte order.
+
+        """
+        if (self.is_tiled or self.compression or self.predictor or
+                self._dtype is None or not self._shape or self.is_palette or
+                'extra_samples' in self.tags or
+                self.bits_per_sample not in (8, 16, 32, 64)):
+            return None
+        offsets = self.strip_offsets
+        byte_counts = self.strip_byte_counts
+        try:
+            offsets[0]
+        except TypeError:
+            offsets = (offsets, )
+            byte_counts = (byte_counts, )
+        if not all(offsets[i] == offsets[i+1] - byte_counts[i]
+                   for i in range(len(offsets)-1)):
+            return None
+        nbytes = int(numpy.prod(self._shape)) * self.bits_per_sample // 8
+        if sum(byte_counts) < nbytes:
+            return None
+        return offsets[0], nbytes
+
     @lazyattr
     def is_reduced(self):
         """True if page is a reduced image of another image."""
@@ -1555,6 +2234,54 @@ class TiffPage(object):
         return 'micromanager_metadata' in self.tags
 
 
+class TiffPages(object):
+    """Sequence of TIFF pages, parsed when first accessed.
+
+    Attributes
+    ----------
+    offsets : list of int
+        Positions of the IFDs in the file.
+
+    """
+    def __init__(self, parent, offsets):
+        """Initialize instance from positions of IFDs in file."""
+        self.parent = parent
+        self.offsets = list(offsets)
+        self._pages = [None] * len(self.offsets)
+
+    def _getpage(self, index):
+        """Return page at index, parse its IFD if not done before."""
+        page = self._pages[index]
+        if page is None:
+            with self.parent._lock:
+                page = self._pages[index]
+                if page is None:
+                    page = TiffPage(self.parent, index=index,
+                                    offset=self.offsets[index])
+                    self._pages[index] = page
+        return page
+
+    def __len__(self):
+        """Return number of pages."""
+        return len(self.offsets)
+
+    def __getitem__(self, key):
+        """Return page or list of pages."""
+        if isinstance(key, slice):
+            return [self._getpage(i)
+                    for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("page index out of range")
+        return self._getpage(key)
+
+    def __iter__(self):
+        """Return iterator over pages."""
+        for i in range(len(self)):
+            yield self._getpage(i)
+
+
 class TiffTag(object):
     """A TIFF tag structure.
 
@@ -2148,8 +2875,39 @@ def read_micromanager_metadata(fh):
     return results
 
 
+def _default_maxworkers(page):
+    """Return number of threads to decode page, all CPUs if compressed."""
+    if ThreadPoolExecutor is None or not page.compression:
+        return 1
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def _map_workers(func, items, maxworkers):
+    """Call func for all items, in a pool of threads if maxworkers > 1.
+
+    Exceptions raised by func are re-raised.
+
+    """
+    if maxworkers is None or maxworkers < 2 or ThreadPoolExecutor is None:
+        for item in items:
+            func(item)
+        return
+    with ThreadPoolExecutor(maxworkers) as executor:
+        for result in executor.map(func, items):
+            pass
+
+
 def _replace_by(module_function, package=None, warn=True):
-    """Try replace decorated function by module.function."""
+    """Try replace decorated function by module.function.
+
+    If package is given, the module is first looked up in the package,
+    then as a top level module.
+
+    """
     try:
         from importlib import import_module
     except ImportError:
@@ -2157,15 +2915,19 @@ def _replace_by(module_function, package=None, warn=True):
         return lambda func: func
 
     def decorate(func, module_function=module_function, warn=warn):
-        try:
-            module, function = module_function.split('.')
-            if not package:
-                module = import_module(module)
-            else:
-                module = import_module('.' + module, package=package)
-            func, oldfunc = getattr(module, function), func
-            globals()['__old_' + func.__name__] = oldfunc
-        except Exception:
+        module, function = module_function.split('.')
+        candidates = [(module, None)]
+        if package:
+            candidates.insert(0, ('.' + module, package))
+        for name, pkg in candidates:
+            try:
+                func, oldfunc = (getattr(import_module(name, package=pkg),
+                                         function), func)
+                globals()['__old_' + func.__name__] = oldfunc
+                break
+            except Exception:
+                pass
+        else:
             if warn:
                 warnings.warn("failed to import %s" % module_function)
         return func
@@ -2173,12 +2935,37 @@ def _replace_by(module_function, package=None, warn=True):
     return decorate
 
 
-@_replace_by('_tifffile.decodepackbits')
+@_replace_by('_tifffile.decodepackbits', package=__package__, warn=False)
 def decodepackbits(encoded):
     """Decompress PackBits encoded byte string.
 
     PackBits is a simple byte-oriented run-length compression scheme.
 
+    The run headers must be parsed one after the other, but the bytes
+    of each run are copied with a single slice operation.
+
+    """
+    data = bytearray(encoded)
+    size = len(data)
+    result = bytearray()
+    i = 0
+    while i < size:
+        n = data[i] + 1
+        i += 1
+        if n < 129:
+            result += data[i:i+n]
+            i += n
+        elif n > 129:
+            result += data[i:i+1] * (258-n)
+            i += 1
+    return bytes(result)
+
+
+def _decodepackbits_py(encoded):
+    """Decompress PackBits encoded byte string.
+
+    Pure Python version of decodepackbits.
+
     """
     func = ord if sys.version[0] == '2' else lambda x: x
     result = []
@@ -2199,7 +2986,7 @@ def decodepackbits(encoded):
     return b''.join(result) if sys.version[0] == '2' else bytes(result)
 
 
-@_replace_by('_tifffile.decodelzw')
+@_replace_by('_tifffile.decodelzw', package=__package__)
 def decodelzw(encoded):
     """Decompress LZW (Lempel-Ziv-Welch) encoded TIFF strip (byte string).
 
@@ -2286,10 +3073,56 @@ def decodelzw(encoded):
     return b''.join(result)
 
 
-@_replace_by('_tifffile.unpackints')
+@_replace_by('_tifffile.unpackints', package=__package__, warn=False)
 def unpackints(data, dtype, itemsize, runlen=0):
     """Decompress byte string to array of integers of any bit size <= 32.
 
+    Parameters
+    ----------
+    data : byte str
+        Data to decompress.
+    dtype : numpy.dtype or str
+        A numpy boolean or integer type.
+    itemsize : int
+        Number of bits per integer.
+    runlen : int
+        Number of consecutive integers, after which to start at next byte.
+
+    """
+    if itemsize == 1 or itemsize in (8, 16, 32, 64):
+        return _unpackints_py(data, dtype, itemsize, runlen)
+    dtype = numpy.dtype(dtype)
+    if itemsize < 1 or itemsize > 32:
+        raise ValueError("itemsize out of range: %i" % itemsize)
+    if dtype.kind not in "biu":
+        raise ValueError("invalid dtype")
+
+    itembytes = next(i for i in (1, 2, 4, 8) if 8 * i >= itemsize)
+    if itembytes != dtype.itemsize:
+        raise ValueError("dtype.itemsize too small")
+    if runlen == 0:
+        runlen = len(data) * 8 // itemsize
+    skipbits = runlen*itemsize % 8
+    if skipbits:
+        skipbits = 8 - skipbits
+
+    # one row of bits per run, padding bits at the end of rows dropped
+    rowbits = runlen * itemsize + skipbits
+    bits = numpy.unpackbits(numpy.frombuffer(data, numpy.uint8))
+    rows = len(bits) // rowbits
+    bits = bits[:rows*rowbits].reshape(rows, rowbits)[:, :runlen*itemsize]
+    # left pad each integer to a multiple of 8 bits and pack to bytes
+    padded = numpy.zeros((rows * runlen, itembytes * 8), numpy.uint8)
+    padded[:, itembytes*8-itemsize:] = bits.reshape(-1, itemsize)
+    result = numpy.packbits(padded, axis=-1).view('>u%i' % itembytes)
+    return result.reshape(-1).astype(dtype)
+
+
+def _unpackints_py(data, dtype, itemsize, runlen=0):
+    """Decompress byte string to array of integers of any bit size <= 32.
+
+    Pure Python version of unpackints.
+
     Parameters
     ----------
     data : byte str
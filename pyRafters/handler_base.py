@@ -8,11 +8,14 @@ from __future__ import (absolute_import, division, print_function,
 
 import six
 import inspect
+import weakref
+import warnings
+from importlib import import_module
+from collections import defaultdict
 from six.moves import cPickle as pickle
 
 from six import with_metaclass
 from abc import ABCMeta, abstractmethod, abstractproperty
-from .utils import all_subclasses as _all_subclasses
 from functools import wraps
 import numpy as np
 
@@ -35,6 +38,241 @@ class RequireInactive(Exception):
     pass
 
 
+def _normalize_extension(ext):
+    """
+    Turn 'tif', '.tif', '*.tif', or 'path/to/a.tif' into 'tif'
+    """
+    return ext.rsplit('.', 1)[-1].lower()
+
+
+class HandlerRegistry(object):
+    """
+    An index of the handler classes by semantic base class and by the
+    file extensions they can deal with.
+
+    Every sub-class of `BaseDataHandler` is registered when the class
+    is created.  The registry only holds weak references, classes which
+    are garbage collected drop out of it.
+
+    Modules which provide handlers can be added with `add_plugin`,
+    along with the extensions and base classes of their handlers.  A
+    module is only imported when a query could match one of its
+    handlers.
+
+    >>> tif_sources = handler_registry.by_extension('*.tif', BaseSource)
+    """
+    def __init__(self):
+        # base class -> weak refs to the registered classes which
+        # derive from it
+        self._by_base = weakref.WeakKeyDictionary()
+        # extension -> weak refs to the registered classes which claim it
+        self._by_ext = defaultdict(list)
+        # (module name, extensions, bases) of modules which have not
+        # been imported yet
+        self._plugins = []
+        # caches for `available` and for query results
+        self._available = weakref.WeakKeyDictionary()
+        self._query_cache = dict()
+
+    def _forget(self, ref):
+        # a registered class was garbage collected
+        self._query_cache.clear()
+
+    def register(self, klass):
+        """
+        Add a class to the indices.
+
+        Parameters
+        ----------
+        klass : type
+            The handler class
+        """
+        ref = weakref.ref(klass, self._forget)
+        for base in klass.__mro__:
+            self._by_base.setdefault(base, []).append(ref)
+        # only FileHandler sub-classes know about extensions
+        try:
+            exts = klass.handler_extensions()
+        except AttributeError:
+            exts = ()
+        for ext in exts:
+            self._by_ext[_normalize_extension(ext)].append(ref)
+        self._query_cache.clear()
+
+    def add_plugin(self, module_name, extensions=None, bases=None):
+        """
+        Register a module which provides handlers.  The module is
+        imported by the first query which could match its handlers.
+
+        Parameters
+        ----------
+        module_name : str
+            Absolute name of the module
+
+        extensions : iterable of str or None, optional
+            The extensions claimed by handlers in the module, if None
+            the module is imported by any query
+
+        bases : iterable of type or None, optional
+            Classes every handler in the module derives from one of
+            (semantic base classes and mix-ins such as `FileHandler`),
+            if None the module is imported by any query
+        """
+        if extensions is not None:
+            extensions = set(_normalize_extension(e) for e in extensions)
+        if bases is not None:
+            bases = tuple(bases)
+        self._plugins.append((module_name, extensions, bases))
+        self._query_cache.clear()
+
+    def refresh(self):
+        """
+        Forget cached results of `available`.
+        """
+        self._available.clear()
+        self._query_cache.clear()
+
+    def _load_plugins(self, ext=None, base_handler=None):
+        """
+        Import the plugin modules which may provide handlers matching a
+        query
+        """
+        def wanted(plugin):
+            _, exts, bases = plugin
+            if ext is not None and exts is not None and ext not in exts:
+                return False
+            if base_handler is None or bases is None:
+                return True
+            # the module may hold sub-classes of `base_handler` if one
+            # of its bases is related to it
+            return any(issubclass(b, base_handler) or
+                       issubclass(base_handler, b) for b in bases)
+
+        to_load = [p for p in self._plugins if wanted(p)]
+        for plugin in to_load:
+            self._plugins.remove(plugin)
+        for module_name, _, _ in to_load:
+            try:
+                import_module(module_name)
+            except ImportError as e:
+                warnings.warn("failed to import {}: {}".format(module_name,
+                                                              e))
+
+    @staticmethod
+    def _live(refs):
+        """
+        Return the classes still alive, dropping the dead references
+        """
+        klasses = [r() for r in refs]
+        if None in klasses:
+            refs[:] = [r for r, k in zip(refs, klasses) if k is not None]
+            klasses = [k for k in klasses if k is not None]
+        return klasses
+
+    def _cached(self, key):
+        refs = self._query_cache.get(key)
+        if refs is None:
+            return None
+        ret = [r() for r in refs]
+        if None in ret:
+            return None
+        return ret
+
+    def _usable(self, klass):
+        try:
+            return self._available[klass]
+        except KeyError:
+            ret = (not inspect.isabstract(klass)) and klass.available()
+            self._available[klass] = ret
+            return ret
+
+    def handlers(self, base_handler):
+        """
+        Return the usable handlers which are sub-classes of
+        `base_handler`.
+
+        If `base_handler` is not abstract it is included, even if
+        it reports it is not available.
+
+        Parameters
+        ----------
+        base_handler : type
+            The base-class to find sub-classes of
+
+        Returns
+        -------
+        handlers : list of type
+        """
+        self._load_plugins(base_handler=base_handler)
+        key = (None, base_handler)
+        ret = self._cached(key)
+        if ret is not None:
+            return ret
+        ret = [h for h in self._live(self._by_base.get(base_handler, []))
+               if ((h is base_handler and not inspect.isabstract(h)) or
+                   self._usable(h))]
+        self._query_cache[key] = [weakref.ref(h) for h in ret]
+        return ret
+
+    def by_extension(self, ext, base_handler=None):
+        """
+        Return the usable handlers which claim the extension `ext`.
+
+        Parameters
+        ----------
+        ext : str
+            The extension, may be given as 'tif', '.tif', '*.tif', or
+            as a file name.
+
+        base_handler : type or None
+            If not None, only return sub-classes of this class
+
+        Returns
+        -------
+        handlers : list of type
+        """
+        ext = _normalize_extension(ext)
+        self._load_plugins(ext=ext, base_handler=base_handler)
+        key = (ext, base_handler)
+        ret = self._cached(key)
+        if ret is not None:
+            return ret
+        ret = [h for h in self._live(self._by_ext.get(ext, []))
+               if ((base_handler is None or issubclass(h, base_handler))
+                   and self._usable(h))]
+        self._query_cache[key] = [weakref.ref(h) for h in ret]
+        return ret
+
+    def extensions(self, base_handler=None):
+        """
+        Return the set of extensions claimed by usable handlers.
+
+        Parameters
+        ----------
+        base_handler : type or None
+            If not None, only consider sub-classes of this class
+
+        Returns
+        -------
+        exts : set of str
+        """
+        self._load_plugins(base_handler=base_handler)
+        return set(ext for ext in list(self._by_ext)
+                   if self.by_extension(ext, base_handler))
+
+
+handler_registry = HandlerRegistry()
+
+
+class _RegisteringABCMeta(ABCMeta):
+    """
+    Meta-class which adds every new handler class to `handler_registry`
+    """
+    def __init__(cls, name, bases, dct):
+        super(_RegisteringABCMeta, cls).__init__(name, bases, dct)
+        handler_registry.register(cls)
+
+
 def available_handler_list(base_handler, filter_list=None):
     """
     Returns a list of handlers which are sub-classes of `base_handler`.
@@ -59,19 +297,13 @@ def available_handler_list(base_handler, filter_list=None):
         Only return handlers which are a subclass of any of the
         elements in filter_list (OR logic).
     """
-    # grab the sub-classes
-    h_lst = []
-    # if base class is not abstract, keep it too
-    if not inspect.isabstract(base_handler):
-        h_lst.append(base_handler)
-    # yay recursion
-    _all_subclasses(base_handler, h_lst)
+    h_lst = handler_registry.handlers(base_handler)
     # list comprehension logic
     return [h for h in h_lst if filter_list is None or
             any(issubclass(h, filt) for filt in filter_list)]
 
 
-class BaseDataHandler(with_metaclass(ABCMeta, object)):
+class BaseDataHandler(with_metaclass(_RegisteringABCMeta, object)):
     """
     An ABC for all data source and sink objects.
 
@@ -416,6 +648,42 @@ class FrameSource(BaseSource):
         """
         raise KeyError()
 
+    def get_frame_metadata_column(self, key):
+        """
+        Returns the meta-data `key` for every frame.
+
+        The base implementation calls `get_frame_metadata` for each
+        frame, sub-classes which store frame-level meta-data by key
+        should override this.
+
+        Parameters
+        ----------
+        key : str
+            The meta-data key to extract
+
+        Returns
+        -------
+        values : ndarray or MaskedArray
+            One value per frame, masked where a frame has no value.
+            Raises `KeyError` if no frame has a value.
+        """
+        vals = []
+        mask = []
+        for n in range(len(self)):
+            try:
+                vals.append(self.get_frame_metadata(n, key))
+                mask.append(False)
+            except KeyError:
+                vals.append(None)
+                mask.append(True)
+        if all(mask):
+            raise KeyError(key)
+        if not any(mask):
+            return np.array(vals)
+        fill = next(v for v, m in zip(vals, mask) if not m)
+        return np.ma.MaskedArray([fill if m else v
+                                  for v, m in zip(vals, mask)], mask=mask)
+
     def get_metadata(self, key):
         """
         Returns meta-data for the set of frames (this is 'global' meta-data
@@ -444,6 +712,28 @@ class FrameSource(BaseSource):
         """
         pass
 
+    def get_frames(self, frame_nums):
+        """
+        Returns a stack of frames.
+
+        The base implementation calls `get_frame` for each frame,
+        sub-classes which can read many frames at once should override
+        this.
+
+        Parameters
+        ----------
+        frame_nums : slice or iterable of uint
+            The frames to extract
+
+        Returns
+        -------
+        frames : ndarray
+            The frames stacked along a new first axis
+        """
+        if isinstance(frame_nums, slice):
+            frame_nums = range(*frame_nums.indices(len(self)))
+        return np.array([self.get_frame(n) for n in frame_nums])
+
     def __getitem__(self, arg):
         """
         Defining __getitem__ is mandatory so that source[j] works
@@ -666,15 +956,21 @@ class TableSource(BaseSource):
     An ABC for sequences of tables
     """
     @abstractmethod
-    def read_table(self, table_name):
+    def read_table(self, table_name, columns=None, rows=None):
         """
-        Source a table
+        Source a table, or part of a table
 
         Parameters
         ----------
         table_name : str
             The name of the table to be retrieve
 
+        columns : list of str or None, optional
+            The fields to read, if None read all of them
+
+        rows : slice, iterable of int, or None, optional
+            The rows to read, if None read all of them
+
         Returns
         -------
         rec_array : ndarray with compound datatype
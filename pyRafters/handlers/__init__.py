@@ -1,7 +1,112 @@
+"""
+The handler modules are imported lazily, either when one of the names
+below is first accessed or when a `handler_registry` query could match
+one of their handlers.  A query by extension or by base class only
+imports the modules which provide handlers for it.  This keeps optional
+dependencies (scipy, h5py, ...) from being imported until they are
+needed.
+"""
 from __future__ import absolute_import
 
-from .csv_handler import csv_dist_source, csv_dist_sink
-from .np_handler import np_dist_source, np_dist_sink
-from .image_handler import scipy_imread_Handler
-from .tiff_handler import tifffile_read2D_Handler
-from .tiff_handler import tifffile_read3D_Handler
+import sys
+from importlib import import_module
+from types import ModuleType
+
+from ..handler_base import (handler_registry, BaseSource, BaseSink,
+                            DistributionSource, DistributionSink,
+                            FrameSource, FrameSink, ImageSource,
+                            TableSource, TableSink)
+from .base_file_handlers import FileHandler
+
+# modules in this package which provide handlers ->
+# (extensions claimed by their handlers, classes each handler derives
+# from one of).  Keep in sync with the modules, the registry uses it to
+# decide which modules a query needs.
+_handler_modules = {
+    'base_file_handlers': ({'png', 'pdf', 'svg', 'jpg'},
+                           (FileHandler, BaseSource, BaseSink)),
+    'csv_handler': ({'csv', 'txt'},
+                    (FileHandler, DistributionSource, DistributionSink,
+                     TableSource, TableSink)),
+    'np_handler': ((), (DistributionSource, DistributionSink,
+                        FrameSource, FrameSink)),
+    'npz_handler': ({'npz'},
+                    (FileHandler, DistributionSource, DistributionSink)),
+    'shm_handler': ((), (FrameSource, FrameSink)),
+    'image_handler': ({'bnp', 'jpeg', 'jpg', 'png', 'tiff'},
+                      (FileHandler, ImageSource)),
+    'tiff_handler': ({'stk', 'tif', 'tiff'},
+                     (FileHandler, FrameSource, FrameSink)),
+    'h5_handlers': ({'h5', 'hdf'},
+                    (FileHandler, FrameSource, FrameSink,
+                     TableSource, TableSink)),
+}
+
+# public name -> module which provides it
+_lazy_handlers = {'OpaqueFileSink': 'base_file_handlers',
+                  'OpaqueFigure': 'base_file_handlers',
+                  'OpaqueFileSource': 'base_file_handlers',
+                  'csv_dist_source': 'csv_handler',
+                  'csv_dist_sink': 'csv_handler',
+                  'csv_table_source': 'csv_handler',
+                  'csv_table_sink': 'csv_handler',
+                  'HdfFrameSource': 'h5_handlers',
+                  'HdfImageSource': 'h5_handlers',
+                  'HdfVolumeSource': 'h5_handlers',
+                  'HdfRawTomoData': 'h5_handlers',
+                  'HdfFrameSink': 'h5_handlers',
+                  'HdfImageSink': 'h5_handlers',
+                  'HdfVolumeSink': 'h5_handlers',
+                  'HdfTableSource': 'h5_handlers',
+                  'HdfTableSink': 'h5_handlers',
+                  'np_dist_source': 'np_handler',
+                  'np_dist_sink': 'np_handler',
+                  'np_frame_source': 'np_handler',
+                  'NPImageSource': 'np_handler',
+                  'NPFrameSink': 'np_handler',
+                  'NPImageSink': 'np_handler',
+                  'npz_dist_source': 'npz_handler',
+                  'npz_dist_sink': 'npz_handler',
+                  'SharedMemFrameSource': 'shm_handler',
+                  'SharedMemImageSource': 'shm_handler',
+                  'SharedMemFrameSink': 'shm_handler',
+                  'SharedMemImageSink': 'shm_handler',
+                  'scipy_imread_Handler': 'image_handler',
+                  'scipy_imread_sequence_Handler': 'image_handler',
+                  'tifffile_read2D_Handler': 'tiff_handler',
+                  'tifffile_read3D_Handler': 'tiff_handler',
+                  'tifffile_sequence_Handler': 'tiff_handler',
+                  'tifffile_Sink': 'tiff_handler'}
+
+for _mod, (_exts, _bases) in _handler_modules.items():
+    handler_registry.add_plugin(__name__ + '.' + _mod, extensions=_exts,
+                                bases=_bases)
+
+
+class _LazyModule(ModuleType):
+    """
+    The type of this package, resolves the lazy names on attribute
+    access.  A module subclass rather than a module level ``__getattr__``
+    (PEP 562) so that python < 3.7 is supported.
+    """
+    def __getattr__(self, name):
+        if name in _handler_modules:
+            return import_module('.' + name, __name__)
+        try:
+            mod = _lazy_handlers[name]
+        except KeyError:
+            raise AttributeError("module {!r} has no attribute {!r}".format(
+                __name__, name))
+        return getattr(import_module('.' + mod, __name__), name)
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_handler_modules) |
+                      set(_lazy_handlers))
+
+
+_module = _LazyModule(__name__, __doc__)
+_module.__dict__.update(globals())
+# python 2 clears the globals of a module when it is collected, keep the
+# original alive for the functions defined here
+_module._original = sys.modules[__name__]
+sys.modules[__name__] = _module
@@ -2,8 +2,18 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import six
-from ..handler_base import BaseSink, BaseSource
+from ..handler_base import BaseSink, BaseSource, require_active
 import os
+import re
+import glob
+import string
+import threading
+import numpy as np
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 
 
 class FileHandler(object):
@@ -113,11 +123,49 @@ class SequentialSetFileHandler(FileHandler):
 
     @property
     def base_path(self):
-        return self._path
+        return self._base_path
 
     def get_fname(self, n):
-        return os.path.join((self._base_path,
-                            self._format_str.format(n=n)))
+        return os.path.join(self._base_path,
+                            self._format_str.format(n=n))
+
+    def find_files(self):
+        """
+        Find the files on disk which match the format string
+
+        Returns
+        -------
+        files : list
+            (n, fname) pairs sorted by n
+        """
+        glob_parts = []
+        regex_parts = []
+        for literal, field, spec, conv in string.Formatter().parse(
+                self._format_str):
+            glob_parts.append(literal.replace('[', '[[]'))
+            regex_parts.append(re.escape(literal))
+            if field is None:
+                continue
+            if field != 'n':
+                raise ValueError("format_str may only use the field n")
+            glob_parts.append('*')
+            regex_parts.append(r'\s*(?P<n>-?\d+)')
+        pattern = ''.join(glob_parts)
+        regex = re.compile(''.join(regex_parts) + '$')
+        files = []
+        for fname in glob.glob(os.path.join(glob.escape(self._base_path)
+                                            if self._base_path else '',
+                                            pattern)):
+            rel = fname[len(os.path.join(self._base_path, '')):] \
+                if self._base_path else fname
+            match = regex.match(rel)
+            if match is None:
+                continue
+            n = int(match.group('n'))
+            # only keep names the format string would produce
+            if self._format_str.format(n=n) == rel:
+                files.append((n, fname))
+        return sorted(files)
 
     @property
     def kwarg_dict(self):
@@ -131,6 +179,147 @@ class SequentialSetFileHandler(FileHandler):
         return md
 
 
+class SequentialSetFileSource(SequentialSetFileHandler):
+    """
+    Mix-in class for sources with one frame per file of a sequential set.
+
+    The files are found when the handler is activated, frame `j` is the
+    file with the `j`-th smallest number.  Files are read in a pool of
+    threads, after a frame is requested the next `readahead` frames are
+    read in the background.
+
+    Sub-classes must implement `_read_file`.
+    """
+    def __init__(self, base_path=None, format_str=None, readahead=4,
+                 maxworkers=None, *args, **kwargs):
+        """
+        Parameters
+        ----------
+        base_path : str
+             base path for files
+
+        format_str : str
+            new-style format string with the single field `n`
+
+        readahead : int, optional
+            Number of frames read ahead of the last requested frame
+
+        maxworkers : int or None, optional
+            Number of threads reading files, defaults to `readahead`
+        """
+        super(SequentialSetFileSource, self).__init__(base_path=base_path,
+                                                      format_str=format_str,
+                                                      *args, **kwargs)
+        self._readahead = int(readahead)
+        self._maxworkers = maxworkers
+        self._files = None
+        self._executor = None
+        self._pending = dict()
+        self._lock = threading.Lock()
+
+    def activate(self):
+        super(SequentialSetFileSource, self).activate()
+        self._files = [fname for n, fname in self.find_files()]
+        maxworkers = self._maxworkers
+        if maxworkers is None:
+            maxworkers = self._readahead
+        if maxworkers > 0 and ThreadPoolExecutor is not None:
+            self._executor = ThreadPoolExecutor(maxworkers)
+
+    def deactivate(self):
+        if not self.active:
+            return
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            for future in self._pending.values():
+                future.cancel()
+            executor.shutdown()
+        self._pending.clear()
+        self._files = None
+        super(SequentialSetFileSource, self).deactivate()
+
+    def _read_file(self, fname):
+        """
+        Return the frame stored in `fname`, called from worker threads
+        """
+        raise NotImplementedError()
+
+    @property
+    @require_active
+    def files(self):
+        """
+        The files in the set, in frame order
+        """
+        return list(self._files)
+
+    @require_active
+    def __len__(self):
+        return len(self._files)
+
+    def _submit(self, n):
+        # caller holds the lock
+        future = self._pending.get(n)
+        if future is None:
+            future = self._executor.submit(self._read_file, self._files[n])
+            self._pending[n] = future
+        return future
+
+    @require_active
+    def get_frame(self, n):
+        if n < 0:
+            n += len(self._files)
+        if not 0 <= n < len(self._files):
+            raise IndexError("frame {} out of range".format(n))
+        if self._executor is None:
+            return self._read_file(self._files[n])
+        with self._lock:
+            future = self._submit(n)
+            # drop frames outside of the read ahead window
+            window = range(n, min(n + self._readahead + 1, len(self._files)))
+            for k in list(self._pending):
+                if k not in window:
+                    self._pending.pop(k).cancel()
+            for k in window:
+                self._submit(k)
+            del self._pending[n]
+        return future.result()
+
+    @require_active
+    def get_frames(self, frame_nums):
+        if isinstance(frame_nums, slice):
+            frame_nums = range(*frame_nums.indices(len(self._files)))
+        frame_nums = [n + len(self._files) if n < 0 else n
+                      for n in frame_nums]
+        if any(not 0 <= n < len(self._files) for n in frame_nums):
+            raise IndexError("frame out of range")
+        fnames = [self._files[n] for n in frame_nums]
+        if self._executor is None:
+            frames = (self._read_file(fname) for fname in fnames)
+        else:
+            frames = self._executor.map(self._read_file, fnames)
+        result = None
+        for j, frame in enumerate(frames):
+            if result is None:
+                result = np.empty((len(fnames), ) + frame.shape,
+                                  frame.dtype)
+            result[j] = frame
+        if result is None:
+            raise ValueError("no frames selected")
+        return result
+
+    @require_active
+    def __iter__(self):
+        for n in range(len(self._files)):
+            yield self.get_frame(n)
+
+    @property
+    def kwarg_dict(self):
+        md = super(SequentialSetFileSource, self).kwarg_dict
+        md['readahead'] = self._readahead
+        md['maxworkers'] = self._maxworkers
+        return md
+
+
 class OpaqueFileSink(SingleFileHandler, BaseSink):
     """
     That is an excessively complicated way to pass a path into
@@ -1,19 +1,83 @@
 """
-A set of sources and sinks for handling distributions saved as csv files
+A set of sources and sinks for handling distributions and tables saved
+as csv files
 """
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import six
 from ..handler_base import (DistributionSource,
                             DistributionSink,
+                            TableSource,
+                            TableSink,
                             require_active)
 from .base_file_handlers import SingleFileHandler
 
 
-from six.moves import zip
+from six.moves import zip, range
+import os
+import re
 import csv
+import itertools
 import numpy as np
 
+# rows parsed or formatted at a time
+_CHUNK_ROWS = 65536
+# csv options the vectorized path understands, any others go through
+# the csv module
+_FAST_KWARGS = {'delimiter', 'lineterminator'}
+_QUOTECHAR = '"'
+
+
+def _fast_ok(dtypes, csv_kwargs):
+    """
+    If columns of `dtypes` can be parsed/formatted with out the csv module
+    """
+    if not set(csv_kwargs) <= _FAST_KWARGS:
+        return False
+    return all(np.dtype(dt).kind in 'iuf' for dt in dtypes)
+
+
+def _parse_block(lines, dtypes, delimiter):
+    """
+    Parse a list of lines of numbers into one array per column
+    """
+    text = ''.join(lines)
+    if delimiter.strip():
+        text = text.replace(delimiter, ' ')
+    dtypes = [np.dtype(dt) for dt in dtypes]
+    n_cols = len(dtypes)
+    n_rows = sum(1 for ln in lines if ln.strip())
+    kinds = set(dt.kind for dt in dtypes)
+    if kinds == {'f'}:
+        # every float dtype round-trips through float64
+        common = np.float64
+    elif len(set(dtypes)) == 1:
+        common = dtypes[0]
+    else:
+        common = None
+    if common is not None:
+        flat = np.fromstring(text, dtype=common, sep=' ')
+    else:
+        # mixed ints and floats, do not risk int64 -> float64 -> int64
+        flat = np.array(text.split())
+    if len(flat) != n_rows * n_cols:
+        raise ValueError("rows do not all have {} numeric "
+                         "columns".format(n_cols))
+    return [flat[j::n_cols].astype(dt) for j, dt in enumerate(dtypes)]
+
+
+def _format_block(cols, delimiter, lineterminator):
+    """
+    Format columns of numbers as rows of text in one operation
+    """
+    n_rows = len(cols[0])
+    flat = [None] * (n_rows * len(cols))
+    for j, col in enumerate(cols):
+        # repr is the shortest text which round-trips
+        flat[j::len(cols)] = col.tolist()
+    row_fmt = delimiter.join(['%r'] * len(cols)) + lineterminator
+    return (row_fmt * n_rows) % tuple(flat)
+
 
 class csv_dist_source(SingleFileHandler, DistributionSource):
     """
@@ -41,25 +105,71 @@ class csv_dist_source(SingleFileHandler, DistributionSource):
             csv_kwargs = {}
         self._kwargs = csv_kwargs
         # caching
+        self._header = None
         self._edges = None
         self._vals = None
 
     def activate(self):
         super(csv_dist_source, self).activate()
+        # only read the header here, the data is read when first asked
+        # for or streamed with `iter_chunks`
         with open(self._fname, 'rt') as csv_file:
-            reader = csv.reader(csv_file, **self._kwargs)
-            header = next(reader)
+            self._header = self._read_header(csv_file)
+
+    def _read_header(self, csv_file):
+        return next(csv.reader([csv_file.readline()], **self._kwargs))
+
+    def _load(self):
+        if self._edges is None:
+            chunks = list(self.iter_chunks())
+            if chunks:
+                edges, vals = [np.concatenate(_) for _ in zip(*chunks)]
+            else:
+                edges, vals = [np.array([], dtype=dt)
+                               for dt in self._header]
+            self._edges = edges
+            self._vals = vals
 
-            edges, vals = [np.asarray(_, dtype=dt) for
-                           _, dt in zip(zip(*reader), header)]
-        self._edges = edges
-        self._vals = vals
+    @require_active
+    def iter_chunks(self, chunk_size=None):
+        """
+        Read the distribution a block of bins at a time, so memory use
+        does not grow with the number of bins.
+
+        Parameters
+        ----------
+        chunk_size : int or None, optional
+            Number of bins per block
+
+        Yields
+        ------
+        edges, vals : ndarray
+            The bin edges and values of consecutive blocks of bins
+        """
+        if chunk_size is None:
+            chunk_size = _CHUNK_ROWS
+        with open(self._fname, 'rt') as csv_file:
+            header = self._read_header(csv_file)
+            if _fast_ok(header, self._kwargs):
+                delimiter = self._kwargs.get('delimiter', ',')
+                while True:
+                    lines = list(itertools.islice(csv_file, chunk_size))
+                    if not lines:
+                        break
+                    yield tuple(_parse_block(lines, header, delimiter))
+            else:
+                reader = csv.reader(csv_file, **self._kwargs)
+                while True:
+                    rows = list(itertools.islice(reader, chunk_size))
+                    if not rows:
+                        break
+                    yield tuple(np.asarray(_, dtype=dt) for
+                                _, dt in zip(zip(*rows), header))
 
     def _clear_cache(self):
-        if hasattr(self, '_edges'):
-            del self._edges
-        if hasattr(self, '_vals'):
-            del self._vals
+        self._header = None
+        self._edges = None
+        self._vals = None
 
     def deactivate(self):
         super(csv_dist_source, self).deactivate()
@@ -68,16 +178,19 @@ class csv_dist_source(SingleFileHandler, DistributionSource):
     # distribution methods
     @require_active
     def values(self):
+        self._load()
         return self._vals
 
     @require_active
     def bin_edges(self, include_right=False):
         if include_right:
             raise NotImplementedError("don't support right kwarg yet")
+        self._load()
         return self._edges
 
     @require_active
     def bin_centers(self, include_right=False):
+        self._load()
         # if we have a right edge
         if len(self._edges) > len(self._vals):
             return self._edges[:-1] + np.diff(self._edges)
@@ -113,14 +226,48 @@ class csv_dist_sink(SingleFileHandler, DistributionSink):
     def write_dist(self, edges, vals, right_edge=False):
         if right_edge:
             raise NotImplementedError("don't support right edge yet")
+        self.write_dist_chunks([(edges, vals)])
+
+    @require_active
+    def write_dist_chunks(self, chunks):
+        """
+        Write a distribution given as blocks of bins.
+
+        The blocks are written as they are consumed, so a generator
+        can be used to write distributions which do not fit in memory.
+
+        Parameters
+        ----------
+        chunks : iterable
+            (edges, vals) pairs of consecutive blocks of bins, the
+            dtypes of the first block are written to the header
+        """
+        chunks = iter(chunks)
+        try:
+            edges, vals = next(chunks)
+        except StopIteration:
+            raise ValueError("no bins to write")
+        edges = np.asarray(edges)
+        vals = np.asarray(vals)
+        header = [str(edges.dtype), str(vals.dtype)]
         with open(self._fname, 'wt') as csv_file:
             writer = csv.writer(csv_file, **self._kwargs)
-            header = [str(edges.dtype),
-                             str(vals.dtype)]
-            print(type(header[0]))
             writer.writerow(header)
-            for line in zip(edges, vals):
-                writer.writerow(line)
+            if _fast_ok(header, self._kwargs):
+                delimiter = self._kwargs.get('delimiter', ',')
+                lineterminator = self._kwargs.get('lineterminator', '\r\n')
+                for edges, vals in itertools.chain([(edges, vals)], chunks):
+                    edges = np.asarray(edges)
+                    vals = np.asarray(vals)
+                    n = min(len(edges), len(vals))
+                    for start in range(0, n, _CHUNK_ROWS):
+                        stop = min(start + _CHUNK_ROWS, n)
+                        csv_file.write(_format_block(
+                            [edges[start:stop], vals[start:stop]],
+                            delimiter, lineterminator))
+            else:
+                for edges, vals in itertools.chain([(edges, vals)], chunks):
+                    writer.writerows(zip(edges, vals))
 
     @property
     def kwarg_dict(self):
@@ -136,3 +283,446 @@ class csv_dist_sink(SingleFileHandler, DistributionSink):
         return csv_dist_source(self.backing_file,
                                right=self._right,
                                csv_kwargs=self._kwargs)
+
+
+def _table_name(fname):
+    return os.path.splitext(os.path.basename(fname))[0]
+
+
+def _read_lines(csv_file, chunk_size):
+    """
+    Read up to `chunk_size` lines, plus however many are needed to close
+    a quoted field which spans lines
+    """
+    lines = list(itertools.islice(csv_file, chunk_size))
+    if lines and _QUOTECHAR in lines[-1]:
+        while sum(ln.count(_QUOTECHAR) for ln in lines) % 2:
+            ln = csv_file.readline()
+            if not ln:
+                break
+            lines.append(ln)
+    return lines
+
+
+def _split_block(lines, n_cols, csv_kwargs):
+    """
+    Split a list of csv lines into a (n_rows, n_cols) array of strings.
+
+    Unless the block contains quotes (or csv_kwargs sets dialect options
+    other than the delimiter) this is done with a handful of string
+    operations on the whole block.
+    """
+    delimiter = csv_kwargs.get('delimiter', ',')
+    text = ''.join(lines)
+    if not text.strip():
+        return np.empty((0, n_cols), dtype='U1')
+    if _QUOTECHAR in text or not set(csv_kwargs) <= _FAST_KWARGS:
+        rows = [r for r in csv.reader(text.splitlines(True), **csv_kwargs)
+                if r]
+        tokens = [t for r in rows if len(r) == n_cols for t in r]
+        n_rows = len(rows)
+    else:
+        text = text.replace('\r\n', '\n').strip('\n')
+        # drop blank lines
+        text = re.sub('\n\n+', '\n', text)
+        n_rows = text.count('\n') + 1
+        tokens = text.replace('\n', delimiter).split(delimiter)
+    if len(tokens) != n_rows * n_cols:
+        raise ValueError("rows do not all have {} columns".format(n_cols))
+    return np.array(tokens).reshape(n_rows, n_cols)
+
+
+def _infer_dtype(tokens):
+    """
+    Return the narrowest of int64, float64 or str which holds `tokens`
+    """
+    for dt in (np.int64, np.float64):
+        try:
+            tokens.astype(dt)
+        except ValueError:
+            continue
+        return np.dtype(dt)
+    return np.dtype(('U', max(1, tokens.dtype.itemsize // 4)))
+
+
+def _decode_bytes(rec_array):
+    """
+    Return `rec_array` with any bytes columns decoded to str
+    """
+    dtype = rec_array.dtype
+    if not any(dtype[n].kind == 'S' for n in dtype.names):
+        return rec_array
+    out = np.empty(rec_array.shape,
+                   dtype=[(n, ('U', dtype[n].itemsize)
+                           if dtype[n].kind == 'S' else dtype[n])
+                          for n in dtype.names])
+    for n in dtype.names:
+        col = rec_array[n]
+        out[n] = np.char.decode(col, 'utf-8') if col.dtype.kind == 'S' \
+            else col
+    return out
+
+
+def _format_table(rec_array, csv_kwargs):
+    """
+    Format the rows of a record array (with out bytes columns) as csv
+    text, or return None if any of the fields need quoting
+    """
+    if not set(csv_kwargs) <= _FAST_KWARGS:
+        return None
+    delimiter = csv_kwargs.get('delimiter', ',')
+    lineterminator = csv_kwargs.get('lineterminator', '\r\n')
+    cols = []
+    for name in rec_array.dtype.names:
+        col = rec_array[name]
+        if col.dtype.kind == 'f':
+            # repr is the shortest text which round-trips
+            cols.append([repr(_) for _ in col.tolist()])
+        else:
+            cols.append([six.text_type(_) for _ in col.tolist()])
+    text = ''.join(delimiter.join(r) + lineterminator for r in zip(*cols))
+    # fields which contain quotes, delimiters or line breaks need quoting
+    n = len(rec_array)
+    if (_QUOTECHAR in text or
+            text.count(delimiter) != n * (len(cols) - 1) or
+            text.count('\n') != n * lineterminator.count('\n') or
+            text.count('\r') != n * lineterminator.count('\r')):
+        return None
+    return text
+
+
+class csv_table_source(SingleFileHandler, TableSource):
+    """
+    A source for reading a table out of a csv file with a header row of
+    column names.
+
+    The file holds one table, named after the file.  Columns are parsed
+    a block of rows at a time, so large files can be read piece-wise
+    with `iter_rows` or `read_table` in bounded memory.
+    """
+    _extension_filters = {'csv',
+                          'txt'} | SingleFileHandler.handler_extensions()
+
+    def __init__(self, fname, table_name=None, dtype=None, infer_rows=None,
+                 csv_kwargs=None):
+        """
+        Parameters
+        ----------
+        fname : string
+            sufficiently qualified path to file to read
+
+        table_name : str or None, optional
+            Name of the table, defaults to the file name without the
+            extension
+
+        dtype : np.dtype, dict or None, optional
+            The compound dtype of the table, or a mapping of column name
+            to dtype.  Columns which are not given are inferred as
+            int64, float64 or str from the first `infer_rows` rows.
+
+        infer_rows : int or None, optional
+            Number of rows used to infer the column types
+
+        csv_kwargs : dict or None, optional
+            passed to `csv.reader`
+        """
+        super(csv_table_source, self).__init__(fname=fname)
+        if table_name is None:
+            table_name = _table_name(fname)
+        self._table_name = table_name
+        self._dtype_arg = dtype
+        self._infer_rows = infer_rows
+        if csv_kwargs is None:
+            csv_kwargs = {}
+        self._kwargs = csv_kwargs
+        self._dtype = None
+
+    def activate(self):
+        super(csv_table_source, self).activate()
+        infer_rows = self._infer_rows
+        if infer_rows is None:
+            infer_rows = _CHUNK_ROWS
+        with open(self._fname, 'rt') as csv_file:
+            names = next(csv.reader([csv_file.readline()], **self._kwargs))
+            names = [n.strip() for n in names]
+            given = self._dtype_arg
+            if given is None:
+                given = {}
+            elif isinstance(given, np.dtype):
+                given = dict((n, given[n]) for n in given.names)
+            missing = [n for n in names if n not in given]
+            if missing:
+                tokens = _split_block(_read_lines(csv_file, infer_rows),
+                                      len(names), self._kwargs)
+        fields = []
+        for j, n in enumerate(names):
+            if n in given:
+                dt = np.dtype(given[n])
+            else:
+                dt = _infer_dtype(tokens[:, j])
+            fields.append((n, dt))
+        self._dtype = np.dtype(fields)
+
+    def deactivate(self):
+        super(csv_table_source, self).deactivate()
+        self._dtype = None
+
+    @property
+    def kwarg_dict(self):
+        md = super(csv_table_source, self).kwarg_dict
+        md.update({'table_name': self._table_name,
+                   'dtype': self._dtype_arg,
+                   'infer_rows': self._infer_rows,
+                   'csv_kwargs': self._kwargs})
+        return md
+
+    @require_active
+    def table_keys(self):
+        return [self._table_name]
+
+    @property
+    def dtype(self):
+        """
+        The compound dtype of the table
+        """
+        return self._dtype
+
+    def _check_name(self, table_name):
+        if table_name != self._table_name:
+            raise KeyError("no table {!r} in {}".format(table_name,
+                                                        self._fname))
+
+    @require_active
+    def table_length(self, table_name):
+        """
+        The number of rows in a table
+
+        Parameters
+        ----------
+        table_name : str
+            The name of the table
+        """
+        return sum(len(b) for b in self.iter_rows(table_name, columns=[]))
+
+    @require_active
+    def iter_rows(self, table_name, chunk_size=None, columns=None):
+        """
+        Iterate through a table in blocks of rows.
+
+        Parameters
+        ----------
+        table_name : str
+            The name of the table
+
+        chunk_size : int or None, optional
+            Number of rows per block
+
+        columns : list of str or None, optional
+            The fields to read, if None read all of them
+
+        Yields
+        ------
+        block : ndarray
+            Consecutive rows of the table
+        """
+        self._check_name(table_name)
+        if chunk_size is None:
+            chunk_size = _CHUNK_ROWS
+        names = self._dtype.names
+        if columns is None:
+            columns = names
+        for c in columns:
+            if c not in names:
+                raise KeyError("no column {!r} in {}".format(c,
+                                                             table_name))
+        col_idx = [names.index(c) for c in columns]
+        out_dtype = np.dtype([(c, self._dtype[c]) for c in columns])
+        with open(self._fname, 'rt') as csv_file:
+            # skip the header
+            csv_file.readline()
+            while True:
+                lines = _read_lines(csv_file, chunk_size)
+                if not lines:
+                    break
+                tokens = _split_block(lines, len(names), self._kwargs)
+                block = np.empty(len(tokens), dtype=out_dtype)
+                for c, j in zip(columns, col_idx):
+                    col = tokens[:, j]
+                    dt = out_dtype[c]
+                    if (dt.kind == 'U' and col.dtype.itemsize > dt.itemsize
+                            and np.char.str_len(col).max() > dt.itemsize // 4):
+                        raise ValueError(
+                            "values of column {!r} are longer than {}, pass "
+                            "its dtype to the source".format(c, dt))
+                    block[c] = col
+                yield block
+
+    @require_active
+    def read_table(self, table_name, columns=None, rows=None):
+        if (isinstance(rows, slice) and (rows.step is None or rows.step > 0)
+                and (rows.start is None or rows.start >= 0)
+                and rows.stop is not None and rows.stop >= 0):
+            # only parse as far as needed
+            out = []
+            n = 0
+            for block in self.iter_rows(table_name, columns=columns):
+                out.append(block)
+                n += len(block)
+                if n >= rows.stop:
+                    break
+        else:
+            out = list(self.iter_rows(table_name, columns=columns))
+        if out:
+            data = np.concatenate(out)
+        else:
+            names = self._dtype.names if columns is None else columns
+            data = np.empty(0, dtype=[(c, self._dtype[c]) for c in names])
+        if rows is None:
+            return data
+        if isinstance(rows, slice):
+            return data[rows]
+        idx = np.asarray(rows, dtype=np.intp).ravel()
+        if np.any((idx < -len(data)) | (idx >= len(data))):
+            raise IndexError("row index out of range")
+        return data[idx]
+
+
+class csv_table_sink(SingleFileHandler, TableSink):
+    """
+    A sink for writing a table to a csv file with a header row of column
+    names.
+
+    In append mode each call to `write_table` adds rows to the end of the
+    file (which may already exist).  Rows are buffered and formatted a
+    block at a time.  Otherwise each call replaces the table.
+    """
+    _extension_filters = {'csv',
+                          'txt'} | SingleFileHandler.handler_extensions()
+
+    def __init__(self, fname, table_name=None, append=False,
+                 chunk_rows=None, csv_kwargs=None):
+        """
+        Parameters
+        ----------
+        fname : string
+            sufficiently qualified path to file to write
+
+        table_name : str or None, optional
+            Name of the table, defaults to the file name without the
+            extension
+
+        append : bool, optional
+            If `write_table` appends to the table
+
+        chunk_rows : int or None, optional
+            Number of rows to buffer before writing
+
+        csv_kwargs : dict or None, optional
+            passed to `csv.writer`
+        """
+        super(csv_table_sink, self).__init__(fname=fname)
+        if table_name is None:
+            table_name = _table_name(fname)
+        self._table_name = table_name
+        self._append = bool(append)
+        self._chunk_rows = chunk_rows
+        if csv_kwargs is None:
+            csv_kwargs = {}
+        self._kwargs = csv_kwargs
+        self._buffer = [[], 0]
+        self._dtype = None
+
+    @property
+    def kwarg_dict(self):
+        md = super(csv_table_sink, self).kwarg_dict
+        md.update({'table_name': self._table_name,
+                   'append': self._append,
+                   'chunk_rows': self._chunk_rows,
+                   'csv_kwargs': self._kwargs})
+        return md
+
+    def activate(self):
+        if self.active:
+            # if already active, no-op
+            return
+        super(csv_table_sink, self).activate()
+        self._buffer = [[], 0]
+
+    def deactivate(self):
+        if not self.active:
+            return
+        try:
+            self._flush()
+        finally:
+            super(csv_table_sink, self).deactivate()
+
+    def _header(self):
+        """
+        The column names of the table already in the file, or None
+        """
+        if not os.path.exists(self._fname):
+            return None
+        with open(self._fname, 'rt') as csv_file:
+            line = csv_file.readline()
+        if not line.strip():
+            return None
+        names = next(csv.reader([line], **self._kwargs))
+        return tuple(n.strip() for n in names)
+
+    def _flush(self, replace=False):
+        bufs, n_rows = self._buffer
+        self._buffer = [[], 0]
+        if not bufs:
+            return
+        rows = np.concatenate(bufs)
+        names = None if replace else self._header()
+        if names is not None and names != rows.dtype.names:
+            raise ValueError("columns {} do not match table {}".format(
+                rows.dtype.names, names))
+        with open(self._fname, 'wt' if names is None else 'at') as csv_file:
+            writer = csv.writer(csv_file, **self._kwargs)
+            if names is None:
+                writer.writerow(rows.dtype.names)
+            for start in range(0, len(rows), _CHUNK_ROWS):
+                block = _decode_bytes(rows[start:start + _CHUNK_ROWS])
+                text = _format_table(block, self._kwargs)
+                if text is None:
+                    # needs quoting, let the csv module do it
+                    writer.writerows(block.tolist())
+                else:
+                    csv_file.write(text)
+
+    @require_active
+    def write_table(self, rec_array, table_name):
+        if table_name != self._table_name:
+            raise ValueError("this sink only holds the table {!r}".format(
+                self._table_name))
+        rec_array = np.atleast_1d(np.asarray(rec_array))
+        if rec_array.ndim != 1 or rec_array.dtype.names is None:
+            raise ValueError("tables must be 1D with a compound dtype")
+        if not self._append:
+            self._buffer = [[rec_array], len(rec_array)]
+            self._flush(replace=True)
+            self._dtype = rec_array.dtype
+            return
+        bufs = self._buffer[0]
+        if bufs and bufs[0].dtype.names != rec_array.dtype.names:
+            raise ValueError("columns {} do not match table {}".format(
+                rec_array.dtype.names, bufs[0].dtype.names))
+        bufs.append(rec_array)
+        self._buffer[1] += len(rec_array)
+        self._dtype = rec_array.dtype
+        chunk_rows = self._chunk_rows
+        if chunk_rows is None:
+            chunk_rows = _CHUNK_ROWS
+        if self._buffer[1] >= chunk_rows:
+            self._flush()
+
+    def make_source(self, klass=None):
+        if klass is not None:
+            raise NotImplementedError("don't support this yet")
+
+        return csv_table_source(self.backing_file,
+                                table_name=self._table_name,
+                                dtype=self._dtype,
+                                csv_kwargs=self._kwargs)
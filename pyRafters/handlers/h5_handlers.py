@@ -1,22 +1,87 @@
+"""
+Sources and sinks backed by hdf5 files.
+
+Frame stacks are stored as a single chunked (and optionally compressed)
+dataset with the frame axis first.  The frame axis is resizable so
+sinks do not need to know the number of frames up front.  Set-level
+meta-data is stored as a group written by `MD_dict.write_hdf`.
+Frame-level meta-data is stored as JSON in a byte dataset with a
+second dataset holding the (offset, length) of the entry of each frame.
+
+Frame sources and sinks can use the single-writer/multiple-reader
+(SWMR) mode of hdf5 so that sources in other processes see frames as
+they are written.  In SWMR mode no objects can be added to the file
+once writing has started, so set-level meta-data must be set before the
+first frame is recorded.
+"""
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import six
+import json
+import time
+from six.moves import range
 import h5py
 
 from .base_file_handlers import SingleFileHandler
 from ..handler_base import (TableSource,
                             TableSink,
+                            FrameSource,
+                            FrameSink,
+                            ImageSource,
+                            ImageSink,
+                            VolumeSource,
+                            RawTomoData,
                             require_active)
+from ..utils import MD_dict, LazyMD_dict, md_value
 
 from six.moves import zip
 import csv
 import numpy as np
 
+# aim for chunks of about this many bytes, small enough that a chunk
+# being filled frame-by-frame stays in the default chunk cache (1 MiB)
+_CHUNK_BYTES = 512 * 1024
+
+# suffixes of the meta-data objects stored next to a frame dataset
+_MD_SUFFIX = '_md'
+_FRAME_MD_SUFFIX = '_frame_md'
+_FRAME_MD_INDEX_SUFFIX = '_frame_md_index'
+# chunk length of the frame meta-data bytes
+_FRAME_MD_CHUNK = 64 * 1024
+
+try:
+    TimeoutError = TimeoutError
+except NameError:
+    # python 2
+    class TimeoutError(OSError):
+        pass
+
+
+def _default_chunks(frame_shape, dtype):
+    """
+    Chunk shape holding as many whole frames as fit in `_CHUNK_BYTES`.
+
+    Frames larger than that are stored one frame per chunk.
+    """
+    frame_bytes = max(int(np.prod(frame_shape)) * np.dtype(dtype).itemsize, 1)
+    n = max(_CHUNK_BYTES // frame_bytes, 1)
+    return (n, ) + tuple(frame_shape)
+
+
+def _json_default(obj):
+    # numpy values in the frame meta-data
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return six.text_type(obj)
+
+
 class BaseHdf(SingleFileHandler):
     _extension_filters = set(('h5', 'hdf'))
 
-    def __init__(self, base_group_name=None, h5_kwargs=None,
+    def __init__(self, base_group_name=None, h5_kwargs=None, swmr=False,
                  *args, **kwargs):
         # pass up the call stack
         super(BaseHdf, self).__init__(*args, **kwargs)
@@ -30,6 +95,8 @@ class BaseHdf(SingleFileHandler):
         self._group_name = base_group_name
         # the kwargs to pass to the File call
         self._h5_kwargs = h5_kwargs
+        # single-writer/multiple-reader mode
+        self._swmr = bool(swmr)
 
         # place holders for file and group objects
         self._group = None
@@ -43,15 +110,40 @@ class BaseHdf(SingleFileHandler):
         except AttributeError:
             md = dict()
         md['base_group_name'] = self._group_name
-        md['h5_kwarg'] = self._h5_kwargs
+        md['h5_kwargs'] = self._h5_kwargs
+        md['swmr'] = self._swmr
         return md
 
+    @property
+    def swmr(self):
+        """
+        If the file is opened in single-writer/multiple-reader mode
+        """
+        return self._swmr
+
     def activate(self):
         if self._group is not None or self._File is not None:
             raise RuntimeError("partially or fully initialized, can't re-run")
 
-        self._File = h5py.File(self.backing_file, **self._h5_kwargs)
-        self._group = self._File.ensure_group(self._group_name)
+        h5_kwargs = dict(self._h5_kwargs)
+        if self._swmr:
+            if h5_kwargs.get('mode', 'r') == 'r':
+                h5_kwargs['swmr'] = True
+            else:
+                # writers need the new file format, SWMR mode itself is
+                # switched on by the sub-class once the datasets exist
+                h5_kwargs.setdefault('libver', 'latest')
+        self._File = h5py.File(self.backing_file, **h5_kwargs)
+        try:
+            if self._group_name:
+                self._group = self._File.require_group(self._group_name)
+            else:
+                self._group = self._File
+        except Exception:
+            self._File.close()
+            self._File = None
+            raise
+        super(BaseHdf, self).activate()
 
     def deactivate(self):
         if self._group is not None:
@@ -61,19 +153,809 @@ class BaseHdf(SingleFileHandler):
             self._File.close()
             del self._File
             self._File = None
+        super(BaseHdf, self).deactivate()
+
+
+class HdfFrameSource(BaseHdf, FrameSource):
+    """
+    A source for a stack of frames stored in a single hdf5 dataset with
+    the frame axis first.
+
+    Batched reads (`get_frames`, slicing, iteration) are done as
+    hyperslabs aligned to the chunks of the dataset so that every chunk
+    is read and decompressed at most once per call.
+
+    In SWMR mode the source follows a file which is still being written,
+    the length grows as the writer adds frames.  Use `wait_for_frame` to
+    block until a frame is available.
+    """
+    def __init__(self, fname, dset_name='frames', frame_dim=None,
+                 base_group_name=None, h5_kwargs=None, swmr=False,
+                 resolution=None, resolution_units=None):
+        """
+        Parameters
+        ----------
+        fname : str
+            Absolute path to file
+
+        dset_name : str, optional
+            Name of the frame dataset in the base group
+
+        frame_dim : int or None, optional
+            Dimension of a single frame, if given the dataset must
+            have ``frame_dim + 1`` dimensions
+
+        base_group_name : str or None, optional
+            Group in the file to work in, defaults to the root group
+
+        h5_kwargs : dict or None, optional
+            Passed through to `h5py.File`, defaults to read-only
+
+        swmr : bool, optional
+            Open the file as a SWMR reader, to follow a file which is
+            being written by a SWMR sink
+        """
+        if h5_kwargs is None:
+            h5_kwargs = {'mode': 'r'}
+        super(HdfFrameSource, self).__init__(
+            fname=fname, base_group_name=base_group_name,
+            h5_kwargs=h5_kwargs, swmr=swmr, resolution=resolution,
+            resolution_units=resolution_units)
+        self._dset_name = dset_name
+        self._frame_dim = frame_dim
+        self._dset = None
+        self._md = None
+        self._frame_md = None
+        self._frame_md_index = None
+
+    @property
+    def kwarg_dict(self):
+        md = super(HdfFrameSource, self).kwarg_dict
+        md.update({'dset_name': self._dset_name,
+                   'frame_dim': self._frame_dim})
+        return md
+
+    def activate(self):
+        super(HdfFrameSource, self).activate()
+        try:
+            dset = self._group[self._dset_name]
+            if (self._frame_dim is not None and
+                    dset.ndim != self._frame_dim + 1):
+                raise ValueError(("dataset has {} dimensions, expected "
+                                  "{}").format(dset.ndim,
+                                               self._frame_dim + 1))
+        except Exception:
+            self.deactivate()
+            raise
+        self._dset = dset
+        md_name = self._dset_name + _MD_SUFFIX
+        if md_name in self._group:
+            self._md = LazyMD_dict.read_hdf_group(self._group[md_name])
+        else:
+            self._md = MD_dict()
+        self._frame_md = self._group.get(self._dset_name + _FRAME_MD_SUFFIX)
+        self._frame_md_index = self._group.get(self._dset_name +
+                                               _FRAME_MD_INDEX_SUFFIX)
+        # number of frames per batched read
+        if dset.chunks is not None:
+            self._block = dset.chunks[0]
+        else:
+            self._block = _default_chunks(dset.shape[1:], dset.dtype)[0]
+
+    def deactivate(self):
+        self._dset = None
+        self._md = None
+        self._frame_md = None
+        self._frame_md_index = None
+        super(HdfFrameSource, self).deactivate()
+
+    @require_active
+    def refresh(self):
+        """
+        Pick up frames written since the last refresh.
+
+        Only needed (and only does anything) in SWMR mode.  `len` and
+        the access methods refresh as needed.
+        """
+        if not self._swmr:
+            return
+        for dset in (self._frame_md, self._frame_md_index, self._dset):
+            if dset is not None:
+                dset.refresh()
+
+    @require_active
+    def wait_for_frame(self, n, timeout=None, poll=0.05):
+        """
+        Block until frame `n` has been written and return it.
+
+        Parameters
+        ----------
+        n : int
+            The frame to wait for
+
+        timeout : float or None, optional
+            Give up after this many seconds, wait forever if None
+
+        poll : float, optional
+            Seconds between checks of the file
+
+        Returns
+        -------
+        frame : ndarray
+            Frame `n`
+
+        Raises
+        ------
+        TimeoutError
+            If the frame was not written within `timeout`
+        """
+        if n < 0:
+            raise ValueError("can only wait for non-negative frames")
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            self.refresh()
+            if n < self._dset.shape[0]:
+                return self._dset[n]
+            if timeout is not None and time.time() >= deadline:
+                raise TimeoutError("frame {} was not written within "
+                                   "{} s".format(n, timeout))
+            time.sleep(poll)
+
+    @property
+    @require_active
+    def chunks(self):
+        """
+        The chunk shape of the frame dataset, None if not chunked
+        """
+        return self._dset.chunks
+
+    @require_active
+    def __len__(self):
+        self.refresh()
+        return self._dset.shape[0]
+
+    def _check_index(self, n):
+        n_frames = self._dset.shape[0]
+        if self._swmr and not -n_frames <= n < n_frames:
+            self.refresh()
+            n_frames = self._dset.shape[0]
+        if n < 0:
+            n += n_frames
+        if not 0 <= n < n_frames:
+            raise IndexError("frame {} out of range".format(n))
+        return n
+
+    @require_active
+    def get_frame(self, n):
+        return self._dset[self._check_index(n)]
+
+    @require_active
+    def get_frames(self, frame_nums):
+        dset = self._dset
+        n_frames = len(self)
+        if isinstance(frame_nums, slice):
+            start, stop, step = frame_nums.indices(n_frames)
+            if step == 1:
+                # a single hyperslab
+                return dset[start:max(start, stop)]
+            frame_nums = range(start, stop, step)
+        idx = np.array([self._check_index(int(n)) for n in frame_nums],
+                       dtype=np.intp)
+        out = np.empty((len(idx), ) + dset.shape[1:], dtype=dset.dtype)
+        if len(idx) == 0:
+            return out
+        order = np.argsort(idx, kind='mergesort')
+        sidx = idx[order]
+        # read runs of adjacent chunks as one hyperslab, skip chunks
+        # which hold none of the requested frames
+        blocks = sidx // self._block
+        splits = np.flatnonzero(np.diff(blocks) > 1) + 1
+        for sel in np.split(np.arange(len(sidx)), splits):
+            lo = sidx[sel[0]]
+            hi = sidx[sel[-1]] + 1
+            buf = dset[lo:hi]
+            out[order[sel]] = buf[sidx[sel] - lo]
+        return out
+
+    @require_active
+    def __getitem__(self, arg):
+        if isinstance(arg, slice):
+            return self.get_frames(arg)
+        return self.get_frame(arg)
+
+    @require_active
+    def __iter__(self):
+        dset = self._dset
+        n_frames = len(self)
+        for start in range(0, n_frames, self._block):
+            for frame in dset[start:min(start + self._block, n_frames)]:
+                yield frame
+
+    def get_metadata(self, key):
+        try:
+            val = self._md[key]
+        except (KeyError, TypeError):
+            # no key, or not active
+            return super(HdfFrameSource, self).get_metadata(key)
+        if isinstance(val, md_value):
+            return val.value
+        return val
+
+    @require_active
+    def get_frame_metadata(self, frame_num, key):
+        if self._frame_md_index is not None:
+            frame_num = self._check_index(frame_num)
+            if frame_num < self._frame_md_index.shape[0]:
+                offset, length = self._frame_md_index[frame_num]
+                if length > 0:
+                    raw = self._frame_md[offset:offset + length]
+                    frame_md = json.loads(raw.tobytes().decode('utf-8'))
+                    if key in frame_md:
+                        return frame_md[key]
+        return super(HdfFrameSource, self).get_frame_metadata(frame_num,
+                                                              key)
+
+
+class HdfImageSource(HdfFrameSource, ImageSource):
+    def __init__(self, *args, **kwargs):
+        ndim = kwargs.pop('frame_dim', 2)
+        if ndim != 2:
+            raise RuntimeError("frame_dim should be 2")
+        kwargs['frame_dim'] = ndim
+        super(HdfImageSource, self).__init__(*args, **kwargs)
+
+
+class HdfVolumeSource(HdfFrameSource, VolumeSource):
+    def __init__(self, *args, **kwargs):
+        ndim = kwargs.pop('frame_dim', 3)
+        if ndim != 3:
+            raise RuntimeError("frame_dim should be 3")
+        kwargs['frame_dim'] = ndim
+        super(HdfVolumeSource, self).__init__(*args, **kwargs)
+
+
+class HdfRawTomoData(HdfImageSource, RawTomoData):
+    """
+    Raw tomographic data stored as a stack of projections (theta, y, x).
+
+    Sinograms are read in blocks of rows aligned to the chunks of the
+    dataset, use chunks spanning few rows when writing data which will
+    mostly be read by sinogram.
+    """
+    # upper limit on the size of a block of sinograms
+    _sino_bytes = 64 * 1024 * 1024
+
+    @require_active
+    def iter_by_projection(self):
+        return iter(self)
+
+    @require_active
+    def iter_by_sinogram(self):
+        dset = self._dset
+        n_proj, n_y, n_x = dset.shape
+        rows = dset.chunks[1] if dset.chunks is not None else 1
+        row_bytes = max(n_proj * n_x * dset.dtype.itemsize, 1)
+        rows = max(min(rows, self._sino_bytes // row_bytes), 1)
+        for start in range(0, n_y, rows):
+            buf = dset[:, start:start + rows, :]
+            for j in range(buf.shape[1]):
+                yield buf[:, j, :]
+
+
+_im_dim_error = "img.ndim must equal {snk} not {inp}"
+
+
+class HdfFrameSink(BaseHdf, FrameSink):
+    """
+    A sink which writes frames into a chunked, resizable hdf5 dataset.
+
+    The dataset is created from the shape and dtype of the first frame
+    recorded (or from `frame_shape` and `dtype` on activation) and grows
+    as frames are recorded, in any order.  Any existing dataset of the
+    same name is replaced.
+
+    In SWMR mode every frame is flushed to the file as soon as it is
+    written so that SWMR sources can read it.  Frames recorded ahead of
+    a gap are held in memory until the gap is filled, so the length of
+    the dataset is always the number of contiguous frames.
+    """
+    def __init__(self, fname, dset_name='frames', frame_dim=None,
+                 chunks=None, compression='gzip', compression_opts=None,
+                 shuffle=False, frame_shape=None, dtype=None,
+                 base_group_name=None, h5_kwargs=None, swmr=False,
+                 resolution=None, resolution_units=None):
+        """
+        Parameters
+        ----------
+        fname : str
+            Absolute path to file
+
+        dset_name : str, optional
+            Name of the frame dataset in the base group
+
+        frame_dim : int or None, optional
+            Dimension of a single frame, if given frames of other
+            dimensions are rejected
+
+        chunks : tuple or None, optional
+            Chunk shape, frame axis first.  By default as many whole
+            frames as fit in 512 kB
+
+        compression : str or None, optional
+            Compression filter passed to `h5py`, 'gzip' by default,
+            None for no compression
+
+        compression_opts : optional
+            Options of the compression filter (the level for 'gzip')
+
+        shuffle : bool, optional
+            Apply the byte shuffle filter before compression
+
+        frame_shape, dtype : tuple and np.dtype, optional
+            If given, create the (empty) dataset on activation so that
+            readers can open it before the first frame is recorded
+
+        base_group_name : str or None, optional
+            Group in the file to work in, defaults to the root group
+
+        h5_kwargs : dict or None, optional
+            Passed through to `h5py.File`, by default the file is
+            opened for appending
+
+        swmr : bool, optional
+            Write the file in SWMR mode so it can be read while it is
+            being written.  Set-level meta-data must then be set before
+            the dataset is created.
+        """
+        if h5_kwargs is None:
+            h5_kwargs = {'mode': 'a'}
+        super(HdfFrameSink, self).__init__(
+            fname=fname, base_group_name=base_group_name,
+            h5_kwargs=h5_kwargs, swmr=swmr, resolution=resolution,
+            resolution_units=resolution_units)
+        self._dset_name = dset_name
+        self._frame_dim = frame_dim
+        self._chunks = tuple(chunks) if chunks is not None else None
+        self._compression = compression
+        self._compression_opts = compression_opts
+        self._shuffle = bool(shuffle)
+        if frame_shape is not None:
+            frame_shape = tuple(int(_) for _ in frame_shape)
+            if dtype is None:
+                raise ValueError("must provide dtype with frame_shape")
+            dtype = np.dtype(dtype).str
+        self._frame_shape = frame_shape
+        self._dtype = dtype
+        self._md = dict()
+        self._frames = set()
+        # frames waiting for a gap to be filled (SWMR mode only)
+        self._pending = dict()
+        self._dset = None
+        self._frame_md = None
+        self._frame_md_index = None
+
+    @property
+    def kwarg_dict(self):
+        md = super(HdfFrameSink, self).kwarg_dict
+        md.update({'dset_name': self._dset_name,
+                   'frame_dim': self._frame_dim,
+                   'chunks': self._chunks,
+                   'compression': self._compression,
+                   'compression_opts': self._compression_opts,
+                   'shuffle': self._shuffle,
+                   'frame_shape': self._frame_shape,
+                   'dtype': self._dtype})
+        return md
+
+    def activate(self):
+        super(HdfFrameSink, self).activate()
+        self._frames = set()
+        self._pending = dict()
+        for suffix in ('', _MD_SUFFIX, _FRAME_MD_SUFFIX,
+                       _FRAME_MD_INDEX_SUFFIX):
+            if self._dset_name + suffix in self._group:
+                del self._group[self._dset_name + suffix]
+        if self._frame_shape is not None:
+            self._create(self._frame_shape, self._dtype)
+
+    def deactivate(self):
+        if not self.active:
+            return
+        try:
+            # write out anything still waiting on a gap, the missing
+            # frames are reported below
+            for n in sorted(self._pending):
+                self._write(n, *self._pending.pop(n))
+            # in SWMR mode the meta-data goes out with the dataset, if
+            # no frame ever arrived it still needs to be written
+            if self._md and (not self._swmr or self._dset is None):
+                self._write_md()
+        finally:
+            self._dset = None
+            self._frame_md = None
+            self._frame_md_index = None
+            self._pending = dict()
+            super(HdfFrameSink, self).deactivate()
+        if self._frames and (min(self._frames) != 0 or
+                             max(self._frames) != len(self._frames) - 1):
+            raise ValueError("did not provide continuous frames")
+
+    def _write_md(self):
+        md_group = self._group.create_group(self._dset_name + _MD_SUFFIX)
+        MD_dict(self._md).write_hdf(md_group, compact=True)
+
+    def _create(self, frame_shape, dtype):
+        chunks = self._chunks
+        if chunks is None:
+            chunks = _default_chunks(frame_shape, dtype)
+        self._dset = self._group.create_dataset(
+            self._dset_name, shape=(0, ) + frame_shape,
+            maxshape=(None, ) + frame_shape, dtype=dtype, chunks=chunks,
+            compression=self._compression,
+            compression_opts=self._compression_opts,
+            shuffle=self._shuffle)
+        # JSON of the frame meta-data and the (offset, length) of the
+        # entry of each frame.  Variable length strings are not safe to
+        # use with SWMR.
+        self._frame_md = self._group.create_dataset(
+            self._dset_name + _FRAME_MD_SUFFIX, shape=(0, ),
+            maxshape=(None, ), chunks=(_FRAME_MD_CHUNK, ), dtype=np.uint8)
+        self._frame_md_index = self._group.create_dataset(
+            self._dset_name + _FRAME_MD_INDEX_SUFFIX, shape=(0, 2),
+            maxshape=(None, 2), chunks=(chunks[0], 2), dtype=np.int64)
+        if self._swmr:
+            # no new objects can be created once SWMR mode is on
+            if self._md:
+                self._write_md()
+            self._File.swmr_mode = True
+
+    def _write(self, frame_number, img, frame_md):
+        index = self._frame_md_index
+        if frame_number >= index.shape[0]:
+            index.resize(frame_number + 1, axis=0)
+        if frame_md:
+            raw = json.dumps(dict(frame_md),
+                             default=_json_default).encode('utf-8')
+            offset = self._frame_md.shape[0]
+            self._frame_md.resize(offset + len(raw), axis=0)
+            self._frame_md[offset:] = np.frombuffer(raw, dtype=np.uint8)
+            index[frame_number] = (offset, len(raw))
+        if frame_number >= self._dset.shape[0]:
+            self._dset.resize(frame_number + 1, axis=0)
+        self._dset[frame_number] = img
+
+    @require_active
+    def record_frame(self, img, frame_number, frame_md=None):
+        img = np.asarray(img)
+        if self._frame_dim is not None and img.ndim != self._frame_dim:
+            raise ValueError(_im_dim_error.format(snk=self._frame_dim,
+                                                  inp=img.ndim))
+        if frame_number < 0:
+            raise ValueError("frame_number must be non-negative")
+        if self._dset is None:
+            self._create(img.shape, img.dtype)
+        elif img.shape != self._dset.shape[1:]:
+            raise ValueError("frame shape {} does not match {}".format(
+                img.shape, self._dset.shape[1:]))
+        self._frames.add(frame_number)
+        if not self._swmr:
+            self._write(frame_number, img, frame_md)
+            return
+        n = self._dset.shape[0]
+        if frame_number > n:
+            # hold on to it until the frames before it are written
+            self._pending[frame_number] = (np.array(img), frame_md)
+            return
+        self._write(frame_number, img, frame_md)
+        n = self._dset.shape[0]
+        while n in self._pending:
+            self._write(n, *self._pending.pop(n))
+            n += 1
+        # meta-data first so readers never see a frame without it
+        self._frame_md.flush()
+        self._frame_md_index.flush()
+        self._dset.flush()
+
+    def set_metadata(self, md_dict):
+        if self._swmr and self._dset is not None:
+            raise RuntimeError("in SWMR mode meta-data must be set before "
+                               "the dataset is created")
+        self._md.update(md_dict)
+
+    _source_klass = HdfFrameSource
+
+    def make_source(self, klass_hint=None):
+        if klass_hint is not None:
+            raise NotImplementedError("have not implemented this yet")
+
+        return self._source_klass(self.backing_file,
+                                  dset_name=self._dset_name,
+                                  frame_dim=self._frame_dim,
+                                  base_group_name=self._group_name,
+                                  swmr=self._swmr,
+                                  resolution=self.resolution,
+                                  resolution_units=self.resolution_units)
+
+
+class HdfImageSink(HdfFrameSink, ImageSink):
+    _source_klass = HdfImageSource
+
+    def __init__(self, *args, **kwargs):
+        ndim = kwargs.pop('frame_dim', 2)
+        if ndim != 2:
+            raise RuntimeError("frame_dim should be 2")
+        kwargs['frame_dim'] = ndim
+        super(HdfImageSink, self).__init__(*args, **kwargs)
+
+
+class HdfVolumeSink(HdfFrameSink):
+    _source_klass = HdfVolumeSource
+
+    def __init__(self, *args, **kwargs):
+        ndim = kwargs.pop('frame_dim', 3)
+        if ndim != 3:
+            raise RuntimeError("frame_dim should be 3")
+        kwargs['frame_dim'] = ndim
+        super(HdfVolumeSink, self).__init__(*args, **kwargs)
+
+
+def _table_chunk_rows(dtype):
+    """
+    Number of rows in a chunk of about `_CHUNK_BYTES`
+    """
+    return max(_CHUNK_BYTES // max(np.dtype(dtype).itemsize, 1), 1)
+
+
+class HdfTableSource(BaseHdf, TableSource):
+    """
+    A source for tables stored as (compound) datasets in an hdf5 group.
+
+    Only the requested fields and rows are read from the file, so
+    large tables can be read piece-wise with `read_table` or
+    `iter_rows`.
+    """
+    def __init__(self, fname, base_group_name=None, h5_kwargs=None):
+        """
+        Parameters
+        ----------
+        fname : str
+            Absolute path to file
+
+        base_group_name : str or None, optional
+            Group in the file holding the tables, defaults to the root
+            group
+
+        h5_kwargs : dict or None, optional
+            Passed through to `h5py.File`, defaults to read-only
+        """
+        if h5_kwargs is None:
+            h5_kwargs = {'mode': 'r'}
+        super(HdfTableSource, self).__init__(
+            fname=fname, base_group_name=base_group_name,
+            h5_kwargs=h5_kwargs)
+
+    @require_active
+    def table_keys(self):
+        return [k for k, v in six.iteritems(self._group)
+                if isinstance(v, h5py.Dataset) and v.ndim == 1 and
+                v.dtype.names is not None]
+
+    @require_active
+    def table_length(self, table_name):
+        """
+        The number of rows in a table
+
+        Parameters
+        ----------
+        table_name : str
+            The name of the table
+        """
+        return self._group[table_name].shape[0]
+
+    @require_active
+    def read_table(self, table_name, columns=None, rows=None):
+        dset = self._group[table_name]
+        n_rows = dset.shape[0]
+        if rows is None:
+            rows = slice(None)
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(n_rows)
+            if step < 0:
+                # hdf5 only does increasing selections
+                return self.read_table(table_name, columns,
+                                       np.arange(start, stop, step))
+            sel = slice(start, max(start, stop), step)
+            order = None
+        else:
+            idx = np.asarray(rows, dtype=np.intp).ravel()
+            idx = np.where(idx < 0, idx + n_rows, idx)
+            if np.any((idx < 0) | (idx >= n_rows)):
+                raise IndexError("row index out of range")
+            # point selections must be increasing and unique
+            sel, order = np.unique(idx, return_inverse=True)
+            if len(sel) == 0:
+                sel = slice(0, 0)
+        if columns is None:
+            data = dset[sel]
+        else:
+            columns = [six.text_type(c) for c in columns]
+            for c in columns:
+                if dset.dtype.names is None or c not in dset.dtype.names:
+                    raise KeyError("no column {!r} in {}".format(c,
+                                                                 table_name))
+            data = dset[tuple(columns) + (sel, )]
+            if len(columns) == 1:
+                # h5py drops the compound type for single fields
+                out = np.empty(data.shape,
+                               dtype=[(columns[0], data.dtype)])
+                out[columns[0]] = data
+                data = out
+        if order is not None:
+            data = data[order]
+        return data
+
+    @require_active
+    def iter_rows(self, table_name, chunk_size=None, columns=None):
+        """
+        Iterate through a table in blocks of rows.
+
+        Parameters
+        ----------
+        table_name : str
+            The name of the table
+
+        chunk_size : int or None, optional
+            Number of rows per block, defaults to the chunking of the
+            dataset
+
+        columns : list of str or None, optional
+            The fields to read, if None read all of them
+
+        Yields
+        ------
+        block : ndarray
+            Consecutive rows of the table
+        """
+        dset = self._group[table_name]
+        if chunk_size is None:
+            if dset.chunks is not None:
+                chunk_size = dset.chunks[0]
+            else:
+                chunk_size = _table_chunk_rows(dset.dtype)
+        for start in range(0, dset.shape[0], chunk_size):
+            yield self.read_table(table_name, columns,
+                                  slice(start, start + chunk_size))
 
 
 class HdfTableSink(BaseHdf, TableSink):
+    """
+    A sink which writes tables as resizable, chunked datasets.
+
+    In append mode each call to `write_table` adds rows to the end of
+    the table (which may already exist in the file), so results can be
+    streamed in a few rows at a time.  Rows are buffered and written a
+    chunk at a time.  Otherwise each call replaces the table.
+    """
+    def __init__(self, fname, append=False, chunk_rows=None,
+                 compression=None, compression_opts=None,
+                 base_group_name=None, h5_kwargs=None):
+        """
+        Parameters
+        ----------
+        fname : str
+            Absolute path to file
+
+        append : bool, optional
+            If `write_table` appends to existing tables
+
+        chunk_rows : int or None, optional
+            Rows per chunk of new tables, by default about 512 kB worth
+
+        compression : str or None, optional
+            Compression filter passed to `h5py`
+
+        compression_opts : optional
+            Options of the compression filter
+
+        base_group_name : str or None, optional
+            Group in the file to put the tables in, defaults to the
+            root group
+
+        h5_kwargs : dict or None, optional
+            Passed through to `h5py.File`, by default the file is
+            opened for appending
+        """
+        if h5_kwargs is None:
+            h5_kwargs = {'mode': 'a'}
+        super(HdfTableSink, self).__init__(
+            fname=fname, base_group_name=base_group_name,
+            h5_kwargs=h5_kwargs)
+        self._append = bool(append)
+        self._chunk_rows = chunk_rows
+        self._compression = compression
+        self._compression_opts = compression_opts
+        # table name -> [list of buffered arrays, number of rows]
+        self._buffers = dict()
+
+    @property
+    def kwarg_dict(self):
+        md = super(HdfTableSink, self).kwarg_dict
+        md.update({'append': self._append,
+                   'chunk_rows': self._chunk_rows,
+                   'compression': self._compression,
+                   'compression_opts': self._compression_opts})
+        return md
+
     def activate(self):
-        if self.activate:
+        if self.active:
             # if already active, no-op
             return
 
         # finally pass up the call stack
         super(HdfTableSink, self).activate()
+        self._buffers = dict()
+
+    def deactivate(self):
+        if not self.active:
+            return
+        try:
+            for table_name in list(self._buffers):
+                self._flush(table_name)
+        finally:
+            super(HdfTableSink, self).deactivate()
+
+    def _create(self, rec_array, table_name):
+        chunk_rows = self._chunk_rows
+        if chunk_rows is None:
+            chunk_rows = _table_chunk_rows(rec_array.dtype)
+        return self._group.create_dataset(
+            table_name, shape=(0, ), maxshape=(None, ),
+            dtype=rec_array.dtype, chunks=(chunk_rows, ),
+            compression=self._compression,
+            compression_opts=self._compression_opts)
+
+    def _flush(self, table_name):
+        buf = self._buffers.pop(table_name, None)
+        if buf is None:
+            return
+        rows = np.concatenate(buf[0])
+        dset = self._group.get(table_name)
+        if dset is None:
+            dset = self._create(rows, table_name)
+        elif dset.dtype.names != rows.dtype.names:
+            raise ValueError("columns {} do not match table {}".format(
+                rows.dtype.names, dset.dtype.names))
+        n = dset.shape[0]
+        dset.resize(n + len(rows), axis=0)
+        dset[n:] = rows.astype(dset.dtype, copy=False)
 
     @require_active
     def write_table(self, rec_array, table_name):
-        # this will blow up unceremoniously if table_name
-        # already exists.  This will auto-magically
-        self._group[table_name] = rec_array
+        rec_array = np.atleast_1d(np.asarray(rec_array))
+        if rec_array.ndim != 1:
+            raise ValueError("tables must be 1D")
+        if not self._append:
+            if table_name in self._group:
+                del self._group[table_name]
+            self._buffers[table_name] = [[rec_array], len(rec_array)]
+            self._flush(table_name)
+            return
+        buf = self._buffers.setdefault(table_name, [[], 0])
+        if buf[0] and buf[0][0].dtype.names != rec_array.dtype.names:
+            raise ValueError("columns {} do not match table {}".format(
+                rec_array.dtype.names, buf[0][0].dtype.names))
+        buf[0].append(rec_array)
+        buf[1] += len(rec_array)
+        chunk_rows = self._chunk_rows
+        if chunk_rows is None:
+            chunk_rows = _table_chunk_rows(rec_array.dtype)
+        if buf[1] >= chunk_rows:
+            self._flush(table_name)
+
+    def make_source(self, klass_hint=None):
+        if klass_hint is not None:
+            raise NotImplementedError("have not implemented this yet")
+
+        return HdfTableSource(self.backing_file,
+                              base_group_name=self._group_name)
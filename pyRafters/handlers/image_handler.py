@@ -4,7 +4,7 @@ from __future__ import (absolute_import, division, print_function,
 import six
 
 from ..handler_base import ImageSource, require_active
-from .base_file_handlers import SingleFileHandler
+from .base_file_handlers import SingleFileHandler, SequentialSetFileSource
 try:
     from scipy.misc import imread
 except ImportError:
@@ -42,3 +42,28 @@ class scipy_imread_Handler(SingleFileHandler, ImageSource):
         if n != 0:
             raise NotImplementedError("multi-plane not implemented yet")
         return self._cache
+
+
+class scipy_imread_sequence_Handler(SequentialSetFileSource, ImageSource):
+    """
+    Source for a set of sequentially named image files, one frame per
+    file, read with `scipy.misc.imread`.
+    """
+    @classmethod
+    def available(cls):
+        return (imread is not None and
+                super(scipy_imread_sequence_Handler, cls).available())
+
+    _extension_filters = {'png', 'jpg',
+                          'jpeg', 'tiff',
+                          'bnp'} | SequentialSetFileSource._extension_filters
+
+    def __init__(self, base_path=None, format_str=None, resolution=None,
+                 resolution_units=None, readahead=4, maxworkers=None):
+        super(scipy_imread_sequence_Handler, self).__init__(
+            base_path=base_path, format_str=format_str, readahead=readahead,
+            maxworkers=maxworkers, resolution=resolution,
+            resolution_units=resolution_units)
+
+    def _read_file(self, fname):
+        return imread(fname)
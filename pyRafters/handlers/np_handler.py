@@ -10,6 +10,7 @@ import numpy as np
 from ..handler_base import (DistributionSource, DistributionSink,
                             require_active, ImageSink,
                             ImageSource, FrameSink, FrameSource)
+from ..utils import FrameMDStore
 
 
 class np_dist_source(DistributionSource):
@@ -104,13 +105,45 @@ _dim_err = ("wrong dimensions, data_array should have ndim = {fd} " +
              "or {fdp1}, not {ndim}")
 
 
+def _stack_shape(shape, frame_dim=None):
+    """
+    Return the shape of a frame stack with the frame axis first.
+
+    Parameters
+    ----------
+    shape : tuple
+        shape of the input data
+
+    frame_dim : int or None
+        dimension of a single frame, if None assume `shape` is a stack
+    """
+    shape = tuple(shape)
+    ndim = len(shape)
+    if frame_dim is None:
+        frame_dim = ndim - 1
+
+    # if have a non-sensible number of dimensions raise
+    if ndim < frame_dim or ndim > frame_dim + 1:
+        raise ValueError(_dim_err.format(fd=frame_dim,
+                                         fdp1=frame_dim+1,
+                                         ndim=ndim))
+    # if only one frame, upcast dimensions
+    elif ndim == frame_dim:
+        shape = (1, ) + shape
+    return shape
+
+
 class np_frame_source(FrameSource):
     """
     A source backed by a numpy arrays for in-memory image work
 
+    By default the source keeps a private copy of the data and every
+    access method returns copies.  With ``copy=False`` the source wraps the
+    caller's array and every access method returns read-only views, so
+    callers which want to modify frames must copy them.
     """
     def __init__(self, data_array=None, frame_dim=None, meta_data=None,
-                 frame_meta_data=None, *args, **kwargs):
+                 frame_meta_data=None, copy=True, *args, **kwargs):
         """
         Parameters
         ----------
@@ -119,24 +152,29 @@ class np_frame_source(FrameSource):
             The image stack
 
         meta_data : dict or None
+
+        frame_meta_data : list of dict, FrameMDStore, or None
+            Frame-level meta-data, one entry per frame
+
+        copy : bool, optional
+            If False, do not copy `data_array` and hand out read-only
+            views of it
         """
         super(np_frame_source, self).__init__(*args, **kwargs)
         if data_array is None:
             raise ValueError("data_array must be not-None")
 
-        # make a copy of the data
-        data_array = np.array(data_array)
-        if frame_dim is None:
-            frame_dim = data_array.ndim - 1
-
-        # if have a non-sensible number of dimensions raise
-        if data_array.ndim < frame_dim or data_array.ndim > frame_dim + 1:
-            raise ValueError(_dim_err.format(fd=frame_dim,
-                                            fdp1=frame_dim+1,
-                                            ndim=data_array.ndim))
+        self._copy = copy
+        if copy:
+            # make a copy of the data
+            data_array = np.array(data_array)
+        else:
+            # a read-only view, the caller's array is left writeable
+            data_array = np.asarray(data_array).view()
+            data_array.flags.writeable = False
         # if only one frame, upcast dimensions
-        elif data_array.ndim == frame_dim:
-            data_array.shape = (1, ) + data_array.shape
+        data_array = data_array.reshape(_stack_shape(data_array.shape,
+                                                     frame_dim))
 
         # save the data
         self._data = data_array
@@ -144,6 +182,9 @@ class np_frame_source(FrameSource):
         # keep a copy of the length
         self._len = data_array.shape[0]
 
+        self._init_meta_data(meta_data, frame_meta_data)
+
+    def _init_meta_data(self, meta_data, frame_meta_data):
         # deal with set-level meta-data
         if meta_data is None:
             meta_data = dict()
@@ -151,7 +192,9 @@ class np_frame_source(FrameSource):
         self._meta_data = meta_data
 
         if frame_meta_data is None:
-            frame_meta_data = [dict() for _ in range(self._len)]
+            frame_meta_data = FrameMDStore(self._len)
+        else:
+            frame_meta_data = FrameMDStore.from_dicts(frame_meta_data)
 
         if len(frame_meta_data) != self._len:
             raise ValueError(("number of frames and number of" +
@@ -162,14 +205,33 @@ class np_frame_source(FrameSource):
     def __len__(self):
         return self._len
 
+    def _hand_out(self, frames):
+        """
+        Copy `frames` (a view of the data) if this source hands out copies
+        """
+        if self._copy and isinstance(frames, np.ndarray):
+            # make a copy of the array before handing it out so we don't
+            # get odd in-place operation bugs
+            return np.array(frames)
+        # read-only view (or scalar)
+        return frames
+
     @require_active
     def get_frame(self, n):
-        # make a copy of the array before handing it out so we don't get
-        # odd in-place operation bugs
-        return np.array(self._data[n])
+        return self._hand_out(self._data[n])
+
+    @require_active
+    def get_frames(self, frame_nums):
+        if isinstance(frame_nums, slice):
+            return self._hand_out(self._data[frame_nums])
+        # fancy indexing always copies
+        return self._data[np.asarray(list(frame_nums), dtype=np.intp)]
 
     def get_frame_metadata(self, frame_num, key):
-        return self._frame_meta_data[frame_num][key]
+        return self._frame_meta_data.get(frame_num, key)
+
+    def get_frame_metadata_column(self, key):
+        return self._frame_meta_data.column(key)
 
     def get_metadata(self, key):
         return self._meta_data[key]
@@ -177,19 +239,21 @@ class np_frame_source(FrameSource):
     @require_active
     def __iter__(self):
         # leverage the numpy iterable
-        return iter(self._data)
+        return (self._hand_out(frame) for frame in self._data)
 
     @require_active
     def __getitem__(self, arg):
         # leverage the numpy slicing magic
-        return self._data[arg]
+        return self._hand_out(self._data[arg])
 
+    @property
     def kwarg_dict(self):
         dd = super(np_frame_source, self).kwarg_dict
         dd.update({'data_array': self._data,
                    'frame_dim': self._data.ndim - 1,
                    'meta_data': self._meta_data,
-                   'frame_meta_data': self._frame_meta_data})
+                   'frame_meta_data': self._frame_meta_data,
+                   'copy': self._copy})
         return dd
 
 
@@ -206,42 +270,164 @@ _im_dim_error = "img.ndim must equal {snk} not {inp}"
 
 
 class NPFrameSink(FrameSink):
-    def __init__(self, frame_dim, *args, **kwargs):
+    """
+    A sink which collects frames in memory.
+
+    Frames are written straight into a contiguous buffer which is handed
+    to the source made by `make_source` with out copying.  The buffer is
+    preallocated when the number of frames, the frame shape and the
+    dtype are given, otherwise it grows geometrically as frames arrive.
+    """
+    def __init__(self, frame_dim, n_frames=None, frame_shape=None,
+                 dtype=None, *args, **kwargs):
+        """
+        Parameters
+        ----------
+        frame_dim : int
+            dimension of a single frame
+
+        n_frames : int or None, optional
+            Expected number of frames
+
+        frame_shape : tuple or None, optional
+            Shape of a frame, if None taken from the first frame
+
+        dtype : np.dtype or None, optional
+            Data type of the stack, if None the promoted type of the
+            recorded frames
+        """
         super(NPFrameSink, self).__init__(*args, **kwargs)
-        self._frame_store = dict()
-        self._md_store = dict()
+        self._md_store = FrameMDStore()
         self._md = dict()
         self._frame_dim = frame_dim
+        self._n_frames = n_frames
+        if frame_shape is not None:
+            frame_shape = tuple(int(_) for _ in frame_shape)
+            if len(frame_shape) != frame_dim:
+                raise ValueError(_im_dim_error.format(snk=frame_dim,
+                                                      inp=len(frame_shape)))
+        self._frame_shape = frame_shape
+        self._dtype_arg = dtype
+        self._dtype = None if dtype is None else np.dtype(dtype)
+        # the frame buffer and which of its slots hold frames
+        self._buffer = None
+        self._written = np.zeros(0, dtype=bool)
+        # one past the highest frame number recorded
+        self._len = 0
+        # number of frames in the buffer shared with a source
+        self._n_shared = 0
+        if frame_shape is not None and dtype is not None:
+            self._reserve(n_frames or 1)
+
+    def _allocate(self, shape, dtype):
+        """
+        Return a new, uninitialized frame buffer.
+
+        Sub-classes override this to keep the frames somewhere other
+        than the heap of this process.
+        """
+        return np.empty(shape, dtype=dtype)
+
+    def _reserve(self, capacity, dtype=None):
+        """
+        Move the recorded frames into a new buffer of `capacity` frames
+        """
+        if dtype is None:
+            dtype = self._dtype
+        old = self._buffer
+        buf = self._allocate((capacity, ) + self._frame_shape, dtype)
+        if old is not None:
+            buf[:self._len] = old[:self._len]
+        written = np.zeros(capacity, dtype=bool)
+        written[:self._len] = self._written[:self._len]
+        self._buffer = buf
+        self._written = written
+        self._dtype = np.dtype(dtype)
+        self._n_shared = 0
 
     def record_frame(self, img, frame_number, frame_md=None):
+        img = np.asarray(img)
         if img.ndim != self._frame_dim:
-            raise ValueError(_im_dim_error.format(self._frame_dim,
-                                                  img.ndim))
-        # TODO add checking on shape based on first frame or
-        # init arg
-        self._frame_store[frame_number] = img
-        if frame_md is None:
-            frame_md = dict()
-        self._md_store[frame_number] = frame_md
+            raise ValueError(_im_dim_error.format(snk=self._frame_dim,
+                                                  inp=img.ndim))
+        if frame_number < 0:
+            raise ValueError("frame_number must be non-negative")
+        if self._frame_shape is None:
+            self._frame_shape = img.shape
+        elif img.shape != self._frame_shape:
+            raise ValueError("frame shape {} does not match {}".format(
+                img.shape, self._frame_shape))
+        if self._dtype_arg is not None:
+            dtype = self._dtype
+        elif self._dtype is None:
+            dtype = img.dtype
+        else:
+            dtype = np.promote_types(self._dtype, img.dtype)
+
+        capacity = 0 if self._buffer is None else len(self._buffer)
+        if frame_number >= capacity:
+            # grow geometrically
+            self._reserve(max(frame_number + 1, 2 * capacity,
+                              self._n_frames or 0), dtype)
+        elif dtype != self._dtype or frame_number < self._n_shared:
+            # promote, or copy the frames a source is looking at
+            self._reserve(capacity, dtype)
+        self._buffer[frame_number] = img
+        self._written[frame_number] = True
+        self._len = max(self._len, frame_number + 1)
+        self._md_store.set_frame(frame_number, frame_md)
+
+    def record_frames(self, imgs, frame_numbers=None, frame_md=None):
+        """
+        Record a stack of frames
+
+        Parameters
+        ----------
+        imgs : ndarray
+            The frames stacked along the first axis
+
+        frame_numbers : iterable of int or None, optional
+            The frame numbers, if None the frames after the highest
+            frame recorded so far
+
+        frame_md : dict or None, optional
+            Frame-level meta-data by key, each value has one entry
+            per frame
+        """
+        if frame_numbers is None:
+            frame_numbers = range(self._len, self._len + len(imgs))
+        frame_numbers = list(frame_numbers)
+        if len(frame_numbers) != len(imgs):
+            raise ValueError("need one frame number per frame")
+        if frame_numbers:
+            # the first frame fixes the shape, then make room for the rest
+            self.record_frame(imgs[0], frame_numbers[0])
+            top = max(frame_numbers)
+            if top >= len(self._buffer):
+                self._reserve(max(top + 1, 2 * len(self._buffer)))
+        for img, n in zip(imgs[1:], frame_numbers[1:]):
+            self.record_frame(img, n)
+        for k, vals in six.iteritems(frame_md or {}):
+            self._md_store.set_column(k, vals, frame_numbers)
 
     def set_metadata(self, md_dict):
         self._md.update(md_dict)
 
     def _clean(self):
         # TODO, maybe this should return an empty handler
-        if len(self._frame_store) == 0:
+        n = self._len
+        if n == 0:
             raise ValueError("did not provide any frames")
-        frames = np.array(list(
-            six.iterkeys(self._frame_store)))
-        if (np.min(frames) != 0 or
-              np.max(frames) != len(frames) - 1):
+        if not self._written[:n].all():
             raise ValueError("did not provide continuous frames")
-        data = np.array([self._frame_store[j]
-                         for j in range(len(frames))])
-        frame_md = [self._md_store[j]
-                         for j in range(len(frames))]
-
-        return {'data_array': data,
+        frame_md = self._md_store.copy()
+        # frames at the end may not have meta-data
+        frame_md.set_frame(n - 1, None)
+        # the source gets a view of the buffer, re-recording any of these
+        # frames copies the buffer first
+        self._n_shared = n
+
+        return {'data_array': self._buffer[:n],
                 'frame_dim': self._frame_dim,
                 'meta_data': self._md,
                 'frame_meta_data': frame_md}
@@ -249,11 +435,21 @@ class NPFrameSink(FrameSink):
     @property
     def kwarg_dict(self):
         dd = super(NPFrameSink, self).kwarg_dict
-        dd['frame_dim'] = self._frame_dim
+        dd.update({'frame_dim': self._frame_dim,
+                   'n_frames': self._n_frames,
+                   'frame_shape': self._frame_shape,
+                   'dtype': self._dtype_arg})
         return dd
 
+    def _make_source(self, klass):
+        # hand the buffer over with out copying it, the source still
+        # hands out copies of the frames
+        src = klass(copy=False, **self._clean())
+        src._copy = True
+        return src
+
     def make_source(self):
-        return np_frame_source(**self._clean())
+        return self._make_source(np_frame_source)
 
 
 class NPImageSink(NPFrameSink, ImageSink):
@@ -266,4 +462,4 @@ class NPImageSink(NPFrameSink, ImageSink):
         super(NPImageSink, self).__init__(*args, **kwargs)
 
     def make_source(self):
-        return NPImageSource(**self._clean())
+        return self._make_source(NPImageSource)
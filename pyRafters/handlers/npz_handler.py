@@ -0,0 +1,180 @@
+"""
+A set of sources and sinks for distributions saved as numpy `.npz` files.
+
+The bin edges and values are stored as `edges.npy` and `vals.npy` members
+of the archive.  Uncompressed archives (the default for the sink) are
+memory-mapped on `activate`, so opening a source does not depend on the
+size of the distribution and `values` / `bin_edges` do not copy.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import six
+import struct
+import zipfile
+import numpy as np
+
+from ..handler_base import (DistributionSource,
+                            DistributionSink,
+                            require_active)
+from .base_file_handlers import SingleFileHandler
+
+_EDGES = 'edges'
+_VALS = 'vals'
+
+# layout of a zip local file header, see the zip APPNOTE
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_LOCAL_MAGIC = b'PK\x03\x04'
+
+
+def _member_offset(fobj, info):
+    """
+    Return the offset in the archive of the first byte of a member's data
+    """
+    fobj.seek(info.header_offset)
+    header = _LOCAL_HEADER.unpack(fobj.read(_LOCAL_HEADER.size))
+    if header[0] != _LOCAL_MAGIC:
+        raise ValueError("bad local header for {}".format(info.filename))
+    # the name and extra field lengths in the local header may differ from
+    # those in the central directory
+    name_len, extra_len = header[-2:]
+    return info.header_offset + _LOCAL_HEADER.size + name_len + extra_len
+
+
+def _load_member(fname, zf, name):
+    """
+    Return the array saved as `name` in an open archive.
+
+    Stored members are memory-mapped read-only, compressed members are
+    read into memory.
+    """
+    info = zf.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        with zf.open(info) as member:
+            return np.lib.format.read_array(member, allow_pickle=False)
+
+    with open(fname, 'rb') as fobj:
+        start = _member_offset(fobj, info)
+        fobj.seek(start)
+        version = np.lib.format.read_magic(fobj)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(fobj)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(fobj)
+        offset = fobj.tell()
+    if dtype.hasobject:
+        raise ValueError("can not memory-map object arrays")
+    if not shape or 0 in shape:
+        # mmap can not map zero bytes
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(fname, mode='r', dtype=dtype, shape=shape,
+                     order='F' if fortran else 'C', offset=offset)
+
+
+class npz_dist_source(SingleFileHandler, DistributionSource):
+    """
+    A source for reading distribution data out of npz files.
+
+    The arrays returned by `values` and `bin_edges` are read-only
+    memory-maps of the file (unless the archive is compressed) and are
+    only valid while the file is not being re-written.
+    """
+    _extension_filters = {'npz'} | SingleFileHandler.handler_extensions()
+
+    def __init__(self, fname):
+        """
+        Parameters
+        ----------
+        fname : string
+            sufficiently qualified path to file to read
+        """
+        super(npz_dist_source, self).__init__(fname=fname)
+        self._edges = None
+        self._vals = None
+
+    def activate(self):
+        super(npz_dist_source, self).activate()
+        with zipfile.ZipFile(self._fname, 'r') as zf:
+            self._edges = _load_member(self._fname, zf, _EDGES)
+            self._vals = _load_member(self._fname, zf, _VALS)
+
+    def deactivate(self):
+        super(npz_dist_source, self).deactivate()
+        self._edges = None
+        self._vals = None
+
+    @property
+    def right(self):
+        """
+        If the file includes the right edge of the last bin
+        """
+        return len(self._edges) > len(self._vals)
+
+    # distribution methods
+    @require_active
+    def values(self):
+        return self._vals
+
+    @require_active
+    def bin_edges(self, include_right=False):
+        if include_right:
+            if not self.right:
+                raise ValueError("the right edge was not saved")
+            return self._edges
+        return self._edges[:len(self._vals)]
+
+    @require_active
+    def bin_centers(self, include_right=False):
+        edges = self._edges
+        # if we have a right edge
+        if self.right:
+            return edges[:-1] + np.diff(edges) / 2
+        bin_diff = np.diff(edges)
+        return edges + np.r_[bin_diff, np.mean(bin_diff)] / 2
+
+
+class npz_dist_sink(SingleFileHandler, DistributionSink):
+    """
+    A sink for writing distribution data to a npz file.
+    """
+    _extension_filters = {'npz'} | SingleFileHandler.handler_extensions()
+
+    def __init__(self, fname, compress=False):
+        """
+        Parameters
+        ----------
+        fname : string
+            sufficiently qualified path to file to write
+
+        compress : bool, optional
+            If the archive should be compressed.  Compressed archives
+            can not be memory-mapped when read back.
+        """
+        super(npz_dist_sink, self).__init__(fname=fname)
+        self._compress = compress
+
+    @require_active
+    def write_dist(self, edges, vals, right_edge=False):
+        edges = np.asarray(edges)
+        vals = np.asarray(vals)
+        if edges.ndim != 1 or vals.ndim != 1:
+            raise ValueError("edges and vals must be 1D")
+        n_edges = len(vals) + (1 if right_edge else 0)
+        if len(edges) != n_edges:
+            raise ValueError("expected {} edges, not {}".format(n_edges,
+                                                                len(edges)))
+        savez = np.savez_compressed if self._compress else np.savez
+        # pass a file object so numpy does not append '.npz' to the name
+        with open(self._fname, 'wb') as fobj:
+            savez(fobj, **{_EDGES: edges, _VALS: vals})
+
+    @property
+    def kwarg_dict(self):
+        md = super(npz_dist_sink, self).kwarg_dict
+        md.update({'compress': self._compress})
+        return md
+
+    def make_source(self, klass=None):
+        if klass is not None:
+            raise NotImplementedError("don't support this yet")
+
+        return npz_dist_source(self.backing_file)
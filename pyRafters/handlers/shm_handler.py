@@ -0,0 +1,355 @@
+"""
+A set of sources and sinks for frame stacks held in shared memory.
+
+These behave like the in-memory numpy handlers, but the data lives in a
+`multiprocessing.shared_memory` segment so that pickling a handler (to
+ship it to a worker process) only sends the name of the segment, the
+shape, and the dtype.  The worker attaches to the segment on `activate`
+with out copying the data.
+
+The handler which created the segment owns it and unlinks it when
+`unlink` is called or when the owning handler is garbage collected.
+Handlers re-created from a pickle never unlink the segment.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import six
+import os
+import weakref
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+from ..handler_base import ImageSink, ImageSource
+from .np_handler import np_frame_source, NPFrameSink, _stack_shape
+
+
+# names of the segments created by this process (or inherited from the
+# parent by fork), they are tracked on behalf of their owner
+_created = set()
+
+# the (fd, pid) of the resource tracker inherited by fork, if any
+_forked_tracker = None
+
+
+def _after_fork():
+    global _forked_tracker
+    if shared_memory is not None:
+        rt = resource_tracker._resource_tracker
+        _forked_tracker = (rt._fd, rt._pid)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _shared_tracker():
+    """
+    If this process uses the resource tracker of a parent process.
+
+    Children started with fork, spawn, or forkserver all talk to the
+    tracker of their parent, only a process which launched its own
+    tracker (or is about to) knows its pid.
+    """
+    rt = resource_tracker._resource_tracker
+    if rt._fd is None:
+        return False
+    return rt._pid is None or (rt._fd, rt._pid) == _forked_tracker
+
+
+def _create(size):
+    """
+    Create a new segment of at least `size` bytes
+    """
+    # can not create zero-size segments
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    _created.add(shm._name)
+    return shm
+
+
+def _attach(shm_name):
+    """
+    Attach to an existing segment.
+
+    Attached segments are not tracked by the resource tracker of this
+    process, so that a worker exiting does not unlink a segment it
+    does not own.  Workers sharing the tracker of the process which
+    created the segment leave it tracked, the owner still needs it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:
+        # python < 3.13 always registers the segment, take it back out
+        # of this process's own tracker (but not the tracker of a parent,
+        # that would drop the owner's registration)
+        shared = _shared_tracker()
+        shm = shared_memory.SharedMemory(name=shm_name)
+        if not shared and shm._name not in _created:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _release(shm):
+    """
+    Close and unlink a segment, used as the finalizer of owning handlers
+    """
+    try:
+        shm.close()
+    except BufferError:
+        # there are still arrays looking at the buffer, the mapping
+        # will go away when they do
+        pass
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SharedMemFrameSource(np_frame_source):
+    """
+    A source backed by a numpy array in a shared memory segment.
+
+    Use `from_array` to create a segment from existing data.  The
+    pickled form of this handler only contains the name of the segment,
+    the shape, and the dtype.
+    """
+    @classmethod
+    def available(cls):
+        # shared_memory is new in python 3.8
+        return (shared_memory is not None and
+                super(SharedMemFrameSource, cls).available())
+
+    def __init__(self, shm_name=None, shape=None, dtype=None,
+                 meta_data=None, frame_meta_data=None, copy=True,
+                 *args, **kwargs):
+        """
+        Parameters
+        ----------
+        shm_name : str
+            Name of an existing shared memory segment
+
+        shape : tuple
+            Shape of the frame stack, frame axis first
+
+        dtype : np.dtype or str
+            Data type of the frame stack
+
+        meta_data : dict or None
+
+        frame_meta_data : list of dict, FrameMDStore, or None
+
+        copy : bool, optional
+            If False, `get_frame` returns read-only views of the segment
+            rather than copies
+        """
+        # skip np_frame_source.__init__, there is no array to copy.  The
+        # buffer is attached in `activate`
+        super(np_frame_source, self).__init__(*args, **kwargs)
+        if shm_name is None:
+            raise ValueError("shm_name must be not-None")
+        if shape is None or dtype is None:
+            raise ValueError("must provide shape and dtype")
+
+        self._shm_name = shm_name
+        self._shape = tuple(int(_) for _ in shape)
+        self._dtype = np.dtype(dtype)
+        self._len = self._shape[0]
+        self._copy = copy
+        # only set by `from_array`, never passed through a pickle
+        self._shm_owner = None
+        self._finalizer = None
+        self._shm = None
+        self._data = None
+
+        self._init_meta_data(meta_data, frame_meta_data)
+
+    @classmethod
+    def from_array(cls, data_array, frame_dim=None, meta_data=None,
+                   frame_meta_data=None, **kwargs):
+        """
+        Copy `data_array` into a new shared memory segment and return
+        a source which owns it.
+
+        Parameters
+        ----------
+        data_array : ndarray
+            The image stack
+
+        frame_dim : int or None
+            dimension of a single frame, if None assume `data_array` is
+            a stack of frames
+
+        meta_data : dict or None
+
+        frame_meta_data : list of dict, FrameMDStore, or None
+
+        Returns
+        -------
+        src : SharedMemFrameSource
+            source which will unlink the segment when it is
+            garbage collected or `unlink` is called
+        """
+        data_array = np.asarray(data_array)
+        shape = _stack_shape(data_array.shape, frame_dim)
+        shm = _create(data_array.nbytes)
+        try:
+            tmp = np.ndarray(shape, dtype=data_array.dtype, buffer=shm.buf)
+            tmp[...] = data_array.reshape(shape)
+            del tmp
+            self = cls(shm_name=shm.name, shape=shape,
+                       dtype=data_array.dtype, meta_data=meta_data,
+                       frame_meta_data=frame_meta_data, **kwargs)
+        except Exception:
+            _release(shm)
+            raise
+        self._shm_owner = shm
+        self._finalizer = weakref.finalize(self, _release, shm)
+        return self
+
+    @property
+    def shm_name(self):
+        """
+        The name of the backing shared memory segment
+        """
+        return self._shm_name
+
+    @property
+    def owner(self):
+        """
+        If this handler is responsible for unlinking the segment
+        """
+        return self._finalizer is not None and self._finalizer.alive
+
+    def unlink(self):
+        """
+        Release the backing segment.
+
+        Only the handler that created the segment can do this.  Handlers
+        which are already attached may keep using the data, but no new
+        handlers can attach.
+        """
+        if self._finalizer is None:
+            raise RuntimeError("only the owning handler can unlink")
+        self._finalizer()
+
+    def activate(self):
+        if self._shm_owner is not None and self.owner:
+            shm = self._shm_owner
+        else:
+            shm = _attach(self._shm_name)
+        self._shm = shm
+        self._data = np.ndarray(self._shape, dtype=self._dtype,
+                                buffer=shm.buf)
+        if not self._copy:
+            self._data.flags.writeable = False
+        super(SharedMemFrameSource, self).activate()
+
+    def deactivate(self):
+        super(SharedMemFrameSource, self).deactivate()
+        self._data = None
+        shm, self._shm = self._shm, None
+        if shm is not None and shm is not self._shm_owner:
+            try:
+                shm.close()
+            except BufferError:
+                # views handed out by __getitem__ / __iter__ are still
+                # alive, the mapping is closed when they are collected
+                pass
+
+    @property
+    def kwarg_dict(self):
+        # skip np_frame_source, do not ship the data
+        dd = super(np_frame_source, self).kwarg_dict
+        dd.update({'shm_name': self._shm_name,
+                   'shape': self._shape,
+                   'dtype': self._dtype.str,
+                   'meta_data': self._meta_data,
+                   'frame_meta_data': self._frame_meta_data,
+                   'copy': self._copy})
+        return dd
+
+
+class SharedMemImageSource(SharedMemFrameSource, ImageSource):
+    @classmethod
+    def from_array(cls, *args, **kwargs):
+        ndim = kwargs.pop('frame_dim', 2)
+        if ndim != 2:
+            raise RuntimeError("frame_dim should be 2")
+        kwargs['frame_dim'] = ndim
+        return super(SharedMemImageSource, cls).from_array(*args, **kwargs)
+
+
+class SharedMemFrameSink(NPFrameSink):
+    """
+    A sink which collects frames in a shared memory segment and hands
+    the segment to a `SharedMemFrameSource` with out copying.
+
+    The segment is owned by the sink until `make_source` is called and
+    then by the source.  Frames recorded after that go to a new segment.
+    """
+    @classmethod
+    def available(cls):
+        return (shared_memory is not None and
+                super(SharedMemFrameSink, cls).available())
+
+    def __init__(self, *args, **kwargs):
+        # the segment backing the frame buffer, set by `_allocate`
+        self._shm = None
+        self._shm_finalizer = None
+        super(SharedMemFrameSink, self).__init__(*args, **kwargs)
+
+    def _allocate(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        shm = _create(int(np.prod(shape)) * dtype.itemsize)
+        try:
+            buf = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        except Exception:
+            _release(shm)
+            raise
+        self._shm = shm
+        return buf
+
+    def _reserve(self, capacity, dtype=None):
+        old = self._shm_finalizer
+        super(SharedMemFrameSink, self)._reserve(capacity, dtype)
+        self._shm_finalizer = weakref.finalize(self, _release, self._shm)
+        if old is not None:
+            # the frames have been copied out of the previous segment
+            old()
+
+    def _make_source(self, klass):
+        if self._shm_finalizer is None and self._buffer is not None:
+            # the segment already belongs to another source
+            self._reserve(len(self._buffer))
+        kwargs = self._clean()
+        data = kwargs.pop('data_array')
+        kwargs.pop('frame_dim')
+        src = klass(shm_name=self._shm.name, shape=data.shape,
+                    dtype=data.dtype, **kwargs)
+        # hand the segment over to the source
+        self._shm_finalizer.detach()
+        self._shm_finalizer = None
+        src._shm_owner = self._shm
+        src._finalizer = weakref.finalize(src, _release, self._shm)
+        # the source owns the whole segment, later frames go to a new one
+        self._n_shared = len(self._buffer)
+        return src
+
+    def make_source(self):
+        return self._make_source(SharedMemFrameSource)
+
+
+class SharedMemImageSink(SharedMemFrameSink, ImageSink):
+    def __init__(self, *args, **kwargs):
+
+        ndim = kwargs.pop('frame_dim', 2)
+        if ndim != 2:
+            raise RuntimeError("frame_dim should be 2")
+        kwargs['frame_dim'] = ndim
+        super(SharedMemImageSink, self).__init__(*args, **kwargs)
+
+    def make_source(self):
+        return self._make_source(SharedMemImageSource)
@@ -4,45 +4,323 @@ A set of sources and sinks for handling
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import six
+import os
+import json
+import hashlib
+import tempfile
+import warnings
+from six.moves.collections_abc import Mapping
+
+import numpy as np
 
 from ..handler_base import (ImageSource,
                             require_active, VolumeSource, ImageSink)
-from .base_file_handlers import SingleFileHandler
+from .base_file_handlers import SingleFileHandler, SequentialSetFileSource
 from ..extern import tifffile
 
 
+def _default_index_dir():
+    """
+    The per-user directory for cached TIFF indices
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'),
+                                             '.cache'))
+    return os.path.join(cache_home, 'pyRafters', 'tiff_index')
+
+
+def _index_path(index_dir, fname):
+    """
+    Path of the cached index of `fname`.
+
+    The name is derived from the absolute path, size, and modification
+    time of the file so a changed file never matches a stale index.
+    """
+    fname = os.path.abspath(fname)
+    st = os.stat(fname)
+    key = '{}|{}|{}'.format(fname, st.st_size,
+                            getattr(st, 'st_mtime_ns', st.st_mtime))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(index_dir, digest + '.npz')
+
+
+class _TiffIndex(object):
+    """
+    Positions of the IFDs and the data layout of the pages of a TIFF file.
+
+    The layout of a page is only known once the page has been parsed.
+    Pages whose data can be read as is (see `TiffPage.is_contiguous`)
+    can then be read without parsing their IFD again.
+    """
+    def __init__(self, ifd_offsets, data_offsets=None, byte_counts=None,
+                 shapes=None, dtypes=None):
+        n = len(ifd_offsets)
+        self.ifd_offsets = np.asarray(ifd_offsets, dtype=np.uint64)
+        # -1 for unknown layout, -2 for pages which can not be read as is
+        self.data_offsets = (np.full(n, -1, dtype=np.int64)
+                             if data_offsets is None else data_offsets)
+        self.byte_counts = (np.zeros(n, dtype=np.int64)
+                            if byte_counts is None else byte_counts)
+        # shapes are padded with -1 to the largest number of dimensions
+        self.shapes = (np.full((n, 4), -1, dtype=np.int64)
+                       if shapes is None else shapes)
+        self.dtypes = (np.zeros(n, dtype='S8')
+                       if dtypes is None else dtypes)
+        self.dirty = data_offsets is None
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read an index, return None if it can not be read
+        """
+        try:
+            with np.load(path) as data:
+                return cls(**dict((k, data[k]) for k in
+                                  ('ifd_offsets', 'data_offsets',
+                                   'byte_counts', 'shapes', 'dtypes')))
+        except Exception:
+            return None
+
+    def save(self, path):
+        """
+        Atomically replace the index at `path`
+        """
+        index_dir = os.path.dirname(path)
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        fd, tmp = tempfile.mkstemp(suffix='.npz', dir=index_dir)
+        try:
+            with os.fdopen(fd, 'wb') as fout:
+                np.savez(fout, ifd_offsets=self.ifd_offsets,
+                         data_offsets=self.data_offsets,
+                         byte_counts=self.byte_counts,
+                         shapes=self.shapes, dtypes=self.dtypes)
+            os.replace(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+        self.dirty = False
+
+    def layout(self, n):
+        """
+        Return (offset, shape, dtype) of page `n` or None if unknown
+        or not directly readable
+        """
+        if self.data_offsets[n] < 0:
+            return None
+        shape = tuple(int(_) for _ in self.shapes[n] if _ >= 0)
+        return (int(self.data_offsets[n]), shape,
+                np.dtype(self.dtypes[n].decode('ascii')))
+
+    def known(self, n):
+        return self.data_offsets[n] != -1
+
+    def record(self, n, page):
+        """
+        Record the data layout of the parsed page `n`
+        """
+        contiguous = page.is_contiguous
+        if contiguous is None or len(page.shape) > self.shapes.shape[1]:
+            self.data_offsets[n] = -2
+        else:
+            offset, nbytes = contiguous
+            self.data_offsets[n] = offset
+            self.byte_counts[n] = nbytes
+            self.shapes[n] = -1
+            self.shapes[n, :len(page.shape)] = page.shape
+            self.dtypes[n] = (page.parent.byteorder +
+                              np.dtype(page._dtype).str[1:]).encode('ascii')
+        self.dirty = True
+
+
+# key of the frame-level metadata in the JSON image descriptions
+_FRAME_MD_KEY = 'frame_md'
+
+
 class _tifffile_read_Handler(SingleFileHandler):
     # this list should probably be expanded
     _extension_filters = {'tif', 'tiff', 'stk',
                           } | SingleFileHandler._extension_filters
 
-    def __init__(self, fname, resolution=None, resolution_units=None):
-        # don't need to do anything but pass up the MRO
+    def __init__(self, fname, resolution=None, resolution_units=None,
+                 memmap=False, index_cache=None):
+        """
+        Parameters
+        ----------
+        fname : str
+            Absolute path to file
+
+        memmap : bool, optional
+            If True, return read-only views into a memory map of the
+            file for pages where the data is stored uncompressed and
+            contiguously.  Pages which can not be mapped are decoded
+            as usual.
+
+        index_cache : bool or str, optional
+            If True, keep an index of the page positions and data layout
+            of the file in the per-user cache directory, if a str, in
+            that directory.  Later opens of the unchanged file skip the
+            scan of the page list and read directly readable pages
+            without parsing them.
+        """
+        # pass up the MRO
         super(_tifffile_read_Handler, self).__init__(fname=fname,
                                             resolution_units=resolution_units,
                                             resolution=resolution)
+        self._memmap = bool(memmap)
+        self._index_cache = index_cache
+        self._index = None
+
+    @property
+    def memmap(self):
+        """
+        If frames are returned as read-only views into a memory map
+        when the page layout allows it.
+        """
+        return self._memmap
+
+    @property
+    def kwarg_dict(self):
+        md = super(_tifffile_read_Handler, self).kwarg_dict
+        md['memmap'] = self._memmap
+        md['index_cache'] = self._index_cache
+        return md
+
+    @property
+    def _index_path(self):
+        if not self._index_cache:
+            return None
+        index_dir = self._index_cache
+        if not isinstance(index_dir, six.string_types):
+            index_dir = _default_index_dir()
+        return _index_path(index_dir, self.backing_file)
 
     def activate(self):
         # pass up the mro stack to make sure the active flag gets flipped
         super(_tifffile_read_Handler, self).activate()
-        self._tifffile = tifffile.TiffFile(self.backing_file)
+        index_path = self._index_path
+        index = None
+        if index_path is not None:
+            index = _TiffIndex.load(index_path)
+        if index is not None:
+            self._tifffile = tifffile.TiffFile(
+                self.backing_file, ifd_offsets=index.ifd_offsets.tolist())
+        else:
+            self._tifffile = tifffile.TiffFile(self.backing_file)
+            if index_path is not None:
+                index = _TiffIndex(self._tifffile.ifd_offsets)
+        self._index = index
 
     def deactivate(self):
-        if not self.activate:
+        if not self.active:
             # no need to deactivate an inactive handler
             return
         # close the open TiffFile object
         self._tifffile.close()
         # delete TiffFile object
         del self._tifffile
+        index, self._index = self._index, None
+        if index is not None and index.dirty:
+            try:
+                index.save(self._index_path)
+            except (IOError, OSError) as e:
+                warnings.warn("failed to write TIFF index: {}".format(e))
         super(_tifffile_read_Handler, self).deactivate()
 
+    def _description(self, n):
+        """
+        The image description of page `n` parsed as JSON, empty if it
+        is missing or not JSON
+        """
+        tag = self._tifffile[n].tags.get('image_description')
+        if tag is None:
+            return {}
+        try:
+            md = json.loads(tag.value.decode('utf-8'))
+        except ValueError:
+            return {}
+        return md if isinstance(md, dict) else {}
+
+    @require_active
+    def get_metadata(self, key):
+        md = self._description(0)
+        md.pop(_FRAME_MD_KEY, None)
+        try:
+            return md[key]
+        except KeyError:
+            return super(_tifffile_read_Handler, self).get_metadata(key)
+
+    @require_active
+    def get_frame_metadata(self, frame_num, key):
+        md = self._description(frame_num).get(_FRAME_MD_KEY, {})
+        try:
+            return md[key]
+        except (KeyError, TypeError):
+            return super(_tifffile_read_Handler,
+                         self).get_frame_metadata(frame_num, key)
+
+    def _read_page(self, n, roi=None):
+        """
+        Return the data of page `n`, or the region `roi` of it, using
+        the index if there is one
+        """
+        index = self._index
+        layout = None
+        if index is not None:
+            if n < 0:
+                n += len(self._tifffile)
+            if not index.known(n):
+                index.record(n, self._tifffile[n])
+            layout = index.layout(n)
+        if layout is None:
+            page = self._tifffile[n]
+            if roi is None:
+                return page.asarray(memmap=self._memmap)
+            return page.asarray_region(roi, memmap=self._memmap)
+
+        offset, shape, dtype = layout
+        rows = slice(None)
+        if roi is not None:
+            # only read the rows spanned by the region
+            rows, cols = roi
+            start, stop, step = rows.indices(shape[0])
+            if step > 0 and stop > start:
+                rowsize = int(np.prod(shape[1:])) * dtype.itemsize
+                offset += start * rowsize
+                shape = (stop - start, ) + shape[1:]
+                rows = slice(None, None, step)
+        if self._memmap and dtype.isnative:
+            data = np.memmap(self.backing_file, dtype, 'r', offset, shape)
+        else:
+            tif = self._tifffile
+            with tif._lock:
+                tif._fh.seek(offset)
+                data = tifffile.numpy_fromfile(tif._fh, dtype,
+                                               int(np.prod(shape)))
+            data = data.astype(dtype.newbyteorder('=')).reshape(shape)
+        if roi is not None:
+            data = data[rows, cols]
+        return data
+
 
 class tifffile_read2D_Handler(_tifffile_read_Handler, ImageSource):
     # this list should probably be expanded
     @require_active
-    def get_frame(self, n):
-        return self._tifffile[n].asarray()
+    def get_frame(self, n, roi=None):
+        """
+        Return frame `n`, or a region of it
+
+        Parameters
+        ----------
+        n : int
+            The frame number
+
+        roi : tuple of two slices, optional
+            The region along the rows and columns to return.  Only the
+            strips or tiles of the page which intersect the region are
+            read from the file.
+        """
+        return self._read_page(n, roi)
 
     @require_active
     def __len__(self):
@@ -50,41 +328,326 @@ class tifffile_read2D_Handler(_tifffile_read_Handler, ImageSource):
 
 
 class tifffile_read3D_Handler(_tifffile_read_Handler, VolumeSource):
-    # this list should probably be expanded
+    """
+    Source for a volume stored as a stack of TIFF pages, one page per
+    z-slice.
+
+    The whole volume is a single frame, use `get_slab` or `iter_slabs`
+    to read parts of volumes which do not fit in memory.
+    """
     @require_active
     def get_frame(self, n):
-        return self._tifffile.asarray()
+        """
+        Return the whole volume, the only frame of this source
+        """
+        if n not in (0, -1):
+            raise IndexError("volume sources only have frame 0")
+        return self._tifffile.asarray(memmap=self._memmap)
 
     @require_active
     def __len__(self):
+        # the volume is one frame, see `depth` for the number of slices
         return 1
 
+    @property
+    @require_active
+    def depth(self):
+        """
+        The number of z-slices in the volume
+        """
+        return len(self._tifffile)
+
+    @require_active
+    def get_slab(self, z, y=None, x=None):
+        """
+        Return a sub-volume, only reading the pages it spans
+
+        Parameters
+        ----------
+        z : slice
+            The z-slices to return
+
+        y, x : slice, optional
+            Bounds along the rows and columns of each slice.  If given,
+            only the strips or tiles of each page which intersect the
+            region are decoded.
+
+        Returns
+        -------
+        slab : ndarray
+            Array of shape (len(z), len(y), len(x))
+        """
+        pages = range(*z.indices(self.depth))
+        if y is None and x is None:
+            if self._index is None and len(pages):
+                # decodes compressed pages in parallel, a single page
+                # comes back with out the z axis
+                slab = self._tifffile.asarray(key=pages)
+                return slab.reshape((len(pages), ) +
+                                    self._tifffile[pages[0]].shape)
+            roi = None
+        else:
+            roi = (slice(None) if y is None else y,
+                   slice(None) if x is None else x)
+        slab = None
+        for j, n in enumerate(pages):
+            page = self._read_page(n, roi)
+            if slab is None:
+                slab = np.empty((len(pages), ) + page.shape, page.dtype)
+            slab[j] = page
+        if slab is None:
+            raise ValueError("z selects no slices")
+        return slab
+
+    @require_active
+    def iter_slabs(self, slab_depth, y=None, x=None):
+        """
+        Iterate over the volume in slabs of `slab_depth` z-slices
+
+        Only one slab is held in memory at a time.
+
+        Parameters
+        ----------
+        slab_depth : int
+            The number of z-slices per slab, the last slab may be thinner
+
+        y, x : slice, optional
+            Bounds along the rows and columns of each slice
+
+        Yields
+        ------
+        z : slice
+            The z-slices in this slab
+
+        slab : ndarray
+            The data, see `get_slab`
+        """
+        if slab_depth < 1:
+            raise ValueError("slab_depth must be positive")
+        depth = self.depth
+        for start in range(0, depth, slab_depth):
+            z = slice(start, min(start + slab_depth, depth))
+            yield z, self.get_slab(z, y, x)
+
+
+class tifffile_sequence_Handler(SequentialSetFileSource, ImageSource):
+    """
+    Source for a set of sequentially named TIFF files, one frame per
+    file (ex frame_00000.tif, frame_00001.tif, ...).
+
+    The first page of each file is the frame.  The header of each file
+    is parsed once, later reads of the same file jump to the image data
+    if it is stored uncompressed.
+    """
+    _extension_filters = {'tif', 'tiff',
+                          } | SequentialSetFileSource._extension_filters
+
+    def __init__(self, base_path=None, format_str=None, resolution=None,
+                 resolution_units=None, readahead=4, maxworkers=None):
+        """
+        Parameters
+        ----------
+        base_path : str
+             base path for files
+
+        format_str : str
+            new-style format string with the single field `n`, for
+            example 'frame_{n:05d}.tif'
+
+        readahead : int, optional
+            Number of frames read ahead of the last requested frame
+
+        maxworkers : int or None, optional
+            Number of threads reading files, defaults to `readahead`
+        """
+        super(tifffile_sequence_Handler, self).__init__(
+            base_path=base_path, format_str=format_str, readahead=readahead,
+            maxworkers=maxworkers, resolution=resolution,
+            resolution_units=resolution_units)
+
+    def activate(self):
+        super(tifffile_sequence_Handler, self).activate()
+        # fname -> (ifd offsets, (data offset, shape, dtype) or None)
+        self._headers = dict()
+        self._sequence = tifffile.TiffSequence(self._files,
+                                               imread=self._imread,
+                                               pattern=None)
+
+    def deactivate(self):
+        if not self.active:
+            return
+        super(tifffile_sequence_Handler, self).deactivate()
+        self._sequence.close()
+        del self._sequence
+        self._headers = dict()
+
+    def _imread(self, fname):
+        header = self._headers.get(fname)
+        if header is not None and header[1] is not None:
+            offset, shape, dtype = header[1]
+            with open(fname, 'rb') as fin:
+                fin.seek(offset)
+                data = tifffile.numpy_fromfile(fin, dtype,
+                                               int(np.prod(shape)))
+            return data.astype(dtype.newbyteorder('=')).reshape(shape)
+
+        tif = tifffile.TiffFile(fname, ifd_offsets=(header[0] if header
+                                                    else None))
+        try:
+            page = tif.pages[0]
+            data = page.asarray()
+            layout = None
+            if page.is_contiguous is not None:
+                layout = (page.is_contiguous[0], page.shape,
+                          np.dtype(tif.byteorder +
+                                   np.dtype(page._dtype).str[1:]))
+            self._headers[fname] = (tif.ifd_offsets, layout)
+        finally:
+            tif.close()
+        return data
+
+    def _read_file(self, fname):
+        return self._sequence.imread(fname)
+
 
 class tifffile_Sink(SingleFileHandler, ImageSink):
+    """
+    Sink which streams frames into a multi-page TIFF file.
+
+    Each frame is appended to the file as soon as it is recorded, so
+    memory use does not grow with the number of frames.  Frames may be
+    recorded in any order, the pages are ordered by frame number when
+    the sink is deactivated.  The BigTIFF format is used if the file
+    would be larger than 4 GB.
+
+    Metadata set with `set_metadata` is stored as JSON in the image
+    description of the first page.  Frame-level metadata is stored as
+    JSON under the key 'frame_md' in the image description of the
+    frame's page (for frame 0, in the description of the first page).
+
+    If `compress` is given, strips are compressed in a pool of threads
+    while frames keep arriving.
+    """
     _extension_filters = {'tif', 'tiff', 'stk',
                           } | SingleFileHandler._extension_filters
 
-    def __init__(self, fname, resolution=None, resolution_units=None):
+    def __init__(self, fname, resolution=None, resolution_units=None,
+                 bigtiff=None, compress=0, codec='deflate', predictor=False,
+                 maxworkers=None):
+        """
+        Parameters
+        ----------
+        fname : str
+            Absolute path to file
+
+        bigtiff : bool or None, optional
+            Force (True) or forbid (False) the BigTIFF format.  If None,
+            BigTIFF is only used if the file needs it.
+
+        compress : int, optional
+            Compression level from 0 (no compression, the default) to 9
+
+        codec : {'deflate', 'zlib'}, optional
+            The compression scheme
+
+        predictor : bool, optional
+            Apply horizontal differencing before compression, often
+            improves the compression of integer images.  Ignored if
+            `compress` is 0.
+
+        maxworkers : int or None, optional
+            Number of threads compressing strips, by default one per CPU
+        """
         super(tifffile_Sink, self).__init__(fname=fname,
                                             resolution_units=resolution_units,
                                             resolution=resolution)
+        if not 0 <= compress <= 9:
+            raise ValueError("compress must be between 0 and 9")
+        if codec not in tifffile.TiffWriter._CODECS:
+            raise ValueError("codec not supported: {}".format(codec))
+        self._bigtiff = bigtiff
+        self._compress = compress
+        self._codec = codec
+        self._predictor = bool(predictor)
+        self._maxworkers = maxworkers
+        self._md = dict()
+        self._frame0_md = None
+        self._frames = set()
+        self._writer = None
+
+    @property
+    def kwarg_dict(self):
+        md = super(tifffile_Sink, self).kwarg_dict
+        md.update({'bigtiff': self._bigtiff,
+                   'compress': self._compress,
+                   'codec': self._codec,
+                   'predictor': self._predictor,
+                   'maxworkers': self._maxworkers})
+        return md
+
+    def activate(self):
+        super(tifffile_Sink, self).activate()
+        self._frames = set()
+        self._frame0_md = None
+        self._writer = tifffile.TiffWriter(self.backing_file,
+                                           bigtiff=self._bigtiff,
+                                           compress=self._compress,
+                                           codec=self._codec,
+                                           predictor=self._predictor,
+                                           maxworkers=self._maxworkers)
+
+    def deactivate(self):
+        if not self.active:
+            return
+        writer, self._writer = self._writer, None
+        md = dict(self._md)
+        if self._frame0_md:
+            md[_FRAME_MD_KEY] = self._frame0_md
+        if md:
+            writer.description = json.dumps(md, default=_json_default)
+        writer.close()
+        super(tifffile_Sink, self).deactivate()
+        if self._frames and (min(self._frames) != 0 or
+                             max(self._frames) != len(self._frames) - 1):
+            raise ValueError("did not provide continuous frames")
 
     @require_active
     def record_frame(self, img, frame_number, frame_md=None):
-        if frame_number != 0:
-            raise NotImplementedError("have not written this code yet")
         # if boolean, up-cast to uint8 because tifffile can't write bools
         if img.dtype.kind == 'b':
             img = img.astype('uint8')
-        tifffile.imsave(self.backing_file, img)
+        description = None
+        if frame_number == 0:
+            # goes in the description of the first page with the
+            # global metadata
+            self._frame0_md = dict(frame_md) if frame_md else None
+        elif frame_md:
+            description = json.dumps({_FRAME_MD_KEY: dict(frame_md)},
+                                     default=_json_default)
+        self._writer.save(img, index=frame_number, description=description)
+        self._frames.add(frame_number)
 
     def set_metadata(self, md_dict):
-        raise NotImplementedError("have not done this yet")
+        if _FRAME_MD_KEY in md_dict:
+            raise ValueError("{!r} is reserved for frame-level "
+                             "metadata".format(_FRAME_MD_KEY))
+        self._md.update(md_dict)
 
     def make_source(self, klass_hint=None):
         if klass_hint is not None:
             raise NotImplementedError("have not implemented this yet")
 
-        return tifffile_read2D_Handler(self.fname,
+        return tifffile_read2D_Handler(self.backing_file,
                                        self.resolution,
                                        self.resolution_units)
+
+
+def _json_default(obj):
+    # nested MD_dict and numpy values in the metadata
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return six.text_type(obj)
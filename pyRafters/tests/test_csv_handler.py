@@ -1,6 +1,7 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import six
+import csv
 
 from testing_helpers import namedtmpfile
 from numpy.testing import assert_almost_equal
@@ -9,8 +10,10 @@ import numpy as np
 from pyRafters.handler_base import RequireActive
 
 from pyRafters.handlers.csv_handler import (csv_dist_sink,
-                                                 csv_dist_source)
-from nose.tools import raises
+                                                 csv_dist_source,
+                                                 csv_table_sink,
+                                                 csv_table_source)
+from nose.tools import raises, assert_equal, assert_raises
 from six.moves import cPickle as pickle
 
 
@@ -90,3 +93,189 @@ def test_snk_pickle(fname):
     sn = csv_dist_sink(fname)
     ck = pickle.dumps(sn)
     pickle.loads(ck)
+
+
+@namedtmpfile('.csv')
+def test_round_trip_chunked(fname):
+    # more bins than one block so several blocks are formatted / parsed
+    np.random.seed(0)
+    n = 150000
+    edges = np.linspace(0, 1, n)
+    vals = np.random.rand(n).astype(np.float32)
+    sn = csv_dist_sink(fname)
+    sn.activate()
+    sn.write_dist(edges, vals)
+    sn.deactivate()
+
+    sr = sn.make_source()
+    sr.activate()
+    # repr round-trips exactly
+    np.testing.assert_array_equal(sr.bin_edges(), edges)
+    np.testing.assert_array_equal(sr.values(), vals)
+    assert sr.values().dtype == np.float32
+
+    chunks = list(sr.iter_chunks(chunk_size=40000))
+    sr.deactivate()
+    assert [len(e) for e, v in chunks] == [40000, 40000, 40000, 30000]
+    np.testing.assert_array_equal(np.concatenate([e for e, v in chunks]),
+                                  edges)
+
+
+@namedtmpfile('.csv')
+def test_write_dist_chunks(fname):
+    def gen():
+        for j in range(5):
+            yield np.arange(10) + 10 * j, np.arange(10, dtype=np.int16)
+
+    sn = csv_dist_sink(fname)
+    sn.activate()
+    sn.write_dist_chunks(gen())
+    sn.deactivate()
+
+    sr = csv_dist_source(fname)
+    sr.activate()
+    np.testing.assert_array_equal(sr.bin_edges(), np.arange(50))
+    np.testing.assert_array_equal(sr.values(), np.tile(np.arange(10), 5))
+    assert sr.values().dtype == np.int16
+    sr.deactivate()
+
+
+@namedtmpfile('.csv')
+def test_csv_kwargs(fname):
+    edges = np.linspace(0, 1, 100)
+    vals = np.arange(100)
+    # the first goes through the vectorized path, the second through
+    # the csv module
+    for kwargs in ({'delimiter': '\t'},
+                   {'delimiter': ';', 'quoting': csv.QUOTE_NONNUMERIC}):
+        sn = csv_dist_sink(fname, csv_kwargs=kwargs)
+        sn.activate()
+        sn.write_dist(edges, vals)
+        sn.deactivate()
+
+        sr = sn.make_source()
+        sr.activate()
+        assert_almost_equal(sr.bin_edges(), edges)
+        assert_almost_equal(sr.values(), vals)
+        sr.deactivate()
+
+
+def _table(n, offset=0):
+    tbl = np.zeros(n, dtype=[('frame', np.int64), ('x', np.float64),
+                             ('label', 'U8')])
+    tbl['frame'] = np.arange(offset, offset + n)
+    tbl['x'] = np.random.rand(n)
+    tbl['label'] = ['pk{}'.format(j % 7) for j in range(offset, offset + n)]
+    return tbl
+
+
+@namedtmpfile('.csv')
+def test_table_round_trip(fname):
+    np.random.seed(0)
+    tbl = _table(100)
+    snk = csv_table_sink(fname)
+    with snk:
+        snk.write_table(tbl[:5], snk._table_name)
+        # not appending, replaces the table
+        snk.write_table(tbl, snk._table_name)
+    # infer the dtypes from the file
+    src = csv_table_source(fname, infer_rows=10)
+    with src:
+        name, = src.table_keys()
+        assert_equal(src.dtype.names, ('frame', 'x', 'label'))
+        assert_equal(src.dtype['frame'], np.int64)
+        data = src.read_table(name)
+        np.testing.assert_array_equal(data, tbl)
+        assert_equal(src.table_length(name), 100)
+        part = src.read_table(name, columns=['x', 'frame'],
+                              rows=slice(10, 40, 3))
+        assert_equal(part.dtype.names, ('x', 'frame'))
+        np.testing.assert_array_equal(part['x'], tbl['x'][10:40:3])
+        one = src.read_table(name, columns=['label'], rows=[7, 2, -1])
+        np.testing.assert_array_equal(one['label'], tbl['label'][[7, 2, -1]])
+        blocks = list(src.iter_rows(name, chunk_size=30, columns=['frame']))
+        assert_equal([len(b) for b in blocks], [30, 30, 30, 10])
+        assert_raises(KeyError, src.read_table, name, ['z'])
+        assert_raises(KeyError, src.read_table, 'other')
+        assert_raises(IndexError, src.read_table, name, None, [100])
+
+
+@namedtmpfile('.csv')
+def test_table_append(fname):
+    np.random.seed(0)
+    tbl = _table(25)
+    snk = csv_table_sink(fname, table_name='peaks', append=True,
+                         chunk_rows=8)
+    with snk:
+        for j in range(21):
+            snk.write_table(tbl[j:j + 1], 'peaks')
+    with snk:
+        snk.write_table(tbl[21:], 'peaks')
+        assert_raises(ValueError, snk.write_table, tbl, 'other')
+    with snk.make_source() as src:
+        np.testing.assert_array_equal(src.read_table('peaks'), tbl)
+    # a new sink appends to the existing file, but checks the columns
+    snk = csv_table_sink(fname, table_name='peaks', append=True)
+    snk.activate()
+    snk.write_table(np.zeros(2, dtype=[('a', float)]), 'peaks')
+    assert_raises(ValueError, snk.deactivate)
+
+
+@namedtmpfile('.csv')
+def test_table_quoting(fname):
+    tbl = np.zeros(3, dtype=[('n', np.int16), ('note', 'U16')])
+    tbl['n'] = [1, 2, 3]
+    tbl['note'] = ['plain', 'a, b', 'say "hi"\nthere']
+    snk = csv_table_sink(fname)
+    with snk:
+        snk.write_table(tbl, snk._table_name)
+    src = snk.make_source()
+    with src:
+        # a quoted field which spans a line break is kept together
+        blocks = list(src.iter_rows(src.table_keys()[0], chunk_size=1))
+    np.testing.assert_array_equal(np.concatenate(blocks), tbl)
+    assert_equal(blocks[0].dtype['n'], np.int16)
+
+
+@namedtmpfile('.csv')
+def test_table_bytes(fname):
+    tbl = np.zeros(3, dtype=[('n', np.int64), ('tag', 'S12')])
+    tbl['n'] = [1, 2, 3]
+    tbl['tag'] = [b'plain', b'a, b', b'say "hi"']
+    snk = csv_table_sink(fname)
+    with snk:
+        snk.write_table(tbl, snk._table_name)
+    with csv_table_source(fname) as src:
+        data = src.read_table(src.table_keys()[0])
+    np.testing.assert_array_equal(data['n'], tbl['n'])
+    np.testing.assert_array_equal(data['tag'],
+                                  ['plain', 'a, b', 'say "hi"'])
+
+
+@namedtmpfile('.csv')
+def test_table_dtype(fname):
+    with open(fname, 'wt') as fout:
+        fout.write('a\tb\n1\tx\n\n2.5\tlonger\n')
+    src = csv_table_source(fname, csv_kwargs={'delimiter': '\t'},
+                           infer_rows=1)
+    with src:
+        assert_equal(src.dtype['b'], np.dtype('U1'))
+        # the first row does not show that `a` is float or how long
+        # `b` gets
+        assert_raises(ValueError, src.read_table, src.table_keys()[0])
+    src = csv_table_source(fname, csv_kwargs={'delimiter': '\t'},
+                           dtype={'a': np.float32, 'b': 'U6'})
+    with src:
+        data = src.read_table(src.table_keys()[0])
+    assert_equal(data.dtype['a'], np.float32)
+    np.testing.assert_array_equal(data['a'], [1, 2.5])
+    np.testing.assert_array_equal(data['b'], ['x', 'longer'])
+
+
+@namedtmpfile('.csv')
+def test_table_pickle(fname):
+    src = csv_table_source(fname, dtype={'a': float})
+    pickle.loads(pickle.dumps(src))
+    snk = csv_table_sink(fname, append=True)
+    snk2 = pickle.loads(pickle.dumps(snk))
+    assert snk2._append
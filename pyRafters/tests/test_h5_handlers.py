@@ -0,0 +1,248 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import six
+from six.moves import range
+import pickle
+import threading
+import time
+
+import h5py
+from pyRafters.handlers.h5_handlers import (HdfFrameSource, HdfFrameSink,
+                                            HdfImageSource, HdfImageSink,
+                                            HdfVolumeSink, HdfVolumeSource,
+                                            HdfRawTomoData,
+                                            HdfTableSink, TimeoutError)
+from pyRafters.utils import MD_dict
+import synthetic_data as sd
+from testing_helpers import namedtmpfile
+import numpy as np
+from numpy.testing import assert_array_equal
+from nose.tools import (assert_equal, assert_true, assert_raises,
+                        raises)
+
+
+def _write_stack(fname, data, **kwargs):
+    snk = HdfImageSink(fname, **kwargs)
+    with snk:
+        for j, frame in enumerate(data):
+            snk.record_frame(frame, j, {'n': j})
+        snk.set_metadata({'name': 'test', 'nested': {'a': 2}})
+    return snk
+
+
+@namedtmpfile('.h5')
+def test_image_roundtrip(fname):
+    data = sd.random((12, 16, 8), scale=256, dtype=np.uint16)
+    snk = _write_stack(fname, data, chunks=(5, 16, 8))
+    src = snk.make_source()
+    assert_true(isinstance(src, HdfImageSource))
+    with src:
+        assert_equal(len(src), 12)
+        assert_equal(src.chunks, (5, 16, 8))
+        for j in range(len(src)):
+            assert_array_equal(src.get_frame(j), data[j])
+            assert_equal(src.get_frame_metadata(j, 'n'), j)
+        assert_array_equal(src.get_frame(-1), data[-1])
+        assert_array_equal(np.array(list(src)), data)
+        assert_equal(src.get_metadata('nested.a'), 2)
+        assert_raises(KeyError, src.get_frame_metadata, 0, 'missing')
+        assert_raises(IndexError, src.get_frame, 12)
+
+    with h5py.File(fname, 'r') as F:
+        assert_equal(F['frames'].compression, 'gzip')
+        assert_equal(F['frames'].maxshape, (None, 16, 8))
+
+
+@namedtmpfile('.h5')
+def test_get_frames(fname):
+    data = sd.random((23, 4, 6), scale=1, dtype=np.float64)
+    snk = _write_stack(fname, data, chunks=(4, 4, 6), compression=None)
+    with snk.make_source() as src:
+        assert_array_equal(src.get_frames(slice(None)), data)
+        assert_array_equal(src.get_frames(slice(3, 17, 5)), data[3:17:5])
+        assert_array_equal(src[2:9], data[2:9])
+        nums = [22, 0, 5, 4, 13, 5, -2]
+        assert_array_equal(src.get_frames(nums), data[nums])
+        assert_equal(src.get_frames([]).shape, (0, 4, 6))
+
+
+@namedtmpfile('.h5')
+def test_out_of_order(fname):
+    data = sd.random((6, 3, 3), scale=256, dtype=np.uint8)
+    snk = HdfFrameSink(fname, base_group_name='entry/data')
+    with snk:
+        for j in (4, 0, 5, 2, 1, 3):
+            snk.record_frame(data[j], j)
+    with snk.make_source() as src:
+        assert_array_equal(src.get_frames(range(6)), data)
+
+    snk = HdfFrameSink(fname, frame_dim=2)
+    with assert_raises(ValueError):
+        with snk:
+            snk.record_frame(data[0], 0)
+            snk.record_frame(data[1], 2)
+    with snk:
+        assert_raises(ValueError, snk.record_frame, data, 0)
+
+
+@namedtmpfile('.h5')
+def test_volume_and_tomo(fname):
+    data = sd.random((2, 3, 4, 5), scale=1, dtype=np.float32)
+    snk = HdfVolumeSink(fname)
+    with snk:
+        for j, vol in enumerate(data):
+            snk.record_frame(vol, j)
+        assert_raises(ValueError, snk.record_frame, data[0, 0], 2)
+    src = snk.make_source()
+    assert_true(isinstance(src, HdfVolumeSource))
+    with src:
+        assert_array_equal(src.get_frame(1), data[1])
+
+    proj = sd.random((7, 9, 5), scale=1, dtype=np.float32)
+    _write_stack(fname, proj, chunks=(3, 2, 5))
+    with HdfRawTomoData(fname) as src:
+        sinos = list(src.iter_by_sinogram())
+        assert_equal(len(sinos), 9)
+        for j, sino in enumerate(sinos):
+            assert_array_equal(sino, proj[:, j, :])
+        assert_array_equal(np.array(list(src.iter_by_projection())), proj)
+
+
+@namedtmpfile('.h5')
+def test_pickle(fname):
+    data = sd.random((3, 4, 4), scale=256, dtype=np.uint8)
+    snk = _write_stack(fname, data)
+    src = pickle.loads(pickle.dumps(snk.make_source()))
+    with src:
+        assert_array_equal(src[1], data[1])
+
+    snk2 = pickle.loads(pickle.dumps(HdfImageSink(fname, chunks=(1, 4, 4))))
+    assert_equal(snk2.kwarg_dict['chunks'], (1, 4, 4))
+
+
+@raises(ValueError)
+@namedtmpfile('.h5')
+def test_frame_dim_check(fname):
+    data = sd.random((3, 4, 4), scale=256, dtype=np.uint8)
+    _write_stack(fname, data)
+    with HdfVolumeSource(fname):
+        pass
+
+
+def _table(n, offset=0):
+    tbl = np.zeros(n, dtype=[('frame', 'i8'), ('x', 'f8'), ('y', 'f4')])
+    tbl['frame'] = np.arange(offset, offset + n)
+    tbl['x'] = tbl['frame'] * .5
+    tbl['y'] = -tbl['frame']
+    return tbl
+
+
+@namedtmpfile('.h5')
+def test_table_read(fname):
+    tbl = _table(100)
+    snk = HdfTableSink(fname, chunk_rows=16, base_group_name='results')
+    with snk:
+        snk.write_table(tbl, 'peaks')
+        snk.write_table(tbl[:3], 'other')
+        snk.write_table(tbl[:5], 'other')
+    src = snk.make_source()
+    with src:
+        assert_equal(sorted(src.table_keys()), ['other', 'peaks'])
+        assert_array_equal(src.read_table('other'), tbl[:5])
+        assert_array_equal(src.read_table('peaks'), tbl)
+        assert_equal(src.table_length('peaks'), 100)
+        part = src.read_table('peaks', columns=['x', 'frame'],
+                              rows=slice(10, 40, 3))
+        assert_equal(part.dtype.names, ('x', 'frame'))
+        assert_array_equal(part['x'], tbl['x'][10:40:3])
+        assert_array_equal(part['frame'], tbl['frame'][10:40:3])
+        one = src.read_table('peaks', columns=['y'], rows=[7, 2, 2, -1])
+        assert_equal(one.dtype.names, ('y', ))
+        assert_array_equal(one['y'], tbl['y'][[7, 2, 2, -1]])
+        assert_array_equal(src.read_table('peaks', rows=slice(None, None,
+                                                              -7)),
+                           tbl[::-7])
+        assert_raises(KeyError, src.read_table, 'peaks', ['z'])
+        assert_raises(IndexError, src.read_table, 'peaks', None, [100])
+        blocks = list(src.iter_rows('peaks', columns=['frame']))
+        assert_equal(len(blocks), 7)
+        assert_array_equal(np.concatenate(blocks)['frame'], tbl['frame'])
+
+
+@namedtmpfile('.h5')
+def test_table_append(fname):
+    snk = HdfTableSink(fname, append=True, chunk_rows=8)
+    with snk:
+        for j in range(21):
+            snk.write_table(_table(1, j), 'peaks')
+    with snk:
+        snk.write_table(_table(4, 21), 'peaks')
+        assert_raises(ValueError, snk.write_table, np.zeros(2), 'peaks')
+    with snk.make_source() as src:
+        assert_array_equal(src.read_table('peaks'), _table(25))
+    with h5py.File(fname, 'r') as F:
+        assert_equal(F['peaks'].chunks, (8, ))
+
+
+@namedtmpfile('.h5')
+def test_swmr(fname):
+    data = sd.random((6, 4, 5), scale=256, dtype=np.uint8)
+    snk = HdfImageSink(fname, swmr=True, frame_shape=(4, 5), dtype='u1')
+    snk.set_metadata({'name': 'live', 'n': 6})
+    with snk:
+        assert_raises(RuntimeError, snk.set_metadata, {'late': 1})
+        src = snk.make_source()
+        assert_true(src.swmr)
+        with src:
+            assert_equal(len(src), 0)
+            assert_equal(src.get_metadata('n'), 6)
+            snk.record_frame(data[0], 0, {'t': 0})
+            snk.record_frame(data[2], 2, {'t': 2})
+            # frame 2 is held back until frame 1 arrives
+            assert_equal(len(src), 1)
+            assert_array_equal(src.wait_for_frame(0, timeout=0), data[0])
+            assert_raises(TimeoutError, src.wait_for_frame, 2, .05, .01)
+            snk.record_frame(data[1], 1, {'t': 1})
+            assert_equal(len(src), 3)
+            assert_array_equal(src.get_frames([2, 1]), data[[2, 1]])
+            assert_equal(src.get_frame_metadata(2, 't'), 2)
+
+            def write_rest():
+                time.sleep(.05)
+                for j in range(3, 6):
+                    snk.record_frame(data[j], j)
+            th = threading.Thread(target=write_rest)
+            th.start()
+            try:
+                assert_array_equal(src.wait_for_frame(5, timeout=10),
+                                   data[5])
+            finally:
+                th.join()
+            assert_array_equal(np.array(list(src)), data)
+
+    with HdfImageSource(fname) as src:
+        assert_array_equal(src.get_frames(slice(None)), data)
+        assert_equal(src.get_frame_metadata(1, 't'), 1)
+
+
+@namedtmpfile('.h5')
+def test_swmr_no_frames(fname):
+    snk = HdfFrameSink(fname, swmr=True)
+    snk.set_metadata({'name': 'empty', 'nested': {'a': 2}})
+    with snk:
+        pass
+    with h5py.File(fname, 'r') as F:
+        md = MD_dict.read_hdf_group(F['frames_md'])
+    assert_equal(md['name'].value, 'empty')
+    assert_equal(md['nested.a'].value, 2)
+
+
+@namedtmpfile('.h5')
+def test_swmr_gap(fname):
+    snk = HdfFrameSink(fname, swmr=True)
+    with assert_raises(ValueError):
+        with snk:
+            snk.record_frame(np.ones((2, 2)), 0)
+            snk.record_frame(np.ones((2, 2)), 2)
+    with HdfFrameSource(fname) as src:
+        assert_equal(len(src), 3)
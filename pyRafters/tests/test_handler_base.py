@@ -72,3 +72,92 @@ def test_context():
         assert_true(tst.active)
 
     assert_false(a.active)
+
+
+def test_registry_extension():
+    from pyRafters.handler_base import (handler_registry, BaseSource,
+                                        BaseSink, DistributionSink)
+    from pyRafters.handlers.tiff_handler import (tifffile_read2D_Handler,
+                                                 tifffile_Sink)
+    from pyRafters.handlers.csv_handler import csv_dist_sink
+
+    for ext in ('tif', '.tif', '*.tif', '/tmp/a.TIF'):
+        srcs = handler_registry.by_extension(ext, BaseSource)
+        assert_true(tifffile_read2D_Handler in srcs)
+        assert_false(tifffile_Sink in srcs)
+        assert_true(tifffile_Sink in handler_registry.by_extension(ext,
+                                                                   BaseSink))
+    assert_equal(handler_registry.by_extension('csv', DistributionSink),
+                 [csv_dist_sink])
+    assert_equal(handler_registry.by_extension('not_an_ext'), [])
+
+
+def test_registry_base():
+    from pyRafters.handler_base import (available_handler_list,
+                                        DistributionSink)
+    from pyRafters.handlers.csv_handler import csv_dist_sink
+    from pyRafters.handlers.np_handler import np_dist_sink
+    from pyRafters.handlers.npz_handler import npz_dist_sink
+    from pyRafters.handlers.base_file_handlers import FileHandler
+
+    d_sinks = available_handler_list(DistributionSink)
+    assert_true(csv_dist_sink in d_sinks)
+    assert_true(np_dist_sink in d_sinks)
+    assert_equal(set(available_handler_list(DistributionSink,
+                                            [FileHandler])),
+                 {csv_dist_sink, npz_dist_sink})
+    # the abstract base class is not included, concrete ones are
+    assert_equal(available_handler_list(dummy_activate), [dummy_activate])
+
+
+def test_lazy_handlers():
+    import pyRafters.handlers as handlers
+    from pyRafters.handlers.csv_handler import csv_dist_source
+    assert_true(handlers.csv_dist_source is csv_dist_source)
+    from pyRafters.handlers.tiff_handler import tifffile_Sink
+    assert_true(handlers.tifffile_Sink is tifffile_Sink)
+    for name in handlers._lazy_handlers:
+        assert_true(isinstance(getattr(handlers, name), type), name)
+        assert_true(name in dir(handlers), name)
+    assert_false(hasattr(handlers, 'no_such_handler'))
+
+
+_query_script = """
+import sys
+from pyRafters.handler_base import handler_registry, BaseSource
+import pyRafters.handlers
+handler_registry.by_extension('csv', BaseSource)
+print(' '.join(sorted(m for m in sys.modules
+                      if m.startswith('pyRafters.handlers.'))))
+"""
+
+
+def test_registry_lazy_plugins():
+    # run in a new interpreter, the plugins are all loaded in this one
+    import os
+    import sys
+    import subprocess
+    import pyRafters
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(pyRafters.__file__))] +
+        [p for p in [env.get('PYTHONPATH')] if p])
+    out = subprocess.check_output([sys.executable, '-c', _query_script],
+                                  env=env)
+    loaded = set(out.decode('ascii').split())
+    assert_true('pyRafters.handlers.csv_handler' in loaded)
+    for mod in ('h5_handlers', 'tiff_handler', 'image_handler',
+                'npz_handler'):
+        assert_false('pyRafters.handlers.' + mod in loaded, mod)
+
+
+def test_registry_weak():
+    import gc
+    from pyRafters.handler_base import handler_registry
+
+    class transient(dummy_activate):
+        pass
+    assert_true(transient in handler_registry.handlers(dummy_activate))
+    del transient
+    gc.collect()
+    assert_equal(handler_registry.handlers(dummy_activate), [dummy_activate])
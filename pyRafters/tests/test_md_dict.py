@@ -3,11 +3,14 @@ from __future__ import (absolute_import, division, print_function,
 import six
 
 import h5py
+import numpy as np
+from numpy.testing import assert_array_equal
 
 from six.moves import xrange
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_true, assert_raises
 
-from pyRafters.utils import MD_dict, md_value
+from pyRafters.utils import MD_dict, LazyMD_dict, md_value
+from testing_helpers import namedtmpfile
 
 
 def test_string():
@@ -66,3 +69,195 @@ def test_hdf_simple_roundtrip():
     tt2 = MD_dict.read_hdf_group(g)
 
     assert_equal(tt, tt2)
+
+
+def test_hdf_compact_roundtrip():
+    F = h5py.File('test.h5', driver='core', mode='w', backing_store=False)
+    tt = MD_dict()
+    tt['name'] = 'test'
+    tt['a.a'] = 1
+    tt['a.b'] = md_value(2, 'counts')
+    tt['a.c.d'] = md_value(.5, 'm')
+    tt['a.c.e'] = md_value(np.arange(5), 's')
+    tt['big'] = md_value(np.arange(1000.), 'm')
+
+    g = F.require_group('md_test')
+    tt.write_hdf(g, compact=True)
+    # small leaves are attributes, big ones datasets
+    assert_equal(set(g.keys()), {'a', 'big'})
+    assert_true('name' in g.attrs)
+    assert_equal(set(g['a'].keys()), {'c'})
+    assert_true('units' in g['big'].attrs)
+
+    tt2 = MD_dict.read_hdf_group(g)
+    assert_equal(set(tt), set(tt2))
+    for k in tt:
+        assert_equal(tt[k].units, tt2[k].units)
+        assert_array_equal(tt[k].value, tt2[k].value)
+    assert_equal(tt2['name'], md_value('test', 'text'))
+    assert_equal(tt2['a.b'], md_value(2, 'counts'))
+
+    # existing entries are only replaced when asked, in either layout
+    tt3 = MD_dict()
+    tt3['a.b'] = md_value(3, None)
+    tt3['big'] = md_value(7, 'm')
+    assert_raises(ValueError, tt3.write_hdf, g, compact=True)
+    tt3.write_hdf(g, overwrite=True)
+    tt4 = MD_dict.read_hdf_group(g)
+    assert_equal(tt4['a.b'], md_value(3, None))
+    assert_equal(tt4['big'], md_value(7, 'm'))
+    assert_equal(tt4['a.c.d'], md_value(.5, 'm'))
+
+
+def test_hdf_lazy():
+    F = h5py.File('test.h5', driver='core', mode='w', backing_store=False)
+    tt = MD_dict()
+    tt['name'] = 'test'
+    tt['a.stamps'] = md_value(np.arange(5000.), 's')
+    tt['a.b'] = md_value(2, 'counts')
+    g = F.require_group('md_test')
+    tt.write_hdf(g, compact=True)
+
+    lazy = LazyMD_dict.read_hdf_group(g)
+    assert_equal(set(lazy), set(tt))
+    # only the dataset leaf is deferred
+    leaf = lazy._dict['a']._dict['stamps']
+    assert_true(leaf._value is None)
+    assert_equal(lazy['a.stamps'].units, 's')
+    assert_array_equal(lazy['a']['stamps'].value, np.arange(5000.))
+    assert_true(leaf._value is not None)
+    assert_equal(lazy['a.b'], md_value(2, 'counts'))
+
+    # lazy trees can be written back out
+    g2 = F.require_group('copy')
+    lazy.write_hdf(g2)
+    assert_array_equal(MD_dict.read_hdf_group(g2)['a.stamps'].value,
+                       np.arange(5000.))
+
+    no_cache = LazyMD_dict.read_hdf_group(g, cache=False)
+    assert_array_equal(no_cache['a.stamps'].value, np.arange(5000.))
+    assert_true(no_cache._dict['a']._dict['stamps']._value is None)
+    F.close()
+    assert_raises(RuntimeError, no_cache.__getitem__, 'a.stamps')
+    # cached values outlive the file
+    assert_array_equal(lazy['a.stamps'].value, np.arange(5000.))
+
+
+def _assert_hdf_md(g, md):
+    from_file = MD_dict.read_hdf_group(g)
+    assert_equal(set(from_file), set(md))
+    for k in md:
+        assert_equal(from_file[k].units, md[k].units)
+        assert_array_equal(from_file[k].value, md[k].value)
+
+
+def test_hdf_incremental():
+    F = h5py.File('test.h5', driver='core', mode='w', backing_store=False)
+    g = F.require_group('md_test')
+    tt = MD_dict()
+    tt['name'] = 'test'
+    tt['a.a'] = 1
+    tt['a.b'] = md_value(np.arange(3000), 'counts')
+    tt['c'] = md_value(2., 'm')
+    tt.write_hdf(g, compact=True, incremental=True)
+
+    # writing again with no changes touches nothing
+    g['a']['b'].attrs['marker'] = 1
+    tt.write_hdf(g, compact=True, incremental=True)
+    assert_true('marker' in g['a']['b'].attrs)
+
+    # only changed keys are re-written
+    tt['a.a'] = 5
+    tt['d.e.f'] = md_value(3, 's')
+    del tt['c']
+    tt.write_hdf(g, compact=True, incremental=True)
+    assert_true('marker' in g['a']['b'].attrs)
+    _assert_hdf_md(g, tt)
+    assert_true('c' not in g.attrs and 'c' not in g)
+
+    # leaves and branches can replace each other
+    del tt['d']
+    tt['d'] = 7
+    del tt['a.a']
+    tt['a.a.x'] = 1
+    tt.write_hdf(g, incremental=True)
+    _assert_hdf_md(g, tt)
+
+    # an MD_dict read from a group is in sync with it
+    tt2 = MD_dict.read_hdf_group(g)
+    tt2['name'] = 'other'
+    tt2.write_hdf(g, incremental=True)
+    assert_equal(MD_dict.read_hdf_group(g)['name'].value, 'other')
+
+    # other groups get the whole tree
+    g2 = F.require_group('other')
+    tt.write_hdf(g2, incremental=True)
+    _assert_hdf_md(g2, tt)
+
+
+def test_hdf_incremental_recreate_branch():
+    F = h5py.File('test.h5', driver='core', mode='w', backing_store=False)
+    g = F.require_group('md_test')
+    tt = MD_dict({'d': {'x': 1, 'y': 2}, 'n': 1})
+    for compact in (False, True):
+        tt.write_hdf(g, compact=compact, incremental=True)
+        del tt['d']
+        tt['d.x'] = 3
+        tt.write_hdf(g, compact=compact, incremental=True)
+        _assert_hdf_md(g, tt)
+        tt['d.y'] = 2
+    F.close()
+
+
+@namedtmpfile('.h5')
+def test_hdf_incremental_new_file(fname):
+    tt = MD_dict({'name': 'test', 'a': {'b': 1}})
+    with h5py.File(fname, 'w') as F:
+        tt.write_hdf(F.require_group('md'), incremental=True)
+    # a new file at the same path gets the whole tree
+    with h5py.File(fname, 'w') as F:
+        tt.write_hdf(F.require_group('md'), incremental=True)
+        _assert_hdf_md(F['md'], tt)
+    with h5py.File(fname, 'r') as F:
+        tt2 = MD_dict.read_hdf_group(F['md'])
+    tt2['z'] = 3
+    with h5py.File(fname, 'w') as F:
+        tt2.write_hdf(F.require_group('md'), incremental=True)
+        _assert_hdf_md(F['md'], tt2)
+        assert_equal(len(MD_dict.read_hdf_group(F['md'])), 3)
+
+
+def test_flat_index():
+    tt = MD_dict({'name': 'test', 'det': {'x': 1, 'y': (2, 'mm')}})
+    assert_equal(len(tt), 3)
+    assert_equal(tt['det.y'], md_value(2, 'mm'))
+    assert_true('det.x' in tt)
+    assert_true('det' in tt)
+
+    # missing keys raise and do not grow the tree
+    assert_raises(KeyError, tt.__getitem__, 'missing.a')
+    assert_true('missing' not in tt)
+    assert_equal(tt.get('missing.a'), None)
+    assert_equal(len(tt), 3)
+    assert_raises(KeyError, tt.__setitem__, 'name.a', 1)
+    assert_raises(KeyError, tt.__delitem__, 'det.z')
+
+    # sub trees are live views
+    det = tt.subtree('det')
+    assert_equal(set(det), {'x', 'y'})
+    assert_equal(len(det), 2)
+    det['z.w'] = 3
+    assert_equal(tt['det.z.w'], md_value(3, None))
+    assert_equal(len(tt), 4)
+    assert_equal(len(det), 3)
+    assert_equal(tt.subtree('det.z')['w'].value, 3)
+    assert_raises(KeyError, tt.subtree, 'nope')
+
+    # replacing and deleting branches keeps the index in step
+    tt['det.z'] = 5
+    assert_raises(KeyError, tt.__getitem__, 'det.z.w')
+    assert_equal(len(tt), 4)
+    del tt['det']
+    assert_equal(set(tt), {'name'})
+    assert_equal(len(tt), 1)
+    assert_true('det.x' not in tt)
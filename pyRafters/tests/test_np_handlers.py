@@ -2,13 +2,16 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import six
 from six.moves import range
+import pickle
+from pyRafters.handler_base import FrameSource
+from pyRafters.utils import FrameMDStore
 from pyRafters.handlers.np_handler import (NPFrameSink,
                                                 np_frame_source,
                                                 NPImageSource,
                                                 NPImageSink)
 import numpy as np
 from numpy.testing import assert_array_equal
-from nose.tools import assert_true, assert_equal, raises
+from nose.tools import assert_true, assert_equal, assert_raises, raises
 
 
 def test_np_framesource():
@@ -18,6 +21,42 @@ def test_np_framesource():
         for j in range(11):
             assert_true(np.all(np_src.get_frame(j) == j))
             assert_array_equal(np_src.get_frame(j), test_data[j])
+        assert_array_equal(test_data[2:9:3], np_src.get_frames(slice(2, 9, 3)))
+        assert_array_equal(test_data[[4, 0]], np_src.get_frames([4, 0]))
+
+
+def test_np_framesource_nocopy():
+    shape = (13, 17)
+    test_data = np.array([np.ones(shape) * j for j in range(11)])
+    with np_frame_source(test_data, 2, copy=False) as np_src:
+        frames = [np_src.get_frame(3), np_src[3], next(iter(np_src)),
+                  np_src.get_frames(slice(0, 2))]
+        for frame in frames:
+            assert_true(np.shares_memory(frame, test_data))
+            assert_true(not frame.flags.writeable)
+        # the caller's array is untouched
+        assert_true(test_data.flags.writeable)
+        test_data[3] = -1
+        assert_array_equal(np_src.get_frame(3), -1)
+    assert_true(not pickle.loads(pickle.dumps(np_src))._copy)
+    # copy mode still hands out private copies
+    with np_frame_source(test_data, 2) as np_src:
+        frame = np_src.get_frame(3)
+        assert_true(frame.flags.writeable)
+        assert_true(not np.shares_memory(frame, test_data))
+
+
+def test_np_framesource_copy_access():
+    shape = (13, 17)
+    test_data = np.array([np.ones(shape) * j for j in range(11)])
+    with np_frame_source(test_data, 2) as np_src:
+        for j in range(11):
+            np_src[j][:] = -1
+        next(iter(np_src))[:] = -1
+        np_src[2:5][:] = -1
+        for j, frame in enumerate(np_src):
+            assert_array_equal(frame, test_data[j])
+            assert_array_equal(np_src.get_frame(j), test_data[j])
 
 
 def test_np_framesrouce_rt():
@@ -67,3 +106,107 @@ def test_np_framesink_noncontig():
         snk.record_frame(np.zeros((5, 5)), 5)
 
     snk.make_source()
+
+
+def test_np_frame_md_columns():
+    test_data = np.arange(96, dtype=np.float32).reshape(6, 4, 4)
+    np_snk = NPFrameSink(2)
+    with np_snk as snk:
+        snk.record_frames(test_data[:4],
+                          frame_md={'exposure': [.1, .2, .3, .4]})
+        for j in (4, 5):
+            snk.record_frame(test_data[j], j, {'exposure': j,
+                                               'label': 'f{}'.format(j)})
+    src = np_snk.make_source()
+    with src:
+        assert_array_equal(src.get_frame_metadata_column('exposure'),
+                           [.1, .2, .3, .4, 4, 5])
+        assert_equal(src.get_frame_metadata(5, 'exposure'), 5)
+        assert_equal(src.get_frame_metadata(-1, 'label'), 'f5')
+        labels = src.get_frame_metadata_column('label')
+        assert_array_equal(labels.mask, [True] * 4 + [False] * 2)
+        assert_raises(KeyError, src.get_frame_metadata, 0, 'label')
+        assert_raises(KeyError, src.get_frame_metadata_column, 'nope')
+        # the base implementation agrees
+        base = FrameSource.get_frame_metadata_column(src, 'exposure')
+        assert_array_equal(base, [.1, .2, .3, .4, 4, 5])
+        base = FrameSource.get_frame_metadata_column(src, 'label')
+        assert_array_equal(base.mask, labels.mask)
+
+    src2 = pickle.loads(pickle.dumps(src))
+    with src2:
+        assert_equal(src2.get_frame_metadata(3, 'exposure'), .4)
+
+
+def test_frame_md_store():
+    store = FrameMDStore.from_dicts([{'a': 1}, None, {'a': True, 'b': [1]},
+                                     {'a': 2.5}])
+    assert_equal(len(store), 4)
+    col = store.column('a')
+    # mixed kinds are kept as they are
+    assert_equal(col.dtype, object)
+    assert_array_equal(col.mask, [False, True, False, False])
+    assert_equal(store.get(2, 'b'), [1])
+    store.set_frame(6, {'a': 'text'})
+    assert_equal(len(store), 7)
+    assert_equal(store.get(6, 'a'), 'text')
+    assert_equal(store.get(0, 'a'), 1)
+    assert_equal(store.to_dicts()[2], {'a': True, 'b': [1]})
+    assert_raises(IndexError, store.get, 7, 'a')
+
+
+def test_frame_md_store_kinds():
+    store = FrameMDStore.from_dicts([{'flag': True, 'n': 2**53 + 1,
+                                      'x': np.float32(.5)},
+                                     {'flag': 1.5, 'n': np.int8(3),
+                                      'x': .25}])
+    assert_true(store.get(0, 'flag') is True)
+    assert_equal(store.get(1, 'flag'), 1.5)
+    # promoted within one kind
+    assert_equal(store.column('n').dtype, np.int64)
+    assert_equal(store.column('x').dtype, np.float64)
+    store.set_frame(2, {'n': .5})
+    assert_equal(store.get(0, 'n'), 2**53 + 1)
+    assert_equal(store.get(2, 'n'), .5)
+
+
+def test_np_framesink_buffer():
+    test_data = np.arange(5 * 3 * 4, dtype=np.uint8).reshape(5, 3, 4)
+    # preallocated
+    snk = NPFrameSink(2, n_frames=5, frame_shape=(3, 4), dtype=np.uint8)
+    buf = snk._buffer
+    with snk:
+        for j in range(5):
+            snk.record_frame(test_data[j], j)
+    assert_true(snk._buffer is buf)
+    src = snk.make_source()
+    with src:
+        # handed over with out a copy
+        assert_true(np.shares_memory(src._data, buf))
+        # but the frames handed out are still private copies
+        frame = src.get_frame(0)
+        frame[:] = 0
+        src[1][:] = 0
+        assert_array_equal(src.get_frames(slice(None)), test_data)
+        # re-recording a frame the source holds copies first
+        snk.record_frame(np.zeros((3, 4)), 2)
+        assert_array_equal(src.get_frame(2), test_data[2])
+    assert_true(snk._buffer is not buf)
+    with snk.make_source() as src:
+        assert_array_equal(src.get_frame(2), 0)
+
+    # grown on demand, dtype promoted
+    snk = NPFrameSink(2)
+    with snk:
+        snk.record_frames(test_data)
+        snk.record_frame(np.full((3, 4), .5), 9)
+        assert_equal(len(snk._buffer), 10)
+        assert_raises(ValueError, snk.record_frame, np.zeros((4, 3)), 1)
+    assert_raises(ValueError, snk.make_source)
+    with snk:
+        snk.record_frames(test_data[:4], range(5, 9))
+    with snk.make_source() as src:
+        assert_equal(len(src), 10)
+        assert_equal(src.get_frame(0).dtype, np.float64)
+        assert_array_equal(src.get_frames(range(5, 9)), test_data[:4])
+        assert_array_equal(src.get_frame(9), .5)
@@ -0,0 +1,84 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import six
+
+from testing_helpers import namedtmpfile
+from numpy.testing import assert_array_equal
+import numpy as np
+
+from pyRafters.handler_base import RequireActive
+
+from pyRafters.handlers.npz_handler import (npz_dist_sink,
+                                            npz_dist_source)
+from nose.tools import raises, assert_true, assert_false
+from six.moves import cPickle as pickle
+
+
+def _round_trip(fname, edges, vals, **kwargs):
+    sn = npz_dist_sink(fname, **kwargs)
+    sn.activate()
+    sn.write_dist(edges, vals, right_edge=len(edges) > len(vals))
+    sn.deactivate()
+    return sn.make_source()
+
+
+@namedtmpfile('.npz')
+def test_round_trip_mmap(fname):
+    np.random.seed(0)
+    edges = np.linspace(0, 1, 100)
+    vals = np.random.rand(100).astype(np.float32)
+    sr = _round_trip(fname, edges, vals)
+    sr.activate()
+    # stored exactly and memory-mapped
+    assert_array_equal(sr.bin_edges(), edges)
+    assert_array_equal(sr.values(), vals)
+    assert_true(isinstance(sr.values(), np.memmap))
+    assert_false(sr.values().flags.writeable)
+    assert_false(sr.right)
+    sr.deactivate()
+
+
+@namedtmpfile('.npz')
+def test_round_trip_compressed(fname):
+    edges = np.arange(11)
+    vals = np.arange(10, dtype=np.int16)
+    sr = _round_trip(fname, edges, vals, compress=True)
+    sr.activate()
+    assert_false(isinstance(sr.values(), np.memmap))
+    assert_array_equal(sr.values(), vals)
+    # right edge is kept
+    assert_true(sr.right)
+    assert_array_equal(sr.bin_edges(), edges[:-1])
+    assert_array_equal(sr.bin_edges(include_right=True), edges)
+    assert_array_equal(sr.bin_centers(), edges[:-1] + .5)
+    sr.deactivate()
+
+
+@namedtmpfile('.npz')
+def test_empty(fname):
+    sr = _round_trip(fname, np.array([]), np.array([]))
+    sr.activate()
+    assert len(sr.values()) == 0
+    sr.deactivate()
+
+
+@raises(ValueError)
+@namedtmpfile('.npz')
+def test_bad_length(fname):
+    _round_trip(fname, np.arange(5), np.arange(3))
+
+
+@raises(RequireActive)
+@namedtmpfile('.npz')
+def test_src_active(fname):
+    sn = npz_dist_source(fname)
+    sn.values()
+
+
+@namedtmpfile('.npz')
+def test_pickle(fname):
+    sn = npz_dist_sink(fname, compress=True)
+    sn2 = pickle.loads(pickle.dumps(sn))
+    assert_true(sn2._compress)
+    sr = npz_dist_source(fname)
+    pickle.loads(pickle.dumps(sr))
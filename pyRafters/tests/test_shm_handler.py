@@ -0,0 +1,230 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import six
+from six.moves import range
+from six.moves import cPickle as pickle
+from pyRafters.handlers.shm_handler import (SharedMemFrameSource,
+                                            SharedMemImageSink)
+import numpy as np
+from numpy.testing import assert_array_equal
+from nose.tools import assert_true, assert_false, assert_equal, raises
+from nose import SkipTest
+
+
+def _check_available():
+    if not SharedMemFrameSource.available():
+        raise SkipTest("shared memory not available")
+
+
+def test_shm_pickle_rt():
+    _check_available()
+    shape = (13, 17)
+    test_data = np.array([np.ones(shape) * j for j in range(11)])
+    src = SharedMemFrameSource.from_array(test_data, 2,
+                                          meta_data={'md': 5})
+    try:
+        ck = pickle.dumps(src)
+        # only the name, shape, and dtype are shipped
+        assert_true(len(ck) < test_data.nbytes // 10)
+        remote = pickle.loads(ck)
+        assert_false(remote.owner)
+        with remote as r_src:
+            assert_equal(len(r_src), 11)
+            assert_equal(r_src.get_metadata('md'), 5)
+            for j in range(11):
+                assert_array_equal(r_src.get_frame(j), test_data[j])
+    finally:
+        src.unlink()
+
+
+def test_shm_nocopy():
+    _check_available()
+    test_data = np.arange(24, dtype=np.uint16).reshape(4, 2, 3)
+    src = SharedMemFrameSource.from_array(test_data, 2, copy=False)
+    try:
+        with pickle.loads(pickle.dumps(src)) as r_src:
+            frame = r_src.get_frame(2)
+            assert_false(frame.flags.writeable)
+            assert_array_equal(frame, test_data[2])
+            del frame
+    finally:
+        src.unlink()
+
+
+def test_shm_imagesink_rt():
+    _check_available()
+    shape = (13, 17)
+    test_data = np.array([np.ones(shape) * j for j in range(11)])
+    shm_snk = SharedMemImageSink()
+    with shm_snk as snk:
+        for j in range(11):
+            snk.record_frame(test_data[j], j, {'md': j})
+    shm_src = shm_snk.make_source()
+    assert_true(shm_src.owner)
+    with shm_src as src:
+        for j in range(11):
+            assert_array_equal(src.get_frame(j), test_data[j])
+            assert_equal(src.get_frame_metadata(j, 'md'), j)
+    shm_src.unlink()
+    assert_false(shm_src.owner)
+
+
+@raises(FileNotFoundError)
+def test_shm_unlink():
+    _check_available()
+    src = SharedMemFrameSource.from_array(np.zeros((3, 5, 5)))
+    remote = pickle.loads(pickle.dumps(src))
+    src.unlink()
+    remote.activate()
+
+
+@raises(RuntimeError)
+def test_shm_non_owner_unlink():
+    _check_available()
+    src = SharedMemFrameSource.from_array(np.zeros((3, 5, 5)))
+    try:
+        remote = pickle.loads(pickle.dumps(src))
+        remote.unlink()
+    finally:
+        src.unlink()
+
+
+def test_shm_sink_handover():
+    _check_available()
+    test_data = np.arange(4 * 2 * 3, dtype=np.int32).reshape(4, 2, 3)
+    snk = SharedMemImageSink(n_frames=4, frame_shape=(2, 3), dtype='i4')
+    with snk:
+        snk.record_frames(test_data)
+    shm_name = snk._shm.name
+    src = snk.make_source()
+    # the sink's segment is handed over
+    assert_equal(src.shm_name, shm_name)
+    assert_true(src.owner)
+    with snk:
+        snk.record_frame(test_data[0], 4)
+    src2 = snk.make_source()
+    try:
+        assert_true(src2.shm_name != shm_name)
+        with src as s1, src2 as s2:
+            assert_equal(len(s1), 4)
+            assert_equal(len(s2), 5)
+            assert_array_equal(s1.get_frames(range(4)), test_data)
+            assert_array_equal(s2.get_frame(4), test_data[0])
+    finally:
+        src.unlink()
+        src2.unlink()
+
+
+_worker = """
+import sys
+from six.moves import cPickle as pickle
+src = pickle.loads(sys.stdin.buffer.read())
+with src:
+    sys.stdout.write(str(int(src.get_frame(2).sum())))
+"""
+
+
+def test_shm_other_process():
+    _check_available()
+    import os
+    import sys
+    import subprocess
+    import pyRafters
+    test_data = np.arange(4 * 5 * 5, dtype=np.int64).reshape(4, 5, 5)
+    src = SharedMemFrameSource.from_array(test_data)
+    try:
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(pyRafters.__file__))] +
+            [p for p in [env.get('PYTHONPATH')] if p])
+        proc = subprocess.Popen([sys.executable, '-c', _worker],
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, env=env)
+        out, err = proc.communicate(pickle.dumps(src))
+        assert_equal(proc.returncode, 0, err)
+        assert_equal(int(out), int(test_data[2].sum()))
+        # the worker exiting does not unlink the segment, or warn about
+        # leaking it
+        assert_false(b'leaked' in err, err)
+        with pickle.loads(pickle.dumps(src)) as remote:
+            assert_array_equal(remote.get_frame(3), test_data[3])
+    finally:
+        src.unlink()
+
+
+_pool_script = """
+import os
+import sys
+import numpy as np
+from multiprocessing import get_context
+from pyRafters.handlers.shm_handler import SharedMemFrameSource
+
+
+def total(args):
+    src, n = args
+    with src:
+        return int(src.get_frame(n).sum())
+
+
+if __name__ == '__main__':
+    data = np.arange(4 * 5 * 5).reshape(4, 5, 5)
+    src = SharedMemFrameSource.from_array(data)
+    with get_context(sys.argv[1]).Pool(2) as pool:
+        out = pool.map(total, [(src, j) for j in range(4)])
+    sys.stdout.write(src.shm_name + ' ' + str(sum(out)))
+    sys.stdout.flush()
+    if sys.argv[2] == 'exit':
+        # the owner dies with out unlinking
+        os._exit(0)
+    src.unlink()
+"""
+
+
+def _run_pool(method, how):
+    import os
+    import sys
+    import subprocess
+    import tempfile
+    import pyRafters
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(pyRafters.__file__))] +
+        [p for p in [env.get('PYTHONPATH')] if p])
+    fd, script = tempfile.mkstemp(suffix='.py')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(_pool_script)
+        # the resource tracker shares stderr, communicate returns once
+        # it has exited
+        proc = subprocess.Popen([sys.executable, script, method, how],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, env=env)
+        out, err = proc.communicate()
+    finally:
+        os.remove(script)
+    assert_equal(proc.returncode, 0, err)
+    name, total = out.decode('ascii').split()
+    assert_equal(int(total), int(np.arange(100).sum()))
+    return name, err
+
+
+def test_shm_spawn_pool():
+    _check_available()
+    import multiprocessing
+    from multiprocessing import shared_memory
+    for method in multiprocessing.get_all_start_methods():
+        # unlinking after the workers attached is quiet
+        name, err = _run_pool(method, 'unlink')
+        assert_false(b'Traceback' in err, err)
+        assert_false(b'leaked' in err, err)
+        # the workers leave the owner's registration alone, so the
+        # segment is cleaned up if the owner dies
+        name, err = _run_pool(method, 'exit')
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        shm.close()
+        shm.unlink()
+        raise AssertionError("{} leaked the segment".format(method))
@@ -1,13 +1,22 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import six
+import json
+import struct
+import zlib
 
 from pyRafters.handlers.tiff_handler import (tifffile_read2D_Handler,
-                                                  tifffile_Sink)
+                                             tifffile_read3D_Handler,
+                                             tifffile_sequence_Handler,
+                                             tifffile_Sink)
+from pyRafters.extern import tifffile
 import synthetic_data as sd
-from testing_helpers import namedtmpfile
+from testing_helpers import namedtmpfile, tmpdir
+import os
 import numpy as np
 from numpy.testing import assert_array_equal
+from nose.tools import (assert_false, assert_true, assert_equal,
+                        assert_raises)
 
 
 @namedtmpfile('.tif')
@@ -22,3 +31,473 @@ def test_tiff_int_roundtrip(fname):
         im_ret = src.get_frame(0)
 
     assert_array_equal(test_img, im_ret)
+
+
+@namedtmpfile('.tif')
+def test_tiff_memmap(fname):
+    test_data = sd.random((5, 64, 32), scale=2**16, dtype=np.uint16)
+    tifffile.imsave(fname, test_data)
+
+    with tifffile_read2D_Handler(fname, memmap=True) as src:
+        for j in range(len(test_data)):
+            im_ret = src.get_frame(j)
+            assert_false(im_ret.flags.writeable)
+            assert_array_equal(test_data[j], im_ret)
+
+
+@namedtmpfile('.tif')
+def test_tiff_memmap_fallback(fname):
+    test_data = sd.random((5, 64, 32), scale=2**16, dtype=np.uint16)
+    # compressed pages can not be mapped and are decoded instead
+    tifffile.imsave(fname, test_data, compress=6)
+
+    with tifffile_read2D_Handler(fname, memmap=True) as src:
+        for j in range(len(test_data)):
+            assert_array_equal(test_data[j], src.get_frame(j))
+
+
+@namedtmpfile('.tif')
+def test_tiff_stack_out_of_order(fname):
+    test_data = sd.random((6, 64, 32), scale=2**16, dtype=np.uint16)
+    md = {'exposure': 0.5, 'name': 'sample'}
+    with tifffile_Sink(fname) as snk:
+        snk.set_metadata(md)
+        for j in [3, 0, 5, 1, 4, 2]:
+            snk.record_frame(test_data[j], j)
+
+    with snk.make_source() as src:
+        assert_equal(len(src), len(test_data))
+        for j in range(len(test_data)):
+            assert_array_equal(test_data[j], src.get_frame(j))
+
+    tif = tifffile.TiffFile(fname)
+    try:
+        assert_false(tif.is_bigtiff)
+        desc = tif.pages[0].tags['image_description'].value
+    finally:
+        tif.close()
+    assert_equal(md, json.loads(desc.decode('utf-8')))
+
+
+@namedtmpfile('.tif')
+def test_tiff_frame_md(fname):
+    test_data = sd.random((4, 16, 8), scale=256, dtype=np.uint8)
+    with tifffile_Sink(fname, compress=3) as snk:
+        snk.set_metadata({'name': 'sample'})
+        assert_raises(ValueError, snk.set_metadata, {'frame_md': 1})
+        for j in [2, 0, 3, 1]:
+            snk.record_frame(test_data[j], j,
+                             {'t': j * .5} if j != 3 else None)
+
+    with snk.make_source() as src:
+        assert_equal(src.get_metadata('name'), 'sample')
+        assert_raises(KeyError, src.get_metadata, 'frame_md')
+        for j in range(3):
+            assert_equal(src.get_frame_metadata(j, 't'), j * .5)
+        assert_raises(KeyError, src.get_frame_metadata, 3, 't')
+        assert_array_equal(src.get_frame_metadata_column('t').mask,
+                           [False, False, False, True])
+        assert_array_equal(test_data, [src.get_frame(j) for j in range(4)])
+
+
+@namedtmpfile('.tif')
+def test_tiff_stack_bigtiff(fname):
+    test_data = sd.random((3, 600, 40), scale=1, dtype=np.float32)
+    with tifffile_Sink(fname, bigtiff=True) as snk:
+        for j, img in enumerate(test_data):
+            snk.record_frame(img, j)
+
+    tif = tifffile.TiffFile(fname)
+    try:
+        assert_true(tif.is_bigtiff)
+        assert_array_equal(test_data, tif.asarray())
+    finally:
+        tif.close()
+
+
+@namedtmpfile('.tif')
+def test_tiff_stack_gap(fname):
+    test_img = np.zeros((8, 8), dtype=np.uint8)
+    snk = tifffile_Sink(fname)
+    snk.activate()
+    snk.record_frame(test_img, 0)
+    snk.record_frame(test_img, 2)
+    assert_raises(ValueError, snk.deactivate)
+
+
+@namedtmpfile('.tif')
+def test_tiff_parallel_decode(fname):
+    planar_data = sd.random((7, 3, 40, 30), scale=2**16, dtype=np.uint16)
+    contig_data = np.ascontiguousarray(np.rollaxis(planar_data, 1, 4))
+    for planarconfig, test_data in (('contig', contig_data),
+                                    ('planar', planar_data)):
+        tifffile.imsave(fname, test_data, compress=6,
+                        planarconfig=planarconfig)
+        tif = tifffile.TiffFile(fname)
+        try:
+            for maxworkers in (None, 1, 4):
+                assert_array_equal(test_data,
+                                   tif.asarray(maxworkers=maxworkers))
+            out = np.zeros_like(test_data[2])
+            ret = tif.pages[2].asarray(out=out, maxworkers=4)
+            assert_true(ret is out)
+            assert_array_equal(test_data[2], out)
+        finally:
+            tif.close()
+
+
+def _codec_fallback(name):
+    # the python version is kept as __old_ if the C extension is used
+    return getattr(tifffile, '__old_' + name, getattr(tifffile, name))
+
+
+def _encode_packbits(data, rs):
+    # a valid PackBits stream of randomly sized literal and repeat runs,
+    # repeat runs overwrite `data` to match the stream
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        n = min(rs.randint(1, 129), len(data) - i)
+        if n == 1 or rs.rand() < .5:
+            out.append(n - 1)
+            out += data[i:i+n]
+        else:
+            out.append(257 - n)
+            out += data[i:i+1]
+            data[i:i+n] = data[i:i+1] * n
+        i += n
+    return bytes(out), bytes(data)
+
+
+def test_decodepackbits():
+    decodepackbits = _codec_fallback('decodepackbits')
+    # example from Apple Technical Note TN1023
+    encoded = b'\xfe\xaa\x02\x80\x00\x2a\xfd\xaa\x03\x80\x00\x2a\x22\xf7\xaa'
+    expected = (b'\xaa\xaa\xaa\x80\x00\x2a\xaa\xaa\xaa\xaa\x80\x00'
+                b'\x2a\x22\xaa\xaa\xaa\xaa\xaa\xaa\xaa\xaa\xaa\xaa')
+    assert_equal(expected, decodepackbits(encoded))
+    assert_equal(expected, tifffile._decodepackbits_py(encoded))
+    assert_equal(b'', decodepackbits(b''))
+    # a no-op header and truncated runs
+    assert_equal(b'ab', decodepackbits(b'\x80\x02ab'))
+    assert_equal(b'', decodepackbits(b'\xfd'))
+
+    rs = np.random.RandomState(0)
+    for j in range(200):
+        data = bytearray(rs.randint(0, 4, rs.randint(0, 400)).astype(np.uint8))
+        encoded, expected = _encode_packbits(data, rs)
+        assert_equal(expected, decodepackbits(encoded))
+        assert_equal(expected, tifffile.decodepackbits(encoded))
+        # random, possibly malformed, streams
+        junk = rs.randint(0, 256, rs.randint(0, 60)).astype(np.uint8)
+        assert_equal(tifffile._decodepackbits_py(junk.tobytes()),
+                     decodepackbits(junk.tobytes()))
+
+
+def _unpackints_reference(data, itemsize, runlen):
+    bits = ''.join('{0:08b}'.format(b) for b in bytearray(data))
+    rowbits = runlen * itemsize
+    rowbits += -rowbits % 8
+    out = []
+    for row in range(len(bits) // rowbits):
+        for j in range(runlen):
+            start = row * rowbits + j * itemsize
+            out.append(int(bits[start:start+itemsize], 2))
+    return out
+
+
+def test_unpackints():
+    unpackints = _codec_fallback('unpackints')
+    rs = np.random.RandomState(0)
+    for itemsize in (2, 3, 4, 5, 7, 10, 12, 14, 17, 24, 31):
+        itembytes = next(i for i in (1, 2, 4) if 8 * i >= itemsize)
+        dtype = np.dtype('=u%d' % itembytes)
+        for runlen in (1, 3, 8, 13):
+            data = rs.randint(0, 256, rs.randint(itembytes, 64)).astype(
+                np.uint8).tobytes()
+            result = unpackints(data, dtype, itemsize, runlen)
+            assert_equal(dtype, result.dtype)
+            assert_array_equal(_unpackints_reference(data, itemsize, runlen),
+                               result)
+            assert_array_equal(result,
+                               tifffile.unpackints(data, dtype, itemsize,
+                                                   runlen))
+
+
+@namedtmpfile('.tif')
+def test_tiff_lazy_pages(fname):
+    test_data = sd.random((9, 16, 8), scale=256, dtype=np.uint8)
+    tifffile.imsave(fname, test_data)
+
+    tif = tifffile.TiffFile(fname)
+    try:
+        assert_equal(len(test_data), len(tif))
+        assert_array_equal(test_data[-1], tif[-1].asarray())
+        assert_array_equal(test_data[3], tif.pages[3].asarray())
+        assert_equal(3, tif.pages[3].index)
+        offsets = tif.ifd_offsets
+        assert_equal(len(test_data), len(offsets))
+        assert_raises(IndexError, tif.pages.__getitem__, len(test_data))
+    finally:
+        tif.close()
+
+    # re-use the scan of the IFD chain
+    tif = tifffile.TiffFile(fname, ifd_offsets=offsets[:5])
+    try:
+        assert_equal(5, len(tif))
+        assert_array_equal(test_data[:5], tif.asarray())
+    finally:
+        tif.close()
+
+
+@tmpdir
+def test_tiff_index_cache(index_dir):
+    fname = os.path.join(index_dir, 'stack.tif')
+    test_data = sd.random((6, 32, 16), scale=2**16, dtype=np.uint16)
+    with tifffile.TiffWriter(fname, byteorder='>') as tif:
+        for j, img in enumerate(test_data):
+            tif.save(img)
+    cache_dir = os.path.join(index_dir, 'cache')
+
+    for memmap in (False, True, False):
+        h_in = tifffile_read2D_Handler(fname, memmap=memmap,
+                                       index_cache=cache_dir)
+        with h_in as src:
+            assert_equal(len(test_data), len(src))
+            for j in (4, 0, -1):
+                assert_array_equal(test_data[j], src.get_frame(j))
+        assert_equal(1, len(os.listdir(cache_dir)))
+
+    # the index is not used once the file changes
+    tifffile.imsave(fname, test_data[:5], compress=6)
+    with tifffile_read2D_Handler(fname, index_cache=cache_dir) as src:
+        assert_equal(5, len(src))
+        for j in range(5):
+            assert_array_equal(test_data[j], src.get_frame(j))
+    assert_equal(2, len(os.listdir(cache_dir)))
+
+
+@tmpdir
+def test_tiff_roi(index_dir):
+    fname = os.path.join(index_dir, 'stack.tif')
+    test_data = sd.random((5, 67, 41), scale=2**16, dtype=np.uint16)
+    rois = [(slice(10, 30), slice(5, 17)),
+            (slice(None), slice(None)),
+            (slice(60, None, 3), slice(None, None, 7)),
+            (slice(None, None, -2), slice(3, 9)),
+            (slice(40, 10), slice(None))]
+    for compress in (0, 6, None):
+        if compress is None:
+            # several strips per page
+            with tifffile.TiffWriter(fname, rowsperstrip=8) as tif:
+                for img in test_data:
+                    tif.save(img)
+        else:
+            tifffile.imsave(fname, test_data, compress=compress)
+        for index_cache in (None, os.path.join(index_dir, 'cache')):
+            for memmap in (False, True):
+                h_in = tifffile_read2D_Handler(fname, memmap=memmap,
+                                               index_cache=index_cache)
+                with h_in as src:
+                    for j in (0, 3):
+                        for roi in rois:
+                            assert_array_equal(test_data[j][roi],
+                                               src.get_frame(j, roi=roi))
+
+
+def _write_tiled(fname, img, tile, compress=False, predictor=False):
+    """
+    Write a uint16 image as a single page tiled TIFF, the writer only
+    writes strips
+    """
+    tl, tw = tile
+    length, width = img.shape
+    down, across = -(-length // tl), -(-width // tw)
+    padded = np.zeros((down * tl, across * tw), dtype='<u2')
+    padded[:length, :width] = img
+    tiles = []
+    for y in range(0, down * tl, tl):
+        for x in range(0, across * tw, tw):
+            t = padded[y:y + tl, x:x + tw].copy()
+            if predictor:
+                t[:, 1:] = np.diff(t, axis=1)
+            t = t.tobytes()
+            tiles.append(zlib.compress(t) if compress else t)
+    n = len(tiles)
+    # tag, type (3 short, 4 long), count, value
+    tags = [(256, 4, 1, width), (257, 4, 1, length), (258, 3, 1, 16),
+            (259, 3, 1, 8 if compress else 1), (262, 3, 1, 1),
+            (277, 3, 1, 1), (284, 3, 1, 1), (317, 3, 1, 2 if predictor else 1),
+            (322, 4, 1, tw), (323, 4, 1, tl),
+            (324, 4, n, None), (325, 4, n, None), (339, 3, 1, 1)]
+    ifd_size = 2 + 12 * len(tags) + 4
+    offsets_at = 8 + ifd_size
+    counts_at = offsets_at + 4 * n
+    data_at = counts_at + 4 * n
+    offsets = np.cumsum([data_at] + [len(t) for t in tiles[:-1]])
+    ifd = [struct.pack('<H', len(tags))]
+    for tag, typ, count, value in tags:
+        if tag == 324:
+            value = offsets_at
+        elif tag == 325:
+            value = counts_at
+        if typ == 3:
+            ifd.append(struct.pack('<HHIHH', tag, typ, count, value, 0))
+        else:
+            ifd.append(struct.pack('<HHII', tag, typ, count, value))
+    ifd.append(struct.pack('<I', 0))
+    with open(fname, 'wb') as f:
+        f.write(b'II' + struct.pack('<HI', 42, 8))
+        f.write(b''.join(ifd))
+        f.write(struct.pack('<%dI' % n, *offsets))
+        f.write(struct.pack('<%dI' % n, *[len(t) for t in tiles]))
+        f.write(b''.join(tiles))
+
+
+@namedtmpfile('.tif')
+def test_tiff_roi_tiled(fname):
+    # partial tiles along both edges
+    test_data = sd.random((40, 50), scale=2**16, dtype=np.uint16)
+    rois = [(slice(10, 40), slice(30, 50)),
+            (slice(5, 37, 3), slice(1, 49, 2)),
+            (slice(2, 8), slice(17, 30)),
+            (slice(35, None), slice(47, None)),
+            (slice(None), slice(None))]
+    for kwargs in ({}, {'compress': True},
+                   {'compress': True, 'predictor': True}):
+        _write_tiled(fname, test_data, (16, 16), **kwargs)
+        tif = tifffile.TiffFile(fname)
+        try:
+            page = tif.pages[0]
+            assert_true(page.is_tiled)
+            assert_array_equal(test_data, page.asarray())
+            for roi in rois:
+                assert_array_equal(test_data[roi], page.asarray_region(roi))
+        finally:
+            tif.close()
+        with tifffile_read2D_Handler(fname) as src:
+            for roi in rois:
+                assert_array_equal(test_data[roi], src.get_frame(0, roi=roi))
+
+
+@tmpdir
+def test_tiff_slabs(index_dir):
+    fname = os.path.join(index_dir, 'volume.tif')
+    test_data = sd.random((11, 24, 20), scale=2**16, dtype=np.uint16)
+    tifffile.imsave(fname, test_data, compress=6)
+    y, x = slice(3, 17), slice(None, None, 2)
+    for index_cache in (None, os.path.join(index_dir, 'cache')):
+        with tifffile_read3D_Handler(fname, index_cache=index_cache) as src:
+            assert_equal(1, len(src))
+            assert_equal(len(test_data), src.depth)
+            assert_array_equal(test_data, src.get_frame(0))
+            assert_raises(IndexError, src.get_frame, 1)
+            assert_array_equal(test_data[2:5], src.get_slab(slice(2, 5)))
+            assert_array_equal(test_data[2:9:3, y, x],
+                               src.get_slab(slice(2, 9, 3), y, x))
+            zs = []
+            for z, slab in src.iter_slabs(4, y=y):
+                assert_array_equal(test_data[z, y], slab)
+                zs.append(z)
+            assert_equal([slice(0, 4), slice(4, 8), slice(8, 11)], zs)
+            # single page slabs keep the z axis
+            assert_array_equal(test_data[4:5], src.get_slab(slice(4, 5)))
+            assert_array_equal(test_data[4:5, y, x],
+                               src.get_slab(slice(4, 5), y, x))
+            # a short last slab of one page
+            slabs = [slab for z, slab in src.iter_slabs(5)]
+            assert_equal([5, 5, 1], [len(slab) for slab in slabs])
+            assert_array_equal(test_data, np.concatenate(slabs))
+
+
+@namedtmpfile('.tif')
+def test_tiff_compressed_sink(fname):
+    # pages larger than one strip
+    test_data = sd.random((7, 700, 200), scale=2**12, dtype=np.uint16)
+    for kwargs in ({'compress': 6},
+                   {'compress': 1, 'predictor': True, 'maxworkers': 1},
+                   {'compress': 9, 'codec': 'zlib', 'maxworkers': 3}):
+        with tifffile_Sink(fname, **kwargs) as snk:
+            for j in [2, 0, 1, 6, 5, 3, 4]:
+                img = test_data[j].copy()
+                snk.record_frame(img, j)
+                # the sink must not depend on the caller's buffer
+                img[:] = 0
+
+        tif = tifffile.TiffFile(fname)
+        try:
+            assert_equal('adobe_deflate', tif.pages[0].compression)
+            assert_array_equal(test_data, tif.asarray())
+        finally:
+            tif.close()
+        with tifffile_read2D_Handler(fname) as src:
+            roi = (slice(670, 690), slice(5, 30))
+            assert_array_equal(test_data[3][roi], src.get_frame(3, roi=roi))
+
+    assert_raises(ValueError, tifffile_Sink, fname, compress=3, codec='lzw')
+
+
+@namedtmpfile('.tif')
+def test_tiff_predictor_uncompressed(fname):
+    test_data = sd.random((3, 40, 30), scale=2**12, dtype=np.uint16)
+    with tifffile_Sink(fname, predictor=True) as snk:
+        for j, frame in enumerate(test_data):
+            snk.record_frame(frame, j)
+
+    tif = tifffile.TiffFile(fname)
+    try:
+        assert_equal(None, tif.pages[0].compression)
+        assert_equal(None, tif.pages[0].predictor)
+        assert_array_equal(test_data, tif.asarray())
+        assert_array_equal(test_data, tif.asarray(memmap=True))
+    finally:
+        tif.close()
+    with tifffile_read2D_Handler(fname) as src:
+        for j in range(3):
+            assert_array_equal(test_data[j], src.get_frame(j))
+
+
+@namedtmpfile('.tif')
+def test_tiff_compressed_rgb(fname):
+    test_data = sd.random((2, 30, 20, 3), scale=256, dtype=np.uint8)
+    with tifffile.TiffWriter(fname, compress=6) as tif:
+        for frame in test_data:
+            tif.save(frame)
+    tif = tifffile.TiffFile(fname)
+    try:
+        page = tif.pages[0]
+        # one sample format per sample
+        assert_equal((1, 1, 1), tuple(page.tags['sample_format'].value))
+        assert_array_equal(test_data, tif.asarray())
+    finally:
+        tif.close()
+
+
+@tmpdir
+def test_tiff_sequence(base_path):
+    test_data = sd.random((9, 20, 12), scale=2**16, dtype=np.uint16)
+    for j, img in enumerate(test_data):
+        tifffile.imsave(os.path.join(base_path, 'frame_{:03d}.tif'.format(j)),
+                        img, compress=6 if j % 2 else 0)
+    # files which do not match the pattern
+    tifffile.imsave(os.path.join(base_path, 'frame_1.tif'), test_data[0])
+    tifffile.imsave(os.path.join(base_path, 'dark_000.tif'), test_data[0])
+
+    for readahead in (0, 3):
+        h_in = tifffile_sequence_Handler(base_path, 'frame_{n:03d}.tif',
+                                         readahead=readahead)
+        assert_equal(os.path.join(base_path, 'frame_007.tif'),
+                     h_in.get_fname(7))
+        with h_in as src:
+            assert_equal(len(test_data), len(src))
+            # read twice, the second pass uses the cached headers
+            for k in range(2):
+                for j in (0, 1, 2, 8, 3, -1):
+                    assert_array_equal(test_data[j], src.get_frame(j))
+            assert_array_equal(test_data[2:7:2],
+                               src.get_frames(slice(2, 7, 2)))
+            assert_array_equal(test_data[[5, 1, 1]],
+                               src.get_frames([5, 1, 1]))
+            for img, ret in zip(test_data, src):
+                assert_array_equal(img, ret)
+            assert_raises(IndexError, src.get_frame, len(test_data))
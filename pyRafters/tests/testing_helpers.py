@@ -3,6 +3,7 @@ from __future__ import (absolute_import, division, print_function,
 import six
 from six.moves import range
 import tempfile
+import shutil
 import os
 from functools import wraps
 
@@ -23,3 +24,14 @@ def namedtmpfile(suffix, n=1):
                     os.remove(fname)
         return inner
     return outer
+
+
+def tmpdir(fun):
+    @wraps(fun)
+    def inner():
+        dname = tempfile.mkdtemp()
+        try:
+            fun(dname)
+        finally:
+            shutil.rmtree(dname)
+    return inner
@@ -2,15 +2,55 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import six
+import json
+import uuid
 import inspect
 from six import string_types
-from collections import namedtuple, MutableMapping
+from six.moves import range
+from collections import namedtuple, OrderedDict
+from six.moves.collections_abc import Mapping, MutableMapping
 import h5py
+import numpy as np
 
 md_value = namedtuple("md_value", ['value', 'units'])
 
 
-def _hdf_write_helper(group, md, overwrite=False):
+# leaves up to this size are stored as attributes in compact mode
+_COMPACT_MAX_BYTES = 1024
+# name of the group attribute holding the units of attribute leaves,
+# can not clash with a key as keys never contain the separator
+_UNITS_ATTR = '.units'
+# name of the group attribute holding the token of the last sync with a
+# MD_dict, see `MD_dict.write_hdf`
+_SYNC_ATTR = '.sync'
+
+
+def _is_compact(value):
+    """
+    If a leaf is small and simple enough to be stored as an attribute
+    """
+    if isinstance(value, string_types):
+        return len(value) <= _COMPACT_MAX_BYTES
+    try:
+        arr = np.asarray(value)
+    except Exception:
+        return False
+    return arr.dtype.kind in 'biufcS' and arr.nbytes <= _COMPACT_MAX_BYTES
+
+
+def _decode(val):
+    """
+    Convert bytes read from hdf (h5py >= 3 does not decode) to text
+    """
+    if isinstance(val, bytes):
+        return val.decode('utf-8')
+    if isinstance(val, np.ndarray) and val.dtype.kind == 'O':
+        return np.array([_decode(v) for v in val.ravel()],
+                        dtype=object).reshape(val.shape)
+    return val
+
+
+def _hdf_write_helper(group, md, overwrite=False, compact=False):
     """
     recursive helper function for writing meta-data into DataExchange files
 
@@ -27,27 +67,138 @@ def _hdf_write_helper(group, md, overwrite=False):
        If true, silently overwrite values when a given meta-data entry
        exists, if False raise an exception.  This can result in data being
        partially written.
+
+    compact : bool, optional [False]
+       If true, store small leaves as attributes of `group` with their
+       units collected in one JSON attribute.  Larger leaves are still
+       stored as datasets.
     """
+    units = json.loads(_decode(group.attrs.get(_UNITS_ATTR, '{}')))
+    units_changed = False
     for k, v in six.iteritems(md):
+        if isinstance(v, _LazyLeaf):
+            v = v.load()
         # we have hit a leaf
         if isinstance(v, md_value):
-            if overwrite and k in group:
+            exists = k in group or k in group.attrs
+            if exists and not overwrite:
+                raise ValueError("meta-data entry {!r} exists".format(k))
+            if k in group:
                 del group[k]
+            if k in group.attrs:
+                del group.attrs[k]
+                units_changed |= units.pop(k, None) is not None
+            if compact and _is_compact(v.value):
+                group.attrs[k] = v.value
+                if v.units is not None:
+                    units[k] = v.units
+                    units_changed = True
+                continue
             ds = group.create_dataset(k, data=v.value)
             if v.units is not None:
                 ds.attrs['units'] = v.units
         # else keep recursing down the tree
         else:
-            # TODO re-use existing groups
+            if overwrite:
+                # replace a leaf by a branch
+                if k in group and not isinstance(group[k], h5py.Group):
+                    del group[k]
+                if k in group.attrs:
+                    del group.attrs[k]
+                    units_changed |= units.pop(k, None) is not None
             ng = group.require_group(k)
-            _hdf_write_helper(ng, v._dict)
+            _hdf_write_helper(ng, v._dict, overwrite=overwrite,
+                              compact=compact)
+    if units_changed:
+        if units:
+            group.attrs[_UNITS_ATTR] = json.dumps(units)
+        elif _UNITS_ATTR in group.attrs:
+            del group.attrs[_UNITS_ATTR]
 
 
-def _hdf_read_helper(group, md_dict):
+def _hdf_delete_helper(group, name):
+    """
+    Remove the entry `name` (leaf or branch, in either layout) from group
+    """
+    if name in group:
+        del group[name]
+    if name in group.attrs:
+        del group.attrs[name]
+        units = json.loads(_decode(group.attrs.get(_UNITS_ATTR, '{}')))
+        if units.pop(name, None) is not None:
+            if units:
+                group.attrs[_UNITS_ATTR] = json.dumps(units)
+            else:
+                del group.attrs[_UNITS_ATTR]
+
+
+def _sync_token(group):
+    """
+    The sync token stored in `group`, or None
+    """
+    token = group.attrs.get(_SYNC_ATTR)
+    return None if token is None else _decode(token)
+
+
+def _stamp_sync(group):
+    """
+    Store a new sync token in `group` and return it, None if the file
+    is read-only
+    """
+    if group.file.mode == 'r':
+        return None
+    token = uuid.uuid4().hex
+    group.attrs[_SYNC_ATTR] = token
+    return token
+
+
+def _read_dataset(dset, units):
+    """
+    Read a dataset leaf
+    """
+    val = _decode(dset[...])
+    # if we have a scalar array, convert back to base python type
+    if isinstance(val, np.ndarray) and val.ndim == 0:
+        return md_value(_decode(val.item()), units)
+    # other wise just pass it through
+    return md_value(val, units)
+
+
+class _LazyLeaf(object):
+    """
+    Place holder for a dataset leaf which has not been read yet
+    """
+    __slots__ = ('dset', 'units', 'cache', '_value')
+
+    def __init__(self, dset, units, cache):
+        self.dset = dset
+        self.units = units
+        self.cache = cache
+        self._value = None
+
+    def load(self):
+        if self._value is not None:
+            return self._value
+        if not self.dset.id.valid:
+            raise RuntimeError("the file holding {!r} has been "
+                               "closed".format(self.dset.name))
+        val = _read_dataset(self.dset, self.units)
+        if self.cache:
+            self._value = val
+        return val
+
+    def __repr__(self):
+        if self._value is not None:
+            return repr(self._value)
+        return '<lazy {} {}>'.format(self.dset.shape, self.dset.dtype)
+
+
+def _hdf_read_helper(group, md_dict, lazy=False, cache=True):
     """
     A recursive reader function to extract meta-data from a DateExchange group.
 
-    This operates on the input _in place_.
+    This operates on the input _in place_.  Leaves stored as datasets and
+    as attributes (see `_hdf_write_helper`) are both understood.
 
     Parameters
     ----------
@@ -56,25 +207,39 @@ def _hdf_read_helper(group, md_dict):
 
     md_dict : `MD_dict`
        the `MD_dict` to load the data into
+
+    lazy : bool, optional [False]
+       If true, do not read dataset leaves, put a place holder which
+       reads the dataset when accessed instead
+
+    cache : bool, optional [True]
+       If lazy, keep the values of dataset leaves once read
     """
+    units = json.loads(_decode(group.attrs.get(_UNITS_ATTR, '{}')))
+    for k, val in six.iteritems(group.attrs):
+        if k in (_UNITS_ATTR, _SYNC_ATTR):
+            continue
+        val = _decode(val)
+        if isinstance(val, np.generic):
+            val = val.item()
+        elif isinstance(val, np.ndarray) and val.ndim == 0:
+            val = val.item()
+        md_dict[k] = md_value(val, units.get(k))
     for k in group.keys():
         obj = group[k]
         if isinstance(obj, h5py.Dataset):
             if 'units' in obj.attrs:
-                units = obj.attrs['units']
+                ds_units = _decode(obj.attrs['units'])
             else:
-                units = None
-            val = obj[...]
-            # if we have a scalar array, convert back to base python type
-            if val.ndim == 0:
-                md_dict[k] = md_value(val.item(), units)
-            # other wise just pass it through
+                ds_units = None
+            if lazy:
+                md_dict._add_leaf(k, _LazyLeaf(obj, ds_units, cache),
+                                  touch=False)
             else:
-                md_dict[k] = md_value(val, units)
+                md_dict[k] = _read_dataset(obj, ds_units)
         elif isinstance(obj, h5py.Group):
-            md_dict._dict[k] = MD_dict()
-            _hdf_read_helper(obj, md_dict[k])
-        # else: all objects in an hdf file should be groups or data sets
+            _hdf_read_helper(obj, md_dict._get_branch([k], create=True),
+                             lazy=lazy, cache=cache)
 
 
 def _iter_helper(path_list, split, md_dict):
@@ -82,11 +247,11 @@ def _iter_helper(path_list, split, md_dict):
     Recursively walk the tree and return the names of the leaves
     """
     for k, v in six.iteritems(md_dict):
-        if isinstance(v, md_value):
-            yield split.join(path_list + [k])
-        else:
+        if isinstance(v, MD_dict):
             for inner_v in _iter_helper(path_list + [k], split, v._dict):
                 yield inner_v
+        else:
+            yield split.join(path_list + [k])
 
 
 class MD_dict(MutableMapping):
@@ -121,99 +286,327 @@ class MD_dict(MutableMapping):
     >>> tt2 = MD_dict.read_hdf_group(F['meta_data'])
     >>> tt['name'] == tt2['name']
     True
+
+    Leaves are kept in a flat index by full path as well as in the tree,
+    so getting, setting, and membership tests do not walk the tree.
+    Branches are live views of the part of the tree below them:
+
+    >>> nested = tt.subtree('nested')
+    >>> nested['a'].value
+    2
     """
     def __init__(self, md_dict=None):
-        # TODO properly walk the input on upgrade dicts -> MD_dict
-        if md_dict is None:
-            md_dict = dict()
-
-        self._dict = md_dict
+        self._dict = dict()
         self._split = '.'
+        # the root node holds the flat indices, branches point at the
+        # root and know their path in the tree
+        self._root = self
+        self._parent = None
+        self._prefix = ''
+        # full key -> leaf, full path -> branch node
+        self._index = dict()
+        self._branches = dict()
+        # number of leaves below this node
+        self._count = 0
+        # change tracking, only used on the root node
+        self._version = 0
+        # full key -> version of the last change, in order of the version
+        self._changes = OrderedDict()
+        # sync token -> version last written to/read from that group
+        self._synced = dict()
+
+        if md_dict is not None:
+            self._update_from('', md_dict)
+
+    def _update_from(self, prefix, md):
+        """
+        Copy the leaves of a (possibly nested) mapping in
+        """
+        if isinstance(md, MD_dict):
+            for k in md:
+                self[prefix + k] = md[k]
+            return
+        for k, v in six.iteritems(md):
+            if isinstance(v, Mapping):
+                self._update_from(prefix + k + self._split, v)
+            else:
+                self[prefix + k] = v
 
     def __repr__(self):
         return self._dict.__repr__()
 
-    # overload __setitem__ so dotted paths work
-    def __setitem__(self, key, val):
+    def _new_branch(self, name):
+        """
+        Return an empty node to hang below this one as `name`
+        """
+        node = type(self)()
+        node._root = self._root
+        node._parent = self
+        node._prefix = self._prefix + name + self._split
+        return node
 
-        key_split = key.split(self._split)
-        tmp = self._dict
-        for k in key_split[:-1]:
-            try:
-                tmp = tmp[k]._dict
-            except:
-                tmp[k] = type(self)()
-                tmp = tmp[k]._dict
-            if isinstance(tmp, md_value):
-                # TODO make message better
+    def _touch(self, key):
+        """
+        Record that `key` (relative to this node) was set or deleted
+        """
+        root = self._root
+        root._version += 1
+        key = self._prefix + key
+        root._changes.pop(key, None)
+        root._changes[key] = root._version
+
+    def _get_branch(self, path, create=False):
+        """
+        Return the node at `path` (a list of keys relative to this
+        node), or None if it does not exist and `create` is False
+        """
+        if not path:
+            return self
+        node = self._root._branches.get(self._prefix +
+                                        self._split.join(path))
+        if node is not None or not create:
+            return node
+        node = self
+        for j, k in enumerate(path):
+            child = node._dict.get(k)
+            if child is None:
+                child = node._new_branch(k)
+                node._dict[k] = child
+                self._root._branches[child._prefix[:-1]] = child
+                self._touch(self._split.join(path[:j + 1]))
+            elif not isinstance(child, MD_dict):
                 raise KeyError("trying to use a leaf node as a branch")
+            node = child
+        return node
 
-        # if passed in an md_value, set it and return
+    def _add_leaf(self, key, leaf, touch=True):
+        """
+        Put `leaf` at `key` (relative to this node)
+        """
+        key_split = key.split(self._split)
+        parent = self._get_branch(key_split[:-1], create=True)
+        name = key_split[-1]
+        if isinstance(parent._dict.get(name), MD_dict):
+            # a leaf replaces a whole branch
+            parent._remove(name)
+        is_new = name not in parent._dict
+        parent._dict[name] = leaf
+        self._root._index[parent._prefix + name] = leaf
+        if is_new:
+            parent._add_count(1)
+        if touch:
+            self._touch(key)
+
+    def _add_count(self, n):
+        node = self
+        while node is not None:
+            node._count += n
+            node = node._parent
+
+    def _remove(self, name):
+        """
+        Remove the leaf or branch `name` directly below this node
+        """
+        root = self._root
+        child = self._dict.pop(name)
+        full = self._prefix + name
+        if isinstance(child, MD_dict):
+            for k in _iter_helper([], self._split, child._dict):
+                del root._index[child._prefix + k]
+            stack = [child]
+            while stack:
+                node = stack.pop()
+                del root._branches[node._prefix[:-1]]
+                stack.extend(v for v in six.itervalues(node._dict)
+                             if isinstance(v, MD_dict))
+            n = child._count
+        else:
+            del root._index[full]
+            n = 1
+        self._add_count(-n)
+
+    # overload __setitem__ so dotted paths work
+    def __setitem__(self, key, val):
+        # if passed in an md_value, use it as is
         if isinstance(val, md_value):
-            tmp[key_split[-1]] = val
-            return
+            leaf = val
         # catch the case of a bare string
         elif isinstance(val, string_types):
             # a value with out units
-            tmp[key_split[-1]] = md_value(val, 'text')
-            return
+            leaf = md_value(val, 'text')
         # not something easy, try to guess what to do instead
-        try:
-            # if the second element is a string or None, cast to named tuple
-            if isinstance(val[1], string_types) or val[1] is None:
-                print('here')
-                tmp[key_split[-1]] = md_value(*val)
-            # else, assume whole thing is the value with no units
-            else:
-                tmp[key_split[-1]] = md_value(val, None)
-        # catch any type errors from trying to index into non-indexable things
-        # or from trying to use iterables longer than 2
-        except TypeError:
-            tmp[key_split[-1]] = md_value(val, None)
-
-    def __getitem__(self, key):
-        key_split = key.split(self._split)
-        tmp = self._dict
-        for k in key_split[:-1]:
+        else:
             try:
-                tmp = tmp[k]._dict
-            except:
-                tmp[k] = type(self)()
-                tmp = tmp[k]._dict
+                # if the second element is a string or None, cast to
+                # named tuple
+                if isinstance(val[1], string_types) or val[1] is None:
+                    leaf = md_value(*val)
+                # else, assume whole thing is the value with no units
+                else:
+                    leaf = md_value(val, None)
+            # catch any type errors from trying to index into
+            # non-indexable things or from trying to use iterables
+            # longer than 2
+            except TypeError:
+                leaf = md_value(val, None)
+        self._add_leaf(key, leaf)
 
-            if isinstance(tmp, md_value):
-                # TODO make message better
-                raise KeyError("trying to use a leaf node as a branch")
+    def __getitem__(self, key):
+        full = self._prefix + key
+        root = self._root
+        try:
+            return root._index[full]
+        except KeyError:
+            pass
+        try:
+            return root._branches[full]
+        except KeyError:
+            raise KeyError(key)
 
-        return tmp.get(key_split[-1], None)
+    def __contains__(self, key):
+        full = self._prefix + key
+        return full in self._root._index or full in self._root._branches
 
     def __delitem__(self, key):
-        # pass one delete the entry
-        # TODO make robust to non-keys
         key_split = key.split(self._split)
-        tmp = self._dict
-        for k in key_split[:-1]:
-            # make sure we are grabbing the internal dict
-            tmp = tmp[k]._dict
-        del tmp[key_split[-1]]
-        # TODO pass 2 remove empty branches
+        parent = self._get_branch(key_split[:-1])
+        if parent is None or key_split[-1] not in parent._dict:
+            raise KeyError(key)
+        parent._remove(key_split[-1])
+        self._touch(key)
+        # TODO remove empty branches
+
+    def _find(self, key):
+        """
+        Return the node or leaf at `key` or None, with out reading lazy
+        values
+        """
+        full = self._prefix + key
+        leaf = self._root._index.get(full)
+        if leaf is not None:
+            return leaf
+        return self._root._branches.get(full)
+
+    def subtree(self, prefix):
+        """
+        Return a live view of the meta-data below `prefix`.
+
+        Keys of the view are relative to `prefix`, setting and deleting
+        through the view changes this MD_dict.
+
+        Parameters
+        ----------
+        prefix : str
+            Dotted path of a branch
+
+        Returns
+        -------
+        view : MD_dict
+        """
+        node = self._get_branch(prefix.split(self._split))
+        if node is None:
+            raise KeyError(prefix)
+        return node
 
     def __len__(self):
-        return len(list(iter(self)))
+        return self._count
 
     def __iter__(self):
+        if self._root is self:
+            return iter(self._index)
         return _iter_helper([], self._split, self._dict)
 
-    def write_hdf(self, group):
+    def write_hdf(self, group, overwrite=False, compact=False,
+                  incremental=False):
         """
         Writes out this MD structure to a hdf file.
 
+        Each write leaves a random token in the group.  With
+        ``incremental=True``, if the token in `group` is the one this
+        `MD_dict` left when it last wrote to (or read from) it, only the
+        keys which were set or deleted since then are written.  Any
+        other group, including a new file at the same path, gets the
+        whole tree.
+
         Parameters
         ----------
         group : `~h5py.Group`
            Open group to write meta-data into
+
+        overwrite : bool, optional
+           Replace existing entries instead of raising
+
+        compact : bool, optional
+           Store scalars and other small leaves as attributes instead
+           of one dataset each, much faster to write and smaller on
+           disk for many small entries.  `read_hdf_group` reads both
+           layouts.
+
+        incremental : bool, optional
+           Only write the changes since the last sync with `group`
+        """
+        root = self._root
+        token = _sync_token(group)
+        if (incremental and root is self and token is not None and
+                token in self._synced):
+            self._write_changes(group, self._synced.pop(token), compact)
+        else:
+            _hdf_write_helper(group, self._dict, overwrite=overwrite,
+                              compact=compact)
+        if root is self:
+            token = _stamp_sync(group)
+            if token is not None:
+                self._synced[token] = self._version
+
+    def _write_changes(self, group, since, compact):
+        """
+        Write the keys changed after version `since` into `group`
         """
-        _hdf_write_helper(group, self._dict)
+        changed = []
+        for key in reversed(self._changes):
+            if self._changes[key] <= since:
+                break
+            changed.append(key)
+        changed = set(changed)
+        # parent path -> {name: leaf or node}
+        to_write = dict()
+        for key in changed:
+            path = key.split(self._split)
+            # a new branch is written in full with its contents
+            if any(self._split.join(path[:j]) in changed and
+                   isinstance(self._find(self._split.join(path[:j])),
+                              MD_dict)
+                   for j in range(1, len(path))):
+                continue
+            parent = '/'.join(path[:-1])
+            val = self._find(key)
+            if val is None or isinstance(val, MD_dict):
+                # a replaced branch must not keep the old children
+                if not parent or parent in group:
+                    _hdf_delete_helper(group[parent] if parent else group,
+                                       path[-1])
+                if val is None:
+                    continue
+            to_write.setdefault(parent, dict())[path[-1]] = val
+        for parent, md in six.iteritems(to_write):
+            g = group.require_group(parent) if parent else group
+            _hdf_write_helper(g, md, overwrite=True, compact=compact)
+
+    def mark_synced(self, group):
+        """
+        Record that `group` holds the current state of this MD_dict,
+        the next incremental `write_hdf` to it only writes later
+        changes.  Nothing is recorded for groups in read-only files.
+
+        Parameters
+        ----------
+        group : `~h5py.Group`
+        """
+        token = _sync_token(group)
+        if token is None:
+            token = _stamp_sync(group)
+        if token is not None:
+            self._root._synced[token] = self._root._version
 
     @classmethod
     def read_hdf_group(cls, group):
@@ -227,9 +620,337 @@ class MD_dict(MutableMapping):
         """
         self = cls()
         _hdf_read_helper(group, self)
+        self.mark_synced(group)
         return self
 
 
+class LazyMD_dict(MD_dict):
+    """
+    A `MD_dict` which reads the values stored in datasets on demand.
+
+    `read_hdf_group` only reads the key tree, the units, and the small
+    values stored as attributes.  Values stored as datasets are read
+    the first time they are accessed, so the group must stay open
+    until then.
+
+    >>> tt = LazyMD_dict.read_hdf_group(F['meta_data'])
+    >>> tt['name'].value  # read from the file here
+    'test'
+    """
+    def __init__(self, md_dict=None, cache=True):
+        """
+        Parameters
+        ----------
+        md_dict : dict or None
+            initial contents
+
+        cache : bool, optional
+            keep values once they are read, if False every access reads
+            the file again
+        """
+        super(LazyMD_dict, self).__init__(md_dict)
+        self._cache = cache
+
+    def _new_branch(self, name):
+        node = super(LazyMD_dict, self)._new_branch(name)
+        node._cache = self._cache
+        return node
+
+    def __getitem__(self, key):
+        val = super(LazyMD_dict, self).__getitem__(key)
+        if isinstance(val, _LazyLeaf):
+            val = val.load()
+        return val
+
+    @classmethod
+    def read_hdf_group(cls, group, cache=True):
+        """
+        Contruct a LazyMD_dict from a group in an hdf file
+
+        Parameters
+        ----------
+        group : `h5py.Group`
+            An open and valid group, it must stay open until the values
+            have been read
+
+        cache : bool, optional
+            keep values once they are read
+        """
+        self = cls(cache=cache)
+        _hdf_read_helper(group, self, lazy=True, cache=cache)
+        self.mark_synced(group)
+        return self
+
+
+def _column_dtype(value):
+    """
+    The dtype of a typed column which can hold `value`, None if it
+    needs an object column
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return np.dtype(bool)
+    if isinstance(value, (six.integer_types, float, complex, np.number)):
+        return np.asarray(value).dtype
+    return None
+
+
+class FrameMDStore(object):
+    """
+    Column-wise store of frame-level meta-data.
+
+    Each key is kept as a numpy array with one entry per frame and a
+    mask of which frames have a value.  Numeric and boolean values go
+    in typed columns which are promoted within their kind (wider ints,
+    wider floats) as needed.  Anything else, or a mix of kinds, goes
+    in an object column.  Pulling one key out for all frames
+    (`column`) is a single array operation instead of a loop over
+    per-frame dicts.
+    """
+    def __init__(self, n_frames=0):
+        """
+        Parameters
+        ----------
+        n_frames : int, optional
+            Number of frames to start with, all with out meta-data
+        """
+        self._len = int(n_frames)
+        self._capacity = max(self._len, 1)
+        # key -> values, key -> mask of frames which have a value
+        self._values = dict()
+        self._present = dict()
+
+    @classmethod
+    def from_dicts(cls, frame_md):
+        """
+        Build a store from a sequence with a dict (or None) per frame
+        """
+        if isinstance(frame_md, cls):
+            return frame_md
+        frame_md = list(frame_md)
+        self = cls(len(frame_md))
+        columns = dict()
+        for n, md in enumerate(frame_md):
+            for k, v in six.iteritems(md or {}):
+                columns.setdefault(k, ([], []))
+                columns[k][0].append(n)
+                columns[k][1].append(v)
+        for k, (frames, vals) in six.iteritems(columns):
+            self.set_column(k, vals, frames)
+        return self
+
+    def __len__(self):
+        return self._len
+
+    def keys(self):
+        """
+        The keys which any frame has a value for
+        """
+        return list(self._values)
+
+    def _grow(self, n_frames):
+        """
+        Make sure there is room for `n_frames` frames
+        """
+        if n_frames > self._len:
+            self._len = n_frames
+        if n_frames <= self._capacity:
+            return
+        self._capacity = max(n_frames, 2 * self._capacity)
+        for k in self._values:
+            vals = self._values[k]
+            new = np.zeros(self._capacity, dtype=vals.dtype)
+            new[:len(vals)] = vals
+            self._values[k] = new
+            present = np.zeros(self._capacity, dtype=bool)
+            present[:len(vals)] = self._present[k]
+            self._present[k] = present
+
+    def _column_for(self, key, dtype):
+        """
+        Return the values of `key`, created or promoted to hold `dtype`
+        """
+        vals = self._values.get(key)
+        if vals is None:
+            vals = np.zeros(self._capacity,
+                            dtype=dtype if dtype is not None else object)
+            self._values[key] = vals
+            self._present[key] = np.zeros(self._capacity, dtype=bool)
+            return vals
+        if vals.dtype == object:
+            return vals
+        if dtype is None or dtype.kind != vals.dtype.kind:
+            # mixing kinds (bool and float, int and float, ...) would
+            # change or lose values, fall back to python objects
+            new_dtype = np.dtype(object)
+        else:
+            new_dtype = np.promote_types(vals.dtype, dtype)
+        if new_dtype != vals.dtype:
+            if new_dtype == object:
+                # keep python scalars in object columns
+                vals = np.array(vals.tolist(), dtype=object)
+            else:
+                vals = vals.astype(new_dtype)
+            self._values[key] = vals
+        return vals
+
+    def set_frame(self, frame_num, md):
+        """
+        Set the meta-data of one frame
+
+        Parameters
+        ----------
+        frame_num : int
+            The frame
+
+        md : dict or None
+            The meta-data, keys not in `md` are left alone
+        """
+        if frame_num < 0:
+            raise ValueError("frame_num must be non-negative")
+        self._grow(frame_num + 1)
+        for k, v in six.iteritems(md or {}):
+            vals = self._column_for(k, _column_dtype(v))
+            vals[frame_num] = v
+            self._present[k][frame_num] = True
+
+    def set_column(self, key, values, frame_nums=None):
+        """
+        Set the value of `key` for many frames at once
+
+        Parameters
+        ----------
+        key : str
+            The meta-data key
+
+        values : array-like
+            One value per frame
+
+        frame_nums : array-like of int or None, optional
+            The frames to set, if None the frames following the last
+            frame (append)
+        """
+        if frame_nums is None:
+            frame_nums = np.arange(self._len, self._len + len(values))
+        frame_nums = np.asarray(frame_nums, dtype=np.intp)
+        if len(frame_nums) == 0:
+            return
+        if frame_nums.min() < 0:
+            raise ValueError("frame numbers must be non-negative")
+        if isinstance(values, np.ndarray):
+            arr = values
+        else:
+            values = list(values)
+            dtypes = [_column_dtype(v) for v in values]
+            # only build a typed column if numpy would not have to
+            # convert between kinds
+            if (any(dt is None for dt in dtypes) or
+                    len(set(dt.kind for dt in dtypes)) > 1):
+                arr = np.empty(0, dtype=object)
+            else:
+                arr = np.asarray(values)
+        if arr.ndim != 1 or arr.dtype.kind not in 'biufc':
+            # not a plain numeric column, store the values as objects
+            values = list(values)
+            arr = np.empty(len(values), dtype=object)
+            for j, v in enumerate(values):
+                arr[j] = v
+        if len(arr) != len(frame_nums):
+            raise ValueError("need one value per frame")
+        self._grow(int(frame_nums.max()) + 1)
+        vals = self._column_for(key, arr.dtype)
+        vals[frame_nums] = arr
+        self._present[key][frame_nums] = True
+
+    def get(self, frame_num, key):
+        """
+        The value of `key` for one frame, raise KeyError if not set
+        """
+        if frame_num < 0:
+            frame_num += self._len
+        if not 0 <= frame_num < self._len:
+            raise IndexError("frame {} out of range".format(frame_num))
+        try:
+            present = self._present[key][frame_num]
+        except KeyError:
+            raise KeyError(key)
+        if not present:
+            raise KeyError(key)
+        val = self._values[key][frame_num]
+        if isinstance(val, np.generic):
+            val = val.item()
+        return val
+
+    def column(self, key):
+        """
+        The values of `key` for all frames.
+
+        Returns
+        -------
+        values : ndarray or MaskedArray
+            A masked array if some frames have no value
+        """
+        try:
+            vals = self._values[key][:self._len]
+        except KeyError:
+            raise KeyError(key)
+        present = self._present[key][:self._len]
+        if present.all():
+            return vals.copy()
+        return np.ma.MaskedArray(vals, mask=~present, copy=True)
+
+    def frame_dict(self, frame_num):
+        """
+        The meta-data of one frame as a dict
+        """
+        out = dict()
+        for k in self._values:
+            try:
+                out[k] = self.get(frame_num, k)
+            except KeyError:
+                pass
+        return out
+
+    def to_dicts(self):
+        """
+        The meta-data as a list with a dict per frame
+        """
+        return [self.frame_dict(n) for n in range(self._len)]
+
+    def __getitem__(self, frame_num):
+        return self.frame_dict(frame_num)
+
+    def __iter__(self):
+        for n in range(self._len):
+            yield self.frame_dict(n)
+
+    def copy(self):
+        """
+        Return an independent copy of the store
+        """
+        new = type(self).__new__(type(self))
+        new.__setstate__(self.__getstate__())
+        return new
+
+    def __getstate__(self):
+        # drop the spare capacity
+        return {'n_frames': self._len,
+                'values': dict((k, v[:self._len])
+                               for k, v in six.iteritems(self._values)),
+                'present': dict((k, v[:self._len])
+                                for k, v in six.iteritems(self._present))}
+
+    def __setstate__(self, state):
+        self._len = state['n_frames']
+        self._capacity = max(self._len, 1)
+        self._values = dict()
+        self._present = dict()
+        for k, v in six.iteritems(state['values']):
+            self._values[k] = np.resize(v, self._capacity)
+            self._present[k] = np.resize(state['present'][k],
+                                         self._capacity)
+            self._present[k][self._len:] = False
+
+
 def all_subclasses(in_c, sc_lst):
     t = in_c.__subclasses__()
     if len(t) > 0:
@@ -62,8 +62,11 @@ setup(
     name='pyRafters',
     version=FULLVERSION,
     author='Brookhaven National Lab',
-    ext_modules=[Extension('_tifffile', ['pyRafters/extern/tifffile.c'],
-    include_dirs=[numpy.get_include()])],
+    # optional, tifffile falls back to python codecs if it fails to build
+    ext_modules=[Extension('pyRafters.extern._tifffile',
+                           ['pyRafters/extern/tifffile.c'],
+                           include_dirs=[numpy.get_include()],
+                           optional=True)],
     url="https://github.com/NSLS-II/pyRafters",  # noqa
     packages=['pyRafters',
               'pyRafters.handlers',